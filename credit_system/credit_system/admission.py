@@ -0,0 +1,273 @@
+"""
+Admission control and load shedding.
+
+``AdmissionControlMiddleware`` applies two limits to the endpoints listed in
+``ADMISSION_LIMITS``, keyed by URL name:
+
+- ``concurrency`` caps the endpoint's requests in flight across every worker.
+  Requests beyond it get ``503`` with ``Retry-After`` at once, instead of queueing
+  for a database connection that ``/create-loan/`` also needs.
+- ``rate`` and ``burst`` make a token bucket per client: ``rate`` requests a
+  second, with bursts of up to ``burst``. A client over its rate gets ``429`` with
+  ``Retry-After`` set to when its next token is due.
+
+State lives in Redis (``ADMISSION_REDIS_URL``), so the limits hold across workers,
+or in the process with ``ADMISSION_BACKEND = 'local'``. A concurrency slot in Redis
+is a lease of ``ADMISSION_LEASE_SECONDS``, so slots held by a worker that died are
+freed. Requests are admitted when Redis cannot be reached, after at most
+``ADMISSION_REDIS_TIMEOUT`` seconds. Admitted and shed counts per endpoint are
+exported on ``/metrics``.
+"""
+
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.http import JsonResponse
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Local buckets kept before the full ones are dropped
+MAX_LOCAL_BUCKETS = 10_000
+
+# KEYS[1]: sorted set of slot leases; ARGV: now, lease seconds, limit, slot ID
+ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[1]) - tonumber(ARGV[2]))
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# KEYS[1]: bucket hash; ARGV: rate, burst, now. Returns the seconds until a token is due, 0 if one was taken
+TAKE_SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class LocalBackend:
+    """Limits kept in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = Counter()
+        self.buckets = {}  # key: (tokens, updated, full_at)
+
+    def acquire(self, endpoint, limit):
+        """A slot for ``endpoint``, or None when ``limit`` are in flight"""
+        with self._lock:
+            if self.in_flight[endpoint] >= limit:
+                return None
+            self.in_flight[endpoint] += 1
+            return endpoint
+
+    def release(self, endpoint, slot):
+        with self._lock:
+            self.in_flight[endpoint] -= 1
+
+    def take(self, key, rate, burst):
+        """Take a token from ``key``'s bucket; returns 0, or the seconds until one is due"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self.buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            if key not in self.buckets and len(self.buckets) >= MAX_LOCAL_BUCKETS:
+                self.buckets = {k: v for k, v in self.buckets.items() if v[2] > now}
+            self.buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            return wait
+
+
+class RedisBackend:
+    """Limits shared by every worker through Redis"""
+
+    def __init__(self, url, lease_seconds, timeout):
+        if redis is None:
+            raise ImproperlyConfigured('ADMISSION_BACKEND = "redis" needs the redis package')
+        # Short timeouts, so requests fail open quickly rather than wait on a Redis that is down
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.lease_seconds = lease_seconds
+        self.acquire_script = self.client.register_script(ACQUIRE_SCRIPT)
+        self.take_script = self.client.register_script(TAKE_SCRIPT)
+
+    def acquire(self, endpoint, limit):
+        slot = uuid.uuid4().hex
+        admitted = self.acquire_script(
+            keys=[f'admission:slots:{endpoint}'], args=[time.time(), self.lease_seconds, limit, slot],
+        )
+        return slot if admitted else None
+
+    def release(self, endpoint, slot):
+        self.client.zrem(f'admission:slots:{endpoint}', slot)
+
+    def take(self, key, rate, burst):
+        return float(self.take_script(keys=[f'admission:bucket:{key}'], args=[rate, burst, time.time()]))
+
+
+def get_backend():
+    if settings.ADMISSION_BACKEND == 'local':
+        return LocalBackend()
+    if settings.ADMISSION_BACKEND == 'redis':
+        return RedisBackend(
+            settings.ADMISSION_REDIS_URL, settings.ADMISSION_LEASE_SECONDS, settings.ADMISSION_REDIS_TIMEOUT,
+        )
+    raise ImproperlyConfigured(f'Unknown ADMISSION_BACKEND {settings.ADMISSION_BACKEND!r}')
+
+
+class AdmissionStats:
+    """Process-wide counts of admitted and shed requests, per endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.admitted = Counter()
+            self.shed = Counter()  # (endpoint, reason)
+            self.errors = 0
+
+    def count(self, endpoint, reason=None):
+        with self._lock:
+            if reason is None:
+                self.admitted[endpoint] += 1
+            else:
+                self.shed[endpoint, reason] += 1
+
+    def count_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def render(self):
+        """The counters in the Prometheus text format"""
+        with self._lock:
+            lines = ['# HELP admission_admitted_total Requests to limited endpoints that were admitted',
+                     '# TYPE admission_admitted_total counter']
+            lines += [f'admission_admitted_total{{endpoint="{endpoint}"}} {count}'
+                      for endpoint, count in sorted(self.admitted.items())]
+            lines += ['# HELP admission_shed_total Requests shed, by reason (rate or concurrency)',
+                      '# TYPE admission_shed_total counter']
+            lines += [f'admission_shed_total{{endpoint="{endpoint}",reason="{reason}"}} {count}'
+                      for (endpoint, reason), count in sorted(self.shed.items())]
+            lines += ['# HELP admission_backend_errors_total Requests admitted because the backend failed',
+                      '# TYPE admission_backend_errors_total counter',
+                      f'admission_backend_errors_total {self.errors}']
+        return lines
+
+
+stats = AdmissionStats()
+
+
+def client_id(request):
+    """The client a request is rate limited as"""
+    if settings.ADMISSION_CLIENT_HEADER:
+        forwarded = request.headers.get(settings.ADMISSION_CLIENT_HEADER, '')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def shed(status, message, retry_after):
+    return JsonResponse({'error': message}, status=status, headers={'Retry-After': str(retry_after)})
+
+
+class AdmissionControlMiddleware:
+    """Shed requests over their endpoint's limits; see the module docstring
+
+    With ``ADMISSION_CONTROL_ENABLED`` off, or no limits, the middleware raises
+    ``MiddlewareNotUsed`` and is dropped from the stack.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.ADMISSION_CONTROL_ENABLED or not settings.ADMISSION_LIMITS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.limits = settings.ADMISSION_LIMITS
+        self.backend = get_backend()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        try:
+            return self.get_response(request)
+        finally:
+            self.release(request)
+
+    async def __acall__(self, request):
+        try:
+            return await self.get_response(request)
+        finally:
+            self.release(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        endpoint = request.resolver_match.url_name
+        limits = self.limits.get(endpoint)
+        if limits is None:
+            return None
+        try:
+            # The slot comes first, so a request shed for concurrency does not spend
+            # one of the client's tokens
+            if 'concurrency' in limits:
+                slot = self.backend.acquire(endpoint, limits['concurrency'])
+                if slot is None:
+                    stats.count(endpoint, 'concurrency')
+                    return shed(503, 'Server busy, retry later', settings.ADMISSION_RETRY_AFTER)
+                request._admission_slot = (endpoint, slot)
+            if 'rate' in limits:
+                wait = self.backend.take(f'{endpoint}:{client_id(request)}', limits['rate'],
+                                         limits.get('burst', limits['rate']))
+                if wait:
+                    self.release(request)
+                    stats.count(endpoint, 'rate')
+                    return shed(429, 'Too many requests, retry later', math.ceil(wait))
+        except Exception:
+            # Fail open: an unreachable limiter must not take the endpoint down with it
+            logger.warning('Admission control unavailable, admitting %s', request.path, exc_info=True)
+            stats.count_error()
+        stats.count(endpoint)
+        return None
+
+    def release(self, request):
+        held = getattr(request, '_admission_slot', None)
+        if held is None:
+            return
+        del request._admission_slot
+        try:
+            self.backend.release(*held)
+        except Exception:
+            logger.warning('Could not release admission slot of %s', held[0], exc_info=True)
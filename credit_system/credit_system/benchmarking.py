@@ -0,0 +1,260 @@
+"""
+Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks run against a throwaway test database so they never touch real data.
+"""
+
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_databases, teardown_databases
+from django.urls import Resolver404, resolve, reverse
+from credit_system.loadtest import summarize_samples
+from customers.importing import normalize_columns
+from customers.models import Customer
+from customers.tasks import build_customers
+from loans.models import CustomerCreditProfile, Loan
+from loans.tasks import build_loans
+
+
+@contextmanager
+def throwaway_database():
+    """Run the block against a freshly created and migrated test database
+
+    Admission control is off in the block, as the benchmarks send bursts from one
+    client on purpose.
+    """
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        with override_settings(ADMISSION_CONTROL_ENABLED=False):
+            yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+def bench_client():
+    """In-process test client that passes the default ALLOWED_HOSTS check"""
+    return Client(HTTP_HOST='localhost')
+
+
+def timed(func, *args, **kwargs):
+    """Call ``func`` and return ``(result, elapsed_seconds)``"""
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def sample_customer_frame(count, seed=0):
+    """Generate customers with the column names of customer_data.xlsx"""
+    rng = np.random.default_rng(seed)
+    salaries = rng.integers(20, 300, count) * 1000
+    return pd.DataFrame({
+        'Customer ID': np.arange(1, count + 1),
+        'First Name': 'First',
+        'Last Name': 'Last',
+        'Age': rng.integers(21, 65, count),
+        'Phone Number': rng.integers(9000000000, 9999999999, count),
+        'Monthly Salary': salaries,
+        'Approved Limit': np.round(salaries * 36 / 100000) * 100000,
+    })
+
+
+def sample_loan_frame(count, customer_count, seed=0):
+    """Generate loans with the column names of loan_data.xlsx"""
+    rng = np.random.default_rng(seed)
+    tenures = rng.integers(6, 120, count)
+    start_dates = pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 3650, count), unit='D')
+    return pd.DataFrame({
+        'Customer ID': rng.integers(1, customer_count + 1, count),
+        'Loan ID': np.arange(1, count + 1),
+        'Loan Amount': rng.integers(10, 1000, count) * 1000,
+        'Tenure': tenures,
+        'Interest Rate': np.round(rng.uniform(8, 20, count), 2),
+        'Monthly payment': rng.integers(1000, 50000, count),
+        'EMIs paid on Time': rng.integers(0, tenures + 1),
+        'Date of Approval': start_dates,
+        'End Date': start_dates + pd.to_timedelta(tenures * 30, unit='D'),
+    })
+
+
+def seed_database(customer_count, loan_count, seed=0):
+    """Bulk insert generated customers and loans and build their credit profiles"""
+    customers = sample_customer_frame(customer_count, seed)
+    customers.columns = normalize_columns(customers.columns)
+    Customer.objects.bulk_create(build_customers(customers), batch_size=1000)
+
+    loans = sample_loan_frame(loan_count, customer_count, seed)
+    loans.columns = normalize_columns(loans.columns)
+    Loan.objects.bulk_create(build_loans(loans), batch_size=1000)
+
+    for _ in CustomerCreditProfile.rebuild_in_chunks(Customer.objects.all(), 1000):
+        pass
+
+
+def concurrent_create_loans(customer_id, attempts, workers, loan_amount, interest_rate='20', tenure=12):
+    """POST ``attempts`` identical /create-loan/ requests for one customer from ``workers`` threads
+
+    Every thread uses its own client and database connection and all start together.
+    Returns ``(Counter of status codes, elapsed_seconds)``.
+    """
+    payload = {
+        'customer_id': customer_id,
+        'loan_amount': str(loan_amount),
+        'interest_rate': str(interest_rate),
+        'tenure': tenure,
+    }
+    url = reverse('create_loan')
+    start = threading.Barrier(workers + 1)
+
+    def worker(count):
+        client = bench_client()
+        start.wait()
+        try:
+            return [client.post(url, payload, content_type='application/json').status_code for _ in range(count)]
+        finally:
+            connection.close()
+
+    shares = [attempts // workers + (index < attempts % workers) for index in range(workers)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(worker, share) for share in shares]
+        start.wait()
+        started = time.perf_counter()
+        codes = Counter(code for future in futures for code in future.result())
+        return codes, time.perf_counter() - started
+
+
+# Share of each endpoint in the synthetic traffic mix
+TRAFFIC_MIX = {
+    'register': 0.10,
+    'check-eligibility': 0.40,
+    'create-loan': 0.10,
+    'view-loan': 0.20,
+    'view-loans': 0.20,
+}
+
+
+def synthetic_traffic(count, customer_count, loan_count, seed=0):
+    """Generate ``count`` API requests following TRAFFIC_MIX as ``(method, path, body)``
+
+    Customer and loan IDs are drawn from 1..customer_count and 1..loan_count, which
+    matches a database filled by ``seed_database`` with the same counts.
+    """
+    rng = np.random.default_rng(seed)
+    kinds = rng.choice(list(TRAFFIC_MIX), size=count, p=list(TRAFFIC_MIX.values()))
+    customers = rng.integers(1, customer_count + 1, count).tolist()
+    loans = rng.integers(1, loan_count + 1, count).tolist()
+    amounts = (rng.integers(10, 2000, count) * 1000).tolist()
+    rates = np.round(rng.uniform(8, 20, count), 2).tolist()
+    tenures = rng.integers(6, 121, count).tolist()
+    salaries = (rng.integers(20, 300, count) * 1000).tolist()
+    ages = rng.integers(21, 65, count).tolist()
+
+    traffic = []
+    for index, kind in enumerate(kinds.tolist()):
+        if kind == 'register':
+            traffic.append(('POST', reverse('register_customer'), {
+                'first_name': 'Bench', 'last_name': f'Customer{index}', 'age': ages[index],
+                'monthly_salary': salaries[index], 'phone_number': str(9000000000 + index),
+            }))
+        elif kind in ('check-eligibility', 'create-loan'):
+            name = 'check_eligibility' if kind == 'check-eligibility' else 'create_loan'
+            traffic.append(('POST', reverse(name), {
+                'customer_id': customers[index], 'loan_amount': amounts[index],
+                'interest_rate': rates[index], 'tenure': tenures[index],
+            }))
+        elif kind == 'view-loan':
+            traffic.append(('GET', reverse('view_loan', args=[loans[index]]), None))
+        else:
+            traffic.append(('GET', reverse('view_customer_loans', args=[customers[index]]), None))
+    return traffic
+
+
+def read_traffic(path):
+    """Read ``{"method", "path", "body"}`` JSON lines; returns ``(requests, skipped_lines)``
+
+    Lines that are not request records are skipped and counted rather than rejected.
+    """
+    requests, skipped = [], 0
+    with open(path) as traffic_file:
+        for line in traffic_file:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if not isinstance(record, dict) or not isinstance(record.get('path'), str) \
+                    or not record['path'].startswith('/'):
+                skipped += 1
+                continue
+            requests.append((str(record.get('method', 'GET')).upper(), record['path'], record.get('body')))
+    return requests, skipped
+
+
+def write_traffic(path, requests):
+    """Write requests in the JSON lines format ``read_traffic`` replays"""
+    with open(path, 'w') as traffic_file:
+        for method, request_path, body in requests:
+            traffic_file.write(json.dumps({'method': method, 'path': request_path, 'body': body}) + '\n')
+
+
+def endpoint_label(path):
+    """URL name of ``path``, so per-endpoint figures do not split by ID"""
+    try:
+        return resolve(urlsplit(path).path).url_name or path
+    except Resolver404:
+        return path
+
+
+def replay_in_process(requests, concurrency, total):
+    """Send ``total`` requests cycling through ``requests`` through the URLconf in-process
+
+    Each of ``concurrency`` threads has its own test client and database connection.
+    Returns the ``credit_system.loadtest`` summary with ``queries_per_request`` added
+    overall and per endpoint.
+    """
+    labelled = [(method, path, body, endpoint_label(path)) for method, path, body in requests]
+    counter = itertools.count()
+
+    def worker():
+        """Send requests until ``total`` are taken; returns this thread's own samples and query counts"""
+        client = bench_client()
+        samples, queries = [], Counter()
+        try:
+            while (index := next(counter)) < total:
+                method, path, body, label = labelled[index % len(labelled)]
+                data = json.dumps(body) if body is not None else ''
+                started = time.perf_counter()
+                with CaptureQueriesContext(connection) as captured:
+                    response = client.generic(method, path, data, content_type='application/json')
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                samples.append((label, time.perf_counter() - started, response.status_code))
+                queries[label] += len(captured.captured_queries)
+        finally:
+            connection.close()
+        return samples, queries
+
+    started = time.perf_counter()
+    samples, queries = [], Counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            worker_samples, worker_queries = future.result()
+            samples += worker_samples
+            queries.update(worker_queries)
+    result = summarize_samples(samples, time.perf_counter() - started)
+
+    for label, endpoint in result['endpoints'].items():
+        endpoint['queries_per_request'] = queries[label] / endpoint['requests']
+    result['queries_per_request'] = sum(queries.values()) / result['requests'] if result['requests'] else 0.0
+    return result
@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.schedules import crontab
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'credit_system.settings')
@@ -13,6 +14,20 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Load task modules from all registered Django apps.
 app.autodiscover_tasks()
 
+# Run with `celery -A credit_system.celery beat`
+app.conf.beat_schedule = {
+    # Early on the 1st: post last month's repayment file, then retire matured loans
+    'close-month': {
+        'task': 'loans.tasks.close_month',
+        'schedule': crontab(minute=0, hour=2, day_of_month=1),
+    },
+    # Loans also mature mid-month; retiring them daily keeps current debt accurate
+    'retire-matured-loans': {
+        'task': 'loans.tasks.retire_matured_loans',
+        'schedule': crontab(minute=30, hour=2),
+    },
+}
+
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
     print(f'Request: {self.request!r}') 
\ No newline at end of file
@@ -0,0 +1,145 @@
+"""
+Minimal HTTP/1.1 load generator for comparing deployment stacks.
+
+Each of ``concurrency`` workers keeps one keep-alive connection open and sends
+requests back to back until ``total`` requests have been issued, so the server sees
+a steady number of requests in flight. Only the standard library is used, so it
+runs wherever the project runs.
+"""
+
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, statuses, seconds):
+    """Throughput and latency percentiles of ``latencies`` (seconds) measured over ``seconds``"""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'seconds': seconds,
+        'requests_per_second': len(latencies) / seconds if seconds else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'statuses': statuses,
+    }
+
+
+def summarize_samples(samples, seconds):
+    """Overall and per-label summaries of ``(label, latency, status)`` samples"""
+    by_label = {}
+    for label, latency, status in samples:
+        latencies, statuses = by_label.setdefault(label, ([], {}))
+        latencies.append(latency)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    overall_statuses = {}
+    for _, statuses in by_label.values():
+        for status, count in statuses.items():
+            overall_statuses[status] = overall_statuses.get(status, 0) + count
+    result = summarize([sample[1] for sample in samples], overall_statuses, seconds)
+    result['endpoints'] = {
+        label: summarize(latencies, statuses, seconds) for label, (latencies, statuses) in sorted(by_label.items())
+    }
+    return result
+
+
+async def _read_response(reader):
+    """Read one response and return its status code; the body is drained and discarded"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('server closed the connection')
+    status = int(status_line.split()[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('connection', '').lower() == 'close'
+
+
+def _encode_request(method, path, body, host):
+    payload = json.dumps(body).encode() if body is not None else b''
+    lines = [f'{method} {path} HTTP/1.1', f'Host: {host}', 'Connection: keep-alive']
+    if body is not None:
+        lines += ['Content-Type: application/json', f'Content-Length: {len(payload)}']
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode() + payload
+
+
+async def _worker(address, requests, host, counter, total, samples):
+    reader = writer = None
+    while True:
+        index = counter[0]
+        if index >= total:
+            break
+        counter[0] += 1
+        method, path, body, label = requests[index % len(requests)]
+
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(*address)
+            writer.write(_encode_request(method, path, body, host))
+            await writer.drain()
+            status, closed = await _read_response(reader)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            status, closed = 'error', True
+        samples.append((label, time.perf_counter() - started, status))
+
+        if closed and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def _run(base_url, requests, concurrency, total, host):
+    url = urlsplit(base_url)
+    address = (url.hostname, url.port or 80)
+    prefix = url.path.rstrip('/')
+    requests = [
+        (request[0], prefix + request[1], request[2], request[3] if len(request) > 3 else request[1])
+        for request in requests
+    ]
+    counter, samples = [0], []
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        _worker(address, requests, host or url.netloc, counter, total, samples)
+        for _ in range(concurrency)
+    ))
+    return summarize_samples(samples, time.perf_counter() - started)
+
+
+def run_load(base_url, requests, concurrency=64, total=5000, host=None):
+    """Send ``total`` requests cycling through ``requests`` with ``concurrency`` in flight
+
+    ``requests`` is a list of ``(method, path, json_body_or_None[, label])``; the label
+    (the path by default) groups the per-endpoint figures. ``host`` overrides the Host
+    header, e.g. to pass ALLOWED_HOSTS when targeting a container by name. Returns
+    throughput, latency percentiles and a count of responses per status, overall and
+    under ``endpoints`` per label.
+    """
+    return asyncio.run(_run(base_url, requests, concurrency, total, host))
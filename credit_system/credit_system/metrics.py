@@ -0,0 +1,313 @@
+"""
+Per-request SQL and timing instrumentation.
+
+``RequestMetricsMiddleware`` measures, for every request, the number of SQL
+queries and the time spent in them, the time spent serializing the response (in
+response serializers, converting rows and rendering JSON; see ``serializing``)
+and the total time. The figures are sent back in a ``Server-Timing`` header and added
+to in-process histograms per URL name, which ``metrics_view`` exposes in the
+Prometheus text format to the addresses in ``METRICS_ALLOWED_IPS`` and to
+scrapers sending ``Authorization: Bearer <METRICS_TOKEN>``. Histograms live in each server process, so every worker
+of a multi-process deployment is scraped separately.
+
+Queries are counted by a database execute wrapper installed on each connection.
+It finds the request being measured through a context variable, so queries run
+by async views in ``sync_to_async`` threads are counted too.
+"""
+
+import heapq
+import hmac
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.urls import Resolver404, resolve
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds of the histograms
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Figures of the request being handled"""
+
+    def __init__(self, keep_statements=0):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.serializing = False
+        self.keep_statements = keep_statements
+        self.statements = []  # min-heap of the slowest (seconds, sql)
+        self._lock = threading.Lock()
+
+    def record_query(self, sql, seconds):
+        with self._lock:
+            self.sql_count += 1
+            self.sql_seconds += seconds
+            if self.keep_statements:
+                entry = (seconds, sql)
+                if len(self.statements) < self.keep_statements:
+                    heapq.heappush(self.statements, entry)
+                elif entry > self.statements[0]:
+                    heapq.heapreplace(self.statements, entry)
+
+    def slowest_statements(self):
+        return sorted(self.statements, reverse=True)
+
+
+def record_sql(execute, sql, params, many, context):
+    """Database execute wrapper counting queries of the request being measured"""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record_query(sql, time.perf_counter() - started)
+
+
+def install_sql_recorder(connection, **kwargs):
+    # Insert first: connection.execute_wrapper() blocks remove the last wrapper on exit
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_sql)
+
+
+@contextmanager
+def serializing():
+    """Count the block as response serialization time of the current request
+
+    Views wrap their response serializers' ``.data`` and row conversion in it, and
+    ``TimedJSONRenderer`` the rendering. Blocks nested in another count once. Keep
+    queries out of the block: their time is already counted as SQL.
+    """
+    metrics = _current.get()
+    if metrics is None or metrics.serializing:
+        yield
+        return
+    metrics.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializing = False
+        metrics.serialize_seconds += time.perf_counter() - started
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """DRF's JSON renderer, with its time counted as serialization"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with serializing():
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus sense: bucket counts, sum and count"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Process-wide histograms of request figures, per URL name"""
+
+    # name: (help text, buckets, RequestMetrics figure)
+    HISTOGRAMS = {
+        'http_request_duration_seconds': ('Total request time', DURATION_BUCKETS, 'total_seconds'),
+        'http_request_sql_queries': ('SQL queries per request', QUERY_BUCKETS, 'sql_count'),
+        'http_request_sql_duration_seconds': ('Time spent in SQL per request', DURATION_BUCKETS, 'sql_seconds'),
+        'http_request_serialize_duration_seconds': (
+            'Time spent serializing the response', DURATION_BUCKETS, 'serialize_seconds'
+        ),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {name: {} for name in self.HISTOGRAMS}
+            self.responses = {}
+
+    def observe(self, endpoint, method, status_code, metrics):
+        with self._lock:
+            for name, (_, buckets, figure) in self.HISTOGRAMS.items():
+                histogram = self.histograms[name].get(endpoint)
+                if histogram is None:
+                    histogram = self.histograms[name][endpoint] = Histogram(buckets)
+                histogram.observe(getattr(metrics, figure))
+            key = (endpoint, method, status_code)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def render(self):
+        """The histograms and response counters in the Prometheus text format"""
+        lines = []
+        with self._lock:
+            for name, (help_text, _, _) in self.HISTOGRAMS.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for endpoint, histogram in sorted(self.histograms[name].items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {histogram.total!r}')
+                    lines.append(f'{name}_count{{endpoint="{endpoint}"}} {histogram.count}')
+            lines += ['# HELP http_responses_total Responses by endpoint, method and status',
+                      '# TYPE http_responses_total counter']
+            for (endpoint, method, status_code), count in sorted(self.responses.items()):
+                lines.append(
+                    f'http_responses_total{{endpoint="{endpoint}",method="{method}",status="{status_code}"}} {count}'
+                )
+        return lines
+
+
+registry = MetricsRegistry()
+
+
+def application_metrics():
+    """Counters of the in-process caches and of admission control, in the Prometheus text format"""
+    from credit_system.admission import stats as admission_stats
+    from loans.cache import eligibility_cache_stats
+    from loans.emi import annuity_cache_info
+
+    eligibility = eligibility_cache_stats()
+    annuity = annuity_cache_info()
+    return [
+        '# HELP eligibility_cache_hits_total Eligibility results served from the cache',
+        '# TYPE eligibility_cache_hits_total counter',
+        f'eligibility_cache_hits_total {eligibility["hits"]}',
+        '# HELP eligibility_cache_misses_total Eligibility results computed',
+        '# TYPE eligibility_cache_misses_total counter',
+        f'eligibility_cache_misses_total {eligibility["misses"]}',
+        '# HELP eligibility_coalesced_total Eligibility results shared with a concurrent identical lookup',
+        '# TYPE eligibility_coalesced_total counter',
+        f'eligibility_coalesced_total {eligibility["coalesced"]}',
+        '# HELP emi_annuity_cache_hits_total EMI annuity terms served from the cache',
+        '# TYPE emi_annuity_cache_hits_total counter',
+        f'emi_annuity_cache_hits_total {annuity["hits"]}',
+        '# HELP emi_annuity_cache_misses_total EMI annuity terms computed',
+        '# TYPE emi_annuity_cache_misses_total counter',
+        f'emi_annuity_cache_misses_total {annuity["misses"]}',
+        *admission_stats.render(),
+    ]
+
+
+def scrape_allowed(request):
+    """Whether ``request`` may read the metrics"""
+    if settings.METRICS_TOKEN:
+        expected = f'Bearer {settings.METRICS_TOKEN}'
+        if hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected.encode()):
+            return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint"""
+    if not scrape_allowed(request):
+        return HttpResponseForbidden('Forbidden\n', content_type='text/plain')
+    body = '\n'.join(registry.render() + application_metrics()) + '\n'
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class RequestMetricsMiddleware:
+    """Measure each request; see the module docstring
+
+    Requests with more than ``REQUEST_BUDGET_QUERIES`` queries or slower than
+    ``REQUEST_BUDGET_MS`` are logged as warnings with their
+    ``REQUEST_BUDGET_SLOWEST_STATEMENTS`` slowest statements. A budget of 0 is off.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.query_budget = settings.REQUEST_BUDGET_QUERIES
+        self.latency_budget = settings.REQUEST_BUDGET_MS / 1000
+        self.keep_statements = (
+            settings.REQUEST_BUDGET_SLOWEST_STATEMENTS if self.query_budget or self.latency_budget else 0
+        )
+        connection_created.connect(install_sql_recorder, dispatch_uid='request_metrics_sql_recorder')
+        for connection in connections.all(initialized_only=True):
+            install_sql_recorder(connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics(self.keep_statements)
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics(self.keep_statements)
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def endpoint(self, request):
+        match = request.resolver_match
+        if match is None:
+            try:
+                match = resolve(request.path_info)
+            except Resolver404:
+                return 'unmatched'
+        return match.url_name or match.route or 'unnamed'
+
+    def finish(self, request, response, metrics):
+        metrics.total_seconds = time.perf_counter() - metrics.started
+        endpoint = self.endpoint(request)
+        if endpoint == 'metrics':
+            return response
+
+        response['Server-Timing'] = (
+            f'sql;dur={metrics.sql_seconds * 1000:.2f};desc="{metrics.sql_count} queries", '
+            f'serialize;dur={metrics.serialize_seconds * 1000:.2f}, '
+            f'total;dur={metrics.total_seconds * 1000:.2f}'
+        )
+        registry.observe(endpoint, request.method, response.status_code, metrics)
+
+        over_queries = self.query_budget and metrics.sql_count > self.query_budget
+        over_latency = self.latency_budget and metrics.total_seconds > self.latency_budget
+        if over_queries or over_latency:
+            slowest = ''.join(
+                f'\n  {seconds * 1000:.2f} ms: {sql}' for seconds, sql in metrics.slowest_statements()
+            )
+            logger.warning(
+                '%s %s (%s) over budget: %d queries, %.1f ms total, %.1f ms SQL; slowest statements:%s',
+                request.method, request.path, endpoint, metrics.sql_count, metrics.total_seconds * 1000,
+                metrics.sql_seconds * 1000, slowest,
+            )
+        return response
@@ -0,0 +1,214 @@
+"""
+On-demand profiling of single requests.
+
+``RequestProfilingMiddleware`` runs a request under cProfile when it carries the
+``X-Profile-Token`` header with the value of ``REQUEST_PROFILING_TOKEN``, or when
+it is picked by ``REQUEST_PROFILING_SAMPLE_RATE``. The profile and a trace of the
+request's SQL statements are written to ``REQUEST_PROFILING_DIR``, which keeps the
+newest ``REQUEST_PROFILING_KEEP`` captures. ``manage.py profiles`` lists and
+summarizes them.
+
+One request is profiled at a time per process: cProfile hooks cannot tell two
+requests on the same thread apart, and on Python 3.11 a second profiler enabled
+meanwhile takes over the hook silently. A request that wants a profile while
+another is being captured is served without one.
+
+The SQL trace finds the request being profiled through a context variable, like
+``credit_system.metrics``, so queries async views run in ``sync_to_async`` threads
+are traced too.
+
+With ``REQUEST_PROFILING_ENABLED`` off the middleware raises ``MiddlewareNotUsed``
+and is dropped from the stack, so it costs nothing.
+"""
+
+import cProfile
+import hmac
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+PROFILE_HEADER = 'X-Profile-Token'
+
+_trace = ContextVar('request_profile_sql', default=None)
+
+# Held while a request is being profiled
+_profiling = threading.Lock()
+
+
+def profile_dir():
+    return Path(settings.REQUEST_PROFILING_DIR)
+
+
+def list_captures(directory=None):
+    """Metadata of the captured profiles, newest first"""
+    directory = Path(directory or profile_dir())
+    captures = []
+    for path in directory.glob('*.json'):
+        with open(path) as meta_file:
+            captures.append(json.load(meta_file))
+    return sorted(captures, key=lambda capture: capture['captured_at'], reverse=True)
+
+
+def rotate(directory, keep):
+    """Delete all but the newest ``keep`` captures"""
+    captures = sorted(directory.glob('*.json'), key=lambda path: path.name, reverse=True)
+    for meta_path in captures[keep:]:
+        meta_path.unlink(missing_ok=True)
+        meta_path.with_suffix('.prof').unlink(missing_ok=True)
+
+
+class SQLTrace:
+    """Each statement of one profiled request with its duration"""
+
+    def __init__(self):
+        self.statements = []
+
+
+def trace_sql(execute, sql, params, many, context):
+    """Database execute wrapper adding statements to the trace of the request being profiled"""
+    trace = _trace.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.statements.append({'sql': sql, 'ms': (time.perf_counter() - started) * 1000})
+
+
+def install_sql_trace(connection, **kwargs):
+    # Insert first: connection.execute_wrapper() blocks remove the last wrapper on exit
+    if trace_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, trace_sql)
+
+
+class RequestProfilingMiddleware:
+    """Profile opted-in or sampled requests; see the module docstring
+
+    Goes last in MIDDLEWARE, so the profile covers the view and the rendering of
+    its response. Under ASGI the async views are awaited directly, without a
+    thread hop. cProfile then sees the event loop thread while the view runs. That
+    includes other requests the loop serves meanwhile, but not queries the async
+    ORM runs in worker threads; those are in the SQL trace.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.token = settings.REQUEST_PROFILING_TOKEN
+        self.sample_rate = settings.REQUEST_PROFILING_SAMPLE_RATE
+        self.keep = settings.REQUEST_PROFILING_KEEP
+        self.directory = profile_dir()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        connection_created.connect(install_sql_trace, dispatch_uid='request_profiling_sql_trace')
+        for connection in connections.all(initialized_only=True):
+            install_sql_trace(connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def wants_profile(self, request):
+        header = request.headers.get(PROFILE_HEADER)
+        if header is not None and self.token:
+            return hmac.compare_digest(header.encode(), self.token.encode())
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        """An enabled profiler, or None when another request is being profiled"""
+        if not _profiling.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ refuses when a profiler outside this middleware is active
+            _profiling.release()
+            return None
+        return profiler
+
+    def stop(self, profiler):
+        profiler.disable()
+        _profiling.release()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.wants_profile(request):
+            return self.get_response(request)
+
+        trace = SQLTrace()
+        started = time.perf_counter()
+        profiler = self.start()
+        if profiler is None:
+            return self.get_response(request)
+        token = _trace.set(trace)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.stop(profiler)
+            _trace.reset(token)
+        return self.finish(request, response, profiler, trace, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if not self.wants_profile(request):
+            return await self.get_response(request)
+
+        trace = SQLTrace()
+        started = time.perf_counter()
+        profiler = self.start()
+        if profiler is None:
+            return await self.get_response(request)
+        token = _trace.set(trace)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.stop(profiler)
+            _trace.reset(token)
+        return self.finish(request, response, profiler, trace, time.perf_counter() - started)
+
+    def finish(self, request, response, profiler, trace, elapsed):
+        response['X-Profile-Id'] = self.save(request, response, profiler, trace, elapsed)
+        return response
+
+    def save(self, request, response, profiler, trace, elapsed):
+        captured_at = datetime.now(timezone.utc)
+        match = request.resolver_match
+        endpoint = match.url_name if match and match.url_name else 'unmatched'
+        # Names sort by capture time, which rotation relies on
+        capture_id = f'{captured_at:%Y%m%dT%H%M%S%f}-{endpoint}-{uuid.uuid4().hex[:8]}'
+
+        profiler.dump_stats(self.directory / f'{capture_id}.prof')
+        meta = {
+            'id': capture_id,
+            'captured_at': captured_at.isoformat(),
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'ms': elapsed * 1000,
+            'sampled': PROFILE_HEADER not in request.headers,
+            'queries': trace.statements,
+        }
+        # Metadata is written last: a capture is listed only once it is complete
+        temporary = self.directory / f'{capture_id}.json.tmp'
+        with open(temporary, 'w') as meta_file:
+            json.dump(meta, meta_file, indent=2)
+        os.replace(temporary, self.directory / f'{capture_id}.json')
+
+        rotate(self.directory, self.keep)
+        return capture_id
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its figures cover the whole request (see credit_system.metrics)
+    'credit_system.metrics.RequestMetricsMiddleware',
+    # Before anything that does work, so shed requests cost next to nothing (see credit_system.admission)
+    'credit_system.admission.AdmissionControlMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,6 +53,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Last, so profiles cover the view itself (see credit_system.profiling)
+    'credit_system.profiling.RequestProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'credit_system.urls'
@@ -69,6 +76,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'credit_system.wsgi.application'
 
+# Runs the tests with a locmem cache and admission control off; see credit_system/test_runner.py
+TEST_RUNNER = 'credit_system.test_runner.TestRunner'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -83,6 +93,17 @@ DATABASES = {
         'PORT': '5432',
     }
 }
+# DJANGO_DB_ENGINE=sqlite runs against a local SQLite file, e.g. for benchmarks without services
+if os.getenv('DJANGO_DB_ENGINE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DJANGO_DB_NAME', str(BASE_DIR / 'db.sqlite3')),
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 30},
+            # Benchmarks with concurrent threads need a file, not the default in-memory test database
+            'TEST': {'NAME': os.getenv('DJANGO_TEST_DB_NAME')},
+        }
+    }
 
 # Celery Configuration
 CELERY_BROKER_URL = os.getenv('REDIS_URL', 'redis://redis:6379/0')
@@ -94,6 +115,104 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+# Month-end EMI posting reads <REPAYMENT_FILE_DIR>/<YYYY-MM>.csv for the month just closed
+REPAYMENT_FILE_DIR = os.getenv('REPAYMENT_FILE_DIR', str(BASE_DIR / 'repayments'))
+
+# Cache (eligibility results); CACHE_URL=locmem:// uses a process-local cache instead of
+# Redis, as the test runner does
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CACHE_URL', 'redis://redis:6379/1'),
+    }
+}
+if os.getenv('CACHE_URL') == 'locmem://':
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Seconds an eligibility result stays cached; 0 disables the cache
+ELIGIBILITY_CACHE_TIMEOUT = int(os.getenv('ELIGIBILITY_CACHE_TIMEOUT', '300'))
+# Concurrent identical eligibility misses share one computation (see loans.cache). A
+# caller waits at most ELIGIBILITY_SINGLE_FLIGHT_TIMEOUT seconds for it before computing
+# itself. Set ELIGIBILITY_SINGLE_FLIGHT_LOCK_SECONDS to also coalesce across processes
+# through a lock in the cache, held at most that long; 0 keeps coalescing per process
+ELIGIBILITY_SINGLE_FLIGHT_TIMEOUT = float(os.getenv('ELIGIBILITY_SINGLE_FLIGHT_TIMEOUT', '5'))
+ELIGIBILITY_SINGLE_FLIGHT_LOCK_SECONDS = int(os.getenv('ELIGIBILITY_SINGLE_FLIGHT_LOCK_SECONDS', '0'))
+
+# Maximum number of applications accepted by POST /check-eligibility/batch/
+ELIGIBILITY_BATCH_MAX_SIZE = int(os.getenv('ELIGIBILITY_BATCH_MAX_SIZE', '1000'))
+
+# POST /register/bulk/: largest accepted list, and whether invalid items fail the whole
+# batch ('atomic') or only themselves ('partial') when the request does not say
+REGISTER_BULK_MAX_SIZE = int(os.getenv('REGISTER_BULK_MAX_SIZE', '1000'))
+REGISTER_BULK_DEFAULT_MODE = os.getenv('REGISTER_BULK_DEFAULT_MODE', 'partial')
+
+# GET /view-loans/<customer_id>/: largest ?limit= page and rows fetched per chunk with ?stream=1
+VIEW_LOANS_MAX_PAGE_SIZE = int(os.getenv('VIEW_LOANS_MAX_PAGE_SIZE', '1000'))
+VIEW_LOANS_STREAM_CHUNK_SIZE = int(os.getenv('VIEW_LOANS_STREAM_CHUNK_SIZE', '2000'))
+
+# EMI annuity-factor cache: (rate, tenure) pairs kept, and the rates whose
+# 1-120 month terms are precomputed at startup when warm-up is enabled
+EMI_ANNUITY_CACHE_SIZE = int(os.getenv('EMI_ANNUITY_CACHE_SIZE', '4096'))
+EMI_ANNUITY_CACHE_WARMUP = os.getenv('EMI_ANNUITY_CACHE_WARMUP', 'False').lower() == 'true'
+EMI_ANNUITY_WARMUP_RATES = [rate for rate in os.getenv('EMI_ANNUITY_WARMUP_RATES', '12,16').split(',') if rate]
+
+# Seconds a stored POST /register/ or /create-loan/ response is replayed for its Idempotency-Key
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', '86400'))
+
+# Request metrics: requests over either budget are logged with their slowest
+# statements; 0 turns a budget off
+REQUEST_BUDGET_QUERIES = int(os.getenv('REQUEST_BUDGET_QUERIES', '0'))
+REQUEST_BUDGET_MS = float(os.getenv('REQUEST_BUDGET_MS', '0'))
+REQUEST_BUDGET_SLOWEST_STATEMENTS = int(os.getenv('REQUEST_BUDGET_SLOWEST_STATEMENTS', '3'))
+# GET /metrics answers only these client addresses, and scrapers sending
+# "Authorization: Bearer <METRICS_TOKEN>" when a token is set
+METRICS_ALLOWED_IPS = [ip for ip in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip]
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Request profiling: off unless enabled. Requests sending the X-Profile-Token header with
+# REQUEST_PROFILING_TOKEN, plus a sampled share of all requests, are profiled; the newest
+# REQUEST_PROFILING_KEEP captures are kept in REQUEST_PROFILING_DIR
+REQUEST_PROFILING_ENABLED = os.getenv('REQUEST_PROFILING_ENABLED', 'False').lower() == 'true'
+REQUEST_PROFILING_TOKEN = os.getenv('REQUEST_PROFILING_TOKEN', '')
+REQUEST_PROFILING_SAMPLE_RATE = float(os.getenv('REQUEST_PROFILING_SAMPLE_RATE', '0'))
+REQUEST_PROFILING_DIR = os.getenv('REQUEST_PROFILING_DIR', str(BASE_DIR / 'profiles'))
+REQUEST_PROFILING_KEEP = int(os.getenv('REQUEST_PROFILING_KEEP', '100'))
+
+# Admission control: per URL name, 'concurrency' caps requests in flight across all
+# workers (503 beyond it) and 'rate'/'burst' is a token bucket per client in requests
+# per second (429 beyond it). Endpoints not listed are never limited. The test runner
+# and the in-process benchmark commands turn it off, as they send bursts on purpose
+ADMISSION_CONTROL_ENABLED = os.getenv('ADMISSION_CONTROL_ENABLED', 'True').lower() == 'true'
+ADMISSION_LIMITS = json.loads(os.getenv('ADMISSION_LIMITS', 'null')) or {
+    'check_eligibility': {'concurrency': 32, 'rate': 20, 'burst': 40},
+    'check_eligibility_async': {'concurrency': 32, 'rate': 20, 'burst': 40},
+    'check_eligibility_batch': {'concurrency': 4, 'rate': 2, 'burst': 5},
+}
+# 'redis' shares the limits between workers; 'local' keeps them per process
+ADMISSION_BACKEND = os.getenv('ADMISSION_BACKEND', 'local' if CACHES['default']['BACKEND'].endswith('LocMemCache') else 'redis')
+ADMISSION_REDIS_URL = os.getenv('ADMISSION_REDIS_URL', os.getenv('REDIS_URL', 'redis://redis:6379/0'))
+# Seconds to connect to or wait on Redis before admitting the request anyway
+ADMISSION_REDIS_TIMEOUT = float(os.getenv('ADMISSION_REDIS_TIMEOUT', '0.1'))
+# Header naming the client behind a trusted proxy (first address is used); REMOTE_ADDR otherwise
+ADMISSION_CLIENT_HEADER = os.getenv('ADMISSION_CLIENT_HEADER', '')
+# Seconds a concurrency slot is held at most, should a worker die mid-request
+ADMISSION_LEASE_SECONDS = int(os.getenv('ADMISSION_LEASE_SECONDS', '30'))
+# Retry-After sent with 503s when an endpoint is at its concurrency limit
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', '1'))
+
+# DRF's default renderers, with JSON rendering counted as serialization time in the metrics
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'credit_system.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Data import
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))  # rows per bulk insert / transaction
+# Checkpointed imports write the rows they could not import to <IMPORT_REJECT_DIR>/<id>-<kind>-rejects.csv
+IMPORT_REJECT_DIR = os.getenv('IMPORT_REJECT_DIR', str(BASE_DIR / 'rejects'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -0,0 +1,72 @@
+"""
+Single-flight coalescing of concurrent identical computations.
+
+``SingleFlight.do(key, compute)`` runs ``compute`` once per key at a time. Callers
+that ask for a key while its computation is in flight wait for it and get the same
+result, or the same exception, without running it themselves. ``ado`` does the same
+for coroutine functions within an event loop. Nothing is kept once a computation
+ends, so a later call computes afresh. Caching results is left to the caller.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key: Future of the computation in flight
+        self._tasks = {}  # (event loop, key): Task in flight
+
+    def do(self, key, compute, timeout=None):
+        """The result of ``compute()``, shared with concurrent callers of the same key
+
+        A caller that waited ``timeout`` seconds for another's computation runs
+        ``compute`` itself.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            try:
+                return future.result(timeout)
+            except FutureTimeoutError:
+                return compute()
+
+        try:
+            result = compute()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+        future.set_result(result)
+        return result
+
+    async def ado(self, key, compute, timeout=None):
+        """Async version of ``do``; ``compute`` is a coroutine function
+
+        Computations are shared within the running event loop. A caller that is
+        cancelled does not cancel the computation others are waiting for.
+        """
+        flight = (asyncio.get_running_loop(), key)
+        with self._lock:
+            task = self._tasks.get(flight)
+            leader = task is None
+            if leader:
+                task = self._tasks[flight] = asyncio.ensure_future(compute())
+                task.add_done_callback(lambda _: self._forget(flight))
+        if leader:
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            return await compute()
+
+    def _forget(self, flight):
+        with self._lock:
+            self._tasks.pop(flight, None)
@@ -0,0 +1,25 @@
+"""
+Test runner for ``manage.py test``.
+
+The suite uses a process-local cache, whatever ``CACHE_URL`` says, so it needs no
+Redis. It also sends bursts of requests from a single client on purpose, so
+admission control is off for it; the tests of the middleware turn it back on with
+``override_settings``.
+"""
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.overrides = override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            ADMISSION_CONTROL_ENABLED=False, ADMISSION_BACKEND='local',
+        )
+        self.overrides.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.overrides.disable()
+        super().teardown_test_environment(**kwargs)
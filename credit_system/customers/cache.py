@@ -0,0 +1,56 @@
+"""
+Per-customer cache versions.
+
+Cached data derived from a customer (such as eligibility results) is keyed on the
+customer's current version. Bumping the version once a change has committed makes
+every older entry unreachable; those entries then simply expire.
+"""
+
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def version_key(customer_id):
+    return f'customer-version:{customer_id}'
+
+
+def _seed(key):
+    # Seed from the clock so a counter lost to eviction never restarts at a used version
+    cache.add(key, time.time_ns(), timeout=None)
+
+
+def get_customer_version(customer_id):
+    """Current cache version of a customer"""
+    key = version_key(customer_id)
+    version = cache.get(key)
+    if version is None:
+        _seed(key)
+        version = cache.get(key)
+    return version
+
+
+async def aget_customer_version(customer_id):
+    """Async version of ``get_customer_version``"""
+    key = version_key(customer_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_customer_versions(customer_ids):
+    """Invalidate cached data of the given customers once the current transaction commits"""
+    customer_ids = set(customer_ids)
+
+    def bump():
+        for customer_id in customer_ids:
+            key = version_key(customer_id)
+            try:
+                cache.incr(key)
+            except ValueError:
+                _seed(key)
+
+    transaction.on_commit(bump)
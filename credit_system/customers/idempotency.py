@@ -0,0 +1,105 @@
+"""
+``Idempotency-Key`` support for POST endpoints that create rows.
+
+A request carrying the header runs in one transaction together with the insert of
+its ``IdempotencyKey`` row. The row is saved with the response before that
+transaction commits. A retry with the same key then finds the row and gets the
+stored response back, without the view running again.
+
+A duplicate that arrives while the first request is still running blocks on the
+key's unique index, or on the write lock under SQLite. It waits until the first
+request commits and then replays its response. If the first request fails, its
+key row is rolled back with it, and the duplicate runs the view itself.
+
+Server errors are not stored, so they can be retried. Keys expire after
+``IDEMPOTENCY_KEY_TTL`` seconds; ``IdempotencyKey`` rows past ``expires_at`` are
+ignored and can be purged.
+"""
+
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def replay(record):
+    response = HttpResponse(record.response_body, status=record.status_code, content_type=record.content_type)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def purge_expired_keys():
+    """Delete expired keys; returns how many were removed"""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
+
+
+def idempotent(scope):
+    """Make a view replay its stored response for a repeated ``Idempotency-Key``
+
+    ``scope`` names the endpoint, so one key can be used against several endpoints.
+    Goes outside ``@api_view``.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if key is None:
+                return view(request, *args, **kwargs)
+            if not key or len(key) > 255:
+                return JsonResponse({'error': f'{IDEMPOTENCY_HEADER} must be 1-255 characters'}, status=400)
+            fingerprint = hashlib.sha256(request.body).hexdigest()
+
+            # Twice at most: the second pass follows the removal of an expired key
+            for _ in range(2):
+                with transaction.atomic():
+                    try:
+                        with transaction.atomic():
+                            record = IdempotencyKey.objects.create(
+                                scope=scope, key=key, fingerprint=fingerprint,
+                                expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+                            )
+                    except IntegrityError:
+                        record = None
+                    if record is not None:
+                        return store(record, view(request, *args, **kwargs))
+
+                record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+                if record is None:
+                    continue
+                if record.expires_at <= timezone.now():
+                    IdempotencyKey.objects.filter(pk=record.pk).delete()
+                    continue
+                if record.fingerprint != fingerprint:
+                    return JsonResponse(
+                        {'error': f'{IDEMPOTENCY_HEADER} was already used with a different request body'},
+                        status=422,
+                    )
+                return replay(record)
+            return JsonResponse({'error': f'{IDEMPOTENCY_HEADER} is in use, retry later'}, status=409)
+
+        return wrapper
+    return decorator
+
+
+def store(record, response):
+    """Save the response on its key row, or drop the row if the response must not be replayed"""
+    if response.status_code >= 500 or response.streaming:
+        record.delete()
+        return response
+    if hasattr(response, 'render'):
+        response.render()
+    record.status_code = response.status_code
+    record.content_type = response.get('Content-Type', '')
+    record.response_body = response.content.decode(response.charset)
+    record.save(update_fields=['status_code', 'content_type', 'response_body'])
+    return response
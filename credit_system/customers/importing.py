@@ -0,0 +1,170 @@
+from decimal import Decimal, InvalidOperation
+import numpy as np
+import openpyxl
+import pandas as pd
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connection
+
+DEFAULT_IMPORT_BATCH_SIZE = 1000
+
+
+class RowError(ValueError):
+    """A row holds a value that cannot be imported"""
+
+
+def get_batch_size(batch_size=None):
+    """Rows per bulk insert, from the argument or the IMPORT_BATCH_SIZE setting"""
+    return batch_size or getattr(settings, 'IMPORT_BATCH_SIZE', DEFAULT_IMPORT_BATCH_SIZE)
+
+
+def normalize_columns(columns):
+    """Normalize column names: e.g., "Customer ID" -> "customer_id" """
+    return [str(col).strip().lower().replace(' ', '_') for col in columns]
+
+
+def is_csv(path):
+    return str(path).lower().endswith('.csv')
+
+
+def read_sheet(path):
+    """Read a spreadsheet (.xlsx or .csv) into a DataFrame with normalized column names"""
+    df = pd.read_csv(path) if is_csv(path) else pd.read_excel(path)
+    df.columns = normalize_columns(df.columns)
+    return df
+
+
+def iter_frames(path, chunk_size, start=0):
+    """Yield normalized DataFrames of at most ``chunk_size`` rows
+
+    Only one chunk is held in memory at a time: CSV files go through pandas'
+    chunked reader and .xlsx files through openpyxl's read-only row iterator.
+    The first ``start`` data rows are read but not yielded, to resume an import.
+    """
+    for df in read_frames(path, chunk_size):
+        if start >= len(df):
+            start -= len(df)
+            continue
+        if start:
+            df, start = df.iloc[start:], 0
+        yield df
+
+
+def read_frames(path, chunk_size):
+    if is_csv(path):
+        for df in pd.read_csv(path, chunksize=chunk_size):
+            df.columns = normalize_columns(df.columns)
+            yield df
+        return
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = normalize_columns(next(rows, ()))
+        chunk = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def shard_frame(df, column, shard):
+    """Keep the rows of one ``[index, count]`` shard, assigned by ``column`` modulo ``count``"""
+    index, count = shard
+    return df[df[column] % count == index]
+
+
+def to_decimals(series):
+    """Convert a column to Decimals exactly like Decimal(str(value)) per cell
+
+    Raises ``RowError`` for a value that is not a finite number.
+    """
+    decimals = []
+    for value in series.astype(str):
+        try:
+            decimal = Decimal(value)
+        except InvalidOperation:
+            decimal = None
+        if decimal is None or not decimal.is_finite():
+            raise RowError(f'invalid {series.name}: {value}')
+        decimals.append(decimal)
+    return decimals
+
+
+def batches(items, size):
+    """Split a list into consecutive slices of at most ``size`` items"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def empty_result():
+    return {'total': 0, 'inserted': 0, 'skipped': 0, 'orphaned': 0}
+
+
+def empty_delta_result():
+    return {**empty_result(), 'updated': 0, 'unchanged': 0}
+
+
+def fingerprint_rows(df, columns):
+    """64-bit fingerprint of each row over ``columns``, as int64 so it fits a BigIntegerField
+
+    ``columns`` maps column names to ``'text'``, ``'number'`` or ``'date'``. Values
+    are canonicalized first, so 50000 read from a .csv and 50000.0 from an .xlsx, or
+    a date read as text and as a timestamp, fingerprint the same. Columns missing
+    from ``df`` are left out.
+    """
+    canonical = {}
+    for column, kind in columns.items():
+        if column not in df:
+            continue
+        if kind == 'number':
+            canonical[column] = pd.to_numeric(df[column], errors='coerce').astype('float64').round(2)
+        elif kind == 'date':
+            canonical[column] = pd.to_datetime(df[column]).dt.strftime('%Y-%m-%d')
+        else:
+            canonical[column] = df[column].astype(str)
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(canonical, index=df.index), index=False)
+    return hashes.to_numpy().view(np.int64)
+
+
+def stored_fingerprints(model, ids=None):
+    """``{pk: import_fingerprint}`` of the rows of ``model``, or of those with the given IDs"""
+    rows = model.objects.all()
+    if ids is not None:
+        rows = rows.filter(pk__in=ids)
+    return dict(rows.values_list('pk', 'import_fingerprint'))
+
+
+def split_changed(df, id_column, fingerprints, stored):
+    """The rows of ``df`` that are new or changed since they were last imported
+
+    ``fingerprints`` are those of ``df``'s rows and ``stored`` maps the IDs already in
+    the database to their fingerprint (None if never imported). Returns
+    ``(changed, inserted, updated)``: the changed rows with a ``fingerprint`` column,
+    and how many of them are new and how many replace an existing row.
+    """
+    ids = df[id_column].to_numpy()
+    known = df[id_column].isin(stored.keys()).to_numpy()
+    previous = pd.Series(stored, dtype='Int64').reindex(ids)
+    changed = previous.ne(fingerprints).fillna(True).to_numpy(dtype=bool)
+    return (
+        df[changed].assign(fingerprint=fingerprints[changed]),
+        int((changed & ~known).sum()),
+        int((changed & known).sum()),
+    )
+
+
+def reset_sequence(model):
+    """Move the primary key sequence past explicitly imported IDs (no-op where not needed)"""
+    statements = connection.ops.sequence_reset_sql(no_style(), [model])
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
@@ -0,0 +1,126 @@
+import os
+import tempfile
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+from django.db import models
+from credit_system.benchmarking import sample_customer_frame, sample_loan_frame, throwaway_database, timed
+from customers.importing import read_sheet
+from customers.models import Customer
+from customers.tasks import import_customer_data
+from loans.models import Loan
+from loans.tasks import import_loan_data
+
+
+def legacy_import_customers(path):
+    """The original row-at-a-time customer import, kept as the benchmark baseline"""
+    df = read_sheet(path)
+    for _, row in df.iterrows():
+        if not Customer.objects.filter(customer_id=row['customer_id']).exists():
+            Customer.objects.create(
+                customer_id=row['customer_id'],
+                first_name=row['first_name'],
+                last_name=row['last_name'],
+                age=row.get('age', 25),
+                phone_number=str(row['phone_number']),
+                monthly_salary=Decimal(str(row['monthly_salary'])),
+                approved_limit=Decimal(str(row['approved_limit'])),
+                current_debt=Decimal(str(row.get('current_debt', 0)))
+            )
+
+
+def legacy_import_loans(path):
+    """The original row-at-a-time loan import, kept as the benchmark baseline
+
+    Rows are saved with ``Model.save``, skipping the credit profile and cache
+    version upkeep ``Loan.save`` does now, which the original import did not pay for.
+    """
+    df = read_sheet(path)
+    for _, row in df.iterrows():
+        try:
+            customer = Customer.objects.get(customer_id=row['customer_id'])
+            if not Loan.objects.filter(loan_id=row['loan_id']).exists():
+                loan = Loan(
+                    loan_id=row['loan_id'],
+                    customer=customer,
+                    loan_amount=Decimal(str(row['loan_amount'])),
+                    tenure=row['tenure'],
+                    interest_rate=Decimal(str(row['interest_rate'])),
+                    monthly_repayment=Decimal(str(row['monthly_payment'])),
+                    emis_paid_on_time=row['emis_paid_on_time'],
+                    start_date=pd.to_datetime(row['date_of_approval']).date(),
+                    end_date=pd.to_datetime(row['end_date']).date(),
+                    is_active=True
+                )
+                models.Model.save(loan, force_insert=True)
+        except Customer.DoesNotExist:
+            continue
+
+
+class Command(BaseCommand):
+    help = 'Compare rows/sec of the batched import against the row-at-a-time baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--loans', type=int, default=10000)
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--skip-legacy', action='store_true', help='Only time the batched import')
+        parser.add_argument('--change-rates', default='0,0.01,0.1,1',
+                            help='Comma separated shares of changed rows to time delta re-imports with')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp:
+            customers_path = os.path.join(tmp, 'customers.xlsx')
+            loans_path = os.path.join(tmp, 'loans.xlsx')
+            self.stdout.write('Generating spreadsheets...')
+            sample_customer_frame(options['customers']).to_excel(customers_path, index=False)
+            sample_loan_frame(options['loans'], options['customers']).to_excel(loans_path, index=False)
+
+            with throwaway_database():
+                if not options['skip_legacy']:
+                    _, customer_seconds = timed(legacy_import_customers, customers_path)
+                    _, loan_seconds = timed(legacy_import_loans, loans_path)
+                    self.report('legacy', options, customer_seconds, loan_seconds)
+                    Loan.objects.all().delete()
+                    Customer.objects.all().delete()
+
+                _, customer_seconds = timed(import_customer_data, customers_path, options['batch_size'])
+                _, loan_seconds = timed(import_loan_data, loans_path, options['batch_size'])
+                self.report('batched', options, customer_seconds, loan_seconds)
+
+                for rate in [float(rate) for rate in options['change_rates'].split(',')]:
+                    self.bench_delta(tmp, rate, options)
+
+    def bench_delta(self, tmp, rate, options):
+        """Time delta re-imports of the spreadsheets with a share ``rate`` of their rows changed"""
+        rng = np.random.default_rng(1)
+        customers = sample_customer_frame(options['customers'])
+        loans = sample_loan_frame(options['loans'], options['customers'])
+        customers.loc[rng.random(len(customers)) < rate, 'Monthly Salary'] += 1000
+        loans.loc[rng.random(len(loans)) < rate, 'EMIs paid on Time'] += 1
+        customers_path = os.path.join(tmp, f'customers-{rate}.xlsx')
+        loans_path = os.path.join(tmp, f'loans-{rate}.xlsx')
+        customers.to_excel(customers_path, index=False)
+        loans.to_excel(loans_path, index=False)
+
+        customer_result, customer_seconds = timed(
+            import_customer_data, customers_path, options['batch_size'], delta=True,
+        )
+        loan_result, loan_seconds = timed(import_loan_data, loans_path, options['batch_size'], delta=True)
+        self.report(f'delta {rate:g}', options, customer_seconds, loan_seconds)
+        self.stdout.write(
+            f"{'':>12}  {customer_result['updated']} customers and {loan_result['updated']} loans updated, "
+            f"{customer_seconds:.2f}s + {loan_seconds:.2f}s"
+        )
+
+        # Put the original rows back so every rate starts from the same data
+        import_customer_data(os.path.join(tmp, 'customers.xlsx'), options['batch_size'], delta=True)
+        import_loan_data(os.path.join(tmp, 'loans.xlsx'), options['batch_size'], delta=True)
+
+    def report(self, label, options, customer_seconds, loan_seconds):
+        self.stdout.write(
+            f"{label:>12}: customers {options['customers'] / customer_seconds:,.0f} rows/s, "
+            f"loans {options['loans'] / loan_seconds:,.0f} rows/s"
+        )
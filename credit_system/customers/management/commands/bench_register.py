@@ -0,0 +1,60 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from credit_system.benchmarking import bench_client, throwaway_database
+from customers.models import Customer
+
+
+class Command(BaseCommand):
+    help = 'Measure customers registered per second by /register/ against /register/bulk/ across batch sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-sizes', default='10,100,1000',
+                            help='Comma separated batch sizes to compare')
+        parser.add_argument('--customers', type=int, default=2000,
+                            help='Customers registered per run')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        client = bench_client()
+        payloads = [
+            {
+                'first_name': 'Bench',
+                'last_name': f'Customer{index}',
+                'age': int(age),
+                'monthly_salary': int(salary),
+                'phone_number': f'9{index:09d}',
+            }
+            for index, (age, salary) in enumerate(zip(
+                rng.integers(21, 65, options['customers']),
+                rng.integers(15_000, 300_000, options['customers']),
+            ))
+        ]
+
+        with throwaway_database():
+            def run(label, url, bodies):
+                Customer.objects.all().delete()
+                queries = 0
+                started = time.perf_counter()
+                for body in bodies:
+                    with CaptureQueriesContext(connection) as captured:
+                        response = client.post(url, json.dumps(body), content_type='application/json')
+                    assert response.status_code == 201, response.content
+                    queries += len(captured)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'{label:>12}: {elapsed / len(payloads) * 1e6:8.1f} us/customer, '
+                    f'{queries / len(bodies):.1f} queries/request, '
+                    f'{len(payloads) / elapsed:,.0f} customers/s'
+                )
+
+            run('single', reverse('register_customer'), payloads)
+            url = reverse('register_customer_bulk')
+            for batch_size in [int(size) for size in options['batch_sizes'].split(',')]:
+                batches = [payloads[start:start + batch_size] for start in range(0, len(payloads), batch_size)]
+                run(f'bulk {batch_size}', url, batches)
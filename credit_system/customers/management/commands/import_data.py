@@ -1,21 +1,76 @@
-from django.core.management.base import BaseCommand
-from customers.tasks import import_customer_data
-from loans.tasks import import_loan_data
+from django.core.management.base import BaseCommand, CommandError
+from customers.parallel import EXECUTORS, ShardFailed, run_parallel_import
+from customers.runs import open_run
+from customers.tasks import customer_file, import_customer_data
+from loans.tasks import import_loan_data, loan_file
 
 class Command(BaseCommand):
-    help = 'Import customer and loan data from Excel files'
+    help = 'Import customer and loan data from Excel or CSV files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers-file', help='Customer spreadsheet (defaults to customer_data.xlsx)')
+        parser.add_argument('--loans-file', help='Loan spreadsheet (defaults to loan_data.xlsx)')
+        parser.add_argument('--batch-size', type=int, help='Rows per bulk insert (defaults to IMPORT_BATCH_SIZE)')
+        parser.add_argument('--stream', action='store_true',
+                            help='Read and insert one batch at a time to keep memory flat on very large files')
+        parser.add_argument('--delta', action='store_true',
+                            help='Also update existing rows that changed since they were imported')
+        parser.add_argument('--checkpoint', action='store_true',
+                            help='Commit a checkpoint per batch, reject bad rows to a file, and resume an '
+                                 'unfinished import of the same file')
+        parser.add_argument('--parallel', type=int, default=0, metavar='N',
+                            help='Split each phase into N shards and run them concurrently')
+        parser.add_argument('--executor', choices=EXECUTORS, default='celery',
+                            help='Run shards on Celery workers or in a local process pool (with --parallel)')
 
     def handle(self, *args, **options):
+        if options['delta'] and options['parallel']:
+            raise CommandError('--delta cannot be combined with --parallel')
+        if options['checkpoint'] and options['parallel']:
+            raise CommandError('--checkpoint cannot be combined with --parallel')
         self.stdout.write('Starting data import...')
-        
+
+        if options['parallel']:
+            self.stdout.write(f"Importing with {options['parallel']} shards ({options['executor']})...")
+            try:
+                result = run_parallel_import(
+                    options['customers_file'], options['loans_file'], options['parallel'],
+                    options['batch_size'], options['executor'],
+                )
+            except ShardFailed as e:
+                raise CommandError(f'{e}; loans were not imported')
+            for phase in ('customers', 'loans'):
+                for index, shard_result in enumerate(result[phase]['shards']):
+                    self.stdout.write(f'{phase} shard {index}: {shard_result}')
+                totals = {key: value for key, value in result[phase].items() if key != 'shards'}
+                self.stdout.write(f'{phase.capitalize()} import result: {totals}')
+            self.stdout.write(f"Rebuilt {result['profiles']} credit profiles")
+            self.stdout.write(self.style.SUCCESS('Data import completed!'))
+            return
+
         # Import customer data synchronously
         self.stdout.write('Importing customer data...')
-        customer_result = import_customer_data()
+        customer_result = import_customer_data(
+            options['customers_file'], options['batch_size'], options['stream'], delta=options['delta'],
+            import_id=self.open_run('customers', customer_file(options['customers_file']), options),
+        )
         self.stdout.write(f'Customer import result: {customer_result}')
-        
+
         # Import loan data synchronously
         self.stdout.write('Importing loan data...')
-        loan_result = import_loan_data()
+        loan_result = import_loan_data(
+            options['loans_file'], options['batch_size'], options['stream'], delta=options['delta'],
+            import_id=self.open_run('loans', loan_file(options['loans_file']), options),
+        )
         self.stdout.write(f'Loan import result: {loan_result}')
-        
-        self.stdout.write(self.style.SUCCESS('Data import completed!')) 
\ No newline at end of file
+
+        self.stdout.write(self.style.SUCCESS('Data import completed!'))
+
+    def open_run(self, kind, path, options):
+        """With --checkpoint, the ID of the run importing ``path``, announced so its progress can be watched"""
+        if not options['checkpoint']:
+            return None
+        run = open_run(kind, path, options['delta'], options['batch_size'])
+        resumed = f' from row {run.rows_committed}' if run.rows_committed else ''
+        self.stdout.write(f'Import {run.pk}{resumed}; progress at /imports/{run.pk}/')
+        return run.pk
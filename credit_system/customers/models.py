@@ -1,6 +1,11 @@
+from decimal import Decimal
+
+import numpy as np
 from django.db import models
+from .cache import bump_customer_versions
 
-# Create your models here.
+# Customer fields that feed loan eligibility
+ELIGIBILITY_FIELDS = ('approved_limit', 'monthly_salary')
 
 class Customer(models.Model):
     customer_id = models.AutoField(primary_key=True)
@@ -11,6 +16,8 @@ class Customer(models.Model):
     monthly_salary = models.DecimalField(max_digits=12, decimal_places=2)
     approved_limit = models.DecimalField(max_digits=12, decimal_places=2)
     current_debt = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Fingerprint of the spreadsheet row last imported into this customer (see customers.importing)
+    import_fingerprint = models.BigIntegerField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -20,10 +27,115 @@ class Customer(models.Model):
     def __str__(self):
         return f"{self.first_name} {self.last_name} (ID: {self.customer_id})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the eligibility inputs so save() only invalidates caches when they change
+        if all(field in field_names for field in ELIGIBILITY_FIELDS):
+            instance._eligibility_snapshot = instance.eligibility_inputs()
+        return instance
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if not adding and getattr(self, '_eligibility_snapshot', None) != self.eligibility_inputs():
+            bump_customer_versions([self.customer_id])
+        self._eligibility_snapshot = self.eligibility_inputs()
+
+    def delete(self, *args, **kwargs):
+        customer_id = self.customer_id
+        result = super().delete(*args, **kwargs)
+        bump_customer_versions([customer_id])
+        return result
+
+    def eligibility_inputs(self):
+        return tuple(getattr(self, field) for field in ELIGIBILITY_FIELDS)
+
     @property
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
 
     def calculate_approved_limit(self):
         """Calculate approved limit based on monthly salary"""
-        return round(self.monthly_salary * 36 / 100000) * 100000  # Round to nearest lakh
+        return self.approved_limits([self.monthly_salary])[0]
+
+    @staticmethod
+    def approved_limits(monthly_salaries):
+        """Approved limits for many monthly salaries at once, as ints
+
+        36 times the salary rounded to the nearest lakh, half to even, exactly like
+        ``round(salary * 36 / 100000) * 100000`` on a Decimal salary with at most two
+        decimals. The arithmetic is done on integer cents, for the whole array at once.
+        """
+        cents = np.array([int(Decimal(salary).scaleb(2)) for salary in monthly_salaries], dtype=np.int64)
+        divisor = 100_000 * 100  # one lakh, in cents
+        lakhs, remainder = np.divmod(cents * 36, divisor)
+        twice = remainder * 2
+        lakhs += (twice > divisor) | ((twice == divisor) & (lakhs % 2 == 1))
+        return (lakhs * 100_000).tolist()
+
+
+class IdempotencyKey(models.Model):
+    """Stored response of a POST made with an ``Idempotency-Key`` header (see ``customers.idempotency``)"""
+    scope = models.CharField(max_length=50)  # URL name of the endpoint
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)  # SHA-256 of the request body
+    status_code = models.PositiveSmallIntegerField(null=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    response_body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'idempotency_keys'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='idempotency_keys_scope_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Idempotency key {self.key} for {self.scope}"
+
+
+class ImportRun(models.Model):
+    """A checkpointed import of one customer or loan file (see ``customers.runs``)"""
+    KIND_CHOICES = [('customers', 'Customers'), ('loans', 'Loans')]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    path = models.CharField(max_length=500)
+    file_hash = models.CharField(max_length=64)  # SHA-256 of the file's contents
+    delta = models.BooleanField(default=False)
+    batch_size = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Checkpoint: data rows of the file handled by committed chunks
+    rows_committed = models.PositiveBigIntegerField(default=0)
+    counts = models.JSONField(default=dict)  # import result counts, summed over the committed chunks
+    reject_path = models.CharField(max_length=500, blank=True)
+    error = models.TextField(blank=True)
+    task_id = models.CharField(max_length=255, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    # Where and when the latest attempt started, for its throughput
+    attempt_started_at = models.DateTimeField(null=True)
+    attempt_start_row = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'import_runs'
+        indexes = [models.Index(fields=['kind', 'file_hash'], name='import_runs_kind_hash_idx')]
+
+    def __str__(self):
+        return f"Import {self.pk} of {self.kind} from {self.path} ({self.status})"
+
+    @property
+    def rows_per_second(self):
+        """Throughput of the latest attempt, up to its last checkpoint"""
+        if self.attempt_started_at is None:
+            return None
+        elapsed = ((self.finished_at or self.updated_at) - self.attempt_started_at).total_seconds()
+        if elapsed <= 0:
+            return None
+        return round((self.rows_committed - self.attempt_start_row) / elapsed, 1)
@@ -0,0 +1,218 @@
+"""
+Checkpointed, resumable imports.
+
+An ``ImportRun`` records the import of one file. ``open_run`` hashes the file and
+returns the unfinished run of the same contents, kind and mode when there is one,
+so an import that failed or was interrupted resumes where it stopped, and a new
+run otherwise.
+
+``run_import`` reads the file in chunks of ``batch_size`` rows, from the run's
+checkpoint on. A chunk is written and the checkpoint advanced in one transaction,
+so each chunk is imported and counted exactly once. The checkpoint is advanced by
+a conditional UPDATE, which stops two workers from importing the same run at once.
+
+Rows that cannot be imported go to the run's reject file instead of failing the
+run: a CSV with the row's number among the file's data rows, the reason, and the
+row's columns. Rows with a missing value or a number or date that does not parse
+are rejected up front. When writing a chunk fails on a data error (one the
+database raises for a row, or a ``RowError`` from the importer), the chunk is
+written again one row at a time to find the rows at fault. Other errors, like a
+lost database connection or a bug in the importer, fail the run, which keeps its
+checkpoint.
+
+Progress is saved with each checkpoint, for ``GET /imports/<id>/``, and handed to
+a ``progress`` callback, which the import tasks publish as Celery task state.
+"""
+
+import hashlib
+import logging
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import DataError, IntegrityError, transaction
+from django.utils import timezone
+
+from .importing import RowError, get_batch_size, iter_frames
+from .models import ImportRun
+
+logger = logging.getLogger(__name__)
+
+# Statuses of a run that importing the same file again resumes
+UNFINISHED = ('pending', 'running', 'failed')
+
+# Errors caused by a row's data, which reject the row rather than fail the run
+ROW_ERRORS = (DataError, IntegrityError, RowError)
+
+
+class CheckpointConflict(Exception):
+    """Another worker advanced the run's checkpoint"""
+
+
+def file_hash(path):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def open_run(kind, path, delta=False, batch_size=None):
+    """The unfinished run importing the contents of ``path`` as ``kind``, or a new one"""
+    digest = file_hash(path)
+    run = (
+        ImportRun.objects.filter(kind=kind, file_hash=digest, delta=delta, status__in=UNFINISHED)
+        .order_by('-created_at').first()
+    )
+    if run is None:
+        return ImportRun.objects.create(
+            kind=kind, path=str(path), file_hash=digest, delta=delta, batch_size=get_batch_size(batch_size),
+        )
+    # The file may have moved since, and a resumed run can use another batch size
+    run.path = str(path)
+    run.batch_size = get_batch_size(batch_size or run.batch_size)
+    run.save(update_fields=['path', 'batch_size', 'updated_at'])
+    return run
+
+
+def reject_path(run):
+    return os.path.join(settings.IMPORT_REJECT_DIR, f'{run.pk}-{run.kind}-rejects.csv')
+
+
+def trim_rejects(path, rows):
+    """Drop rejects past row ``rows``, left by chunks that were rolled back"""
+    if not os.path.exists(path):
+        return
+    rejects = pd.read_csv(path, dtype=str, keep_default_na=False)
+    rejects[rejects['row'].astype(int) <= rows].to_csv(path, index=False)
+
+
+def append_rejects(path, rejects):
+    if rejects.empty:
+        return
+    rejects = rejects.rename_axis('row').reset_index()
+    rejects = rejects[['row', 'error', *rejects.columns.drop(['row', 'error'])]]
+    rejects.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+
+
+def invalid_rows(df, columns, nullable=()):
+    """Why each row of ``df`` cannot be imported, or NA for the rows that can
+
+    ``columns`` maps column names to ``'text'``, ``'number'`` or ``'date'``, as for
+    ``fingerprint_rows``. Values must be present, except in ``nullable`` columns,
+    and parse as their kind; numbers must be finite.
+    """
+    reasons = pd.Series(pd.NA, index=df.index, dtype=object)
+    for column, kind in columns.items():
+        if column not in df:
+            continue
+        values = df[column]
+        if kind == 'number':
+            numbers = pd.to_numeric(values, errors='coerce')
+            invalid = (numbers.isna() | np.isinf(numbers)) & values.notna()
+        elif kind == 'date':
+            invalid = pd.to_datetime(values, errors='coerce').isna() & values.notna()
+        else:
+            invalid = pd.Series(False, index=df.index)
+        reasons = reasons.mask(reasons.isna() & invalid, f'invalid {column}')
+        if column not in nullable:
+            reasons = reasons.mask(reasons.isna() & values.isna(), f'missing {column}')
+    return reasons
+
+
+def write_chunk(df, write_frame, batch_size, columns, nullable=()):
+    """Import the rows of ``df`` that can be; returns (counts, rejected rows with an ``error`` column)"""
+    reasons = invalid_rows(df, columns, nullable)
+    rejects = df[reasons.notna()].assign(error=reasons[reasons.notna()])
+    valid = df[reasons.isna()]
+    valid = valid.assign(**{
+        column: pd.to_numeric(valid[column]) for column, kind in columns.items()
+        if kind == 'number' and column in valid
+    })
+
+    try:
+        with transaction.atomic():
+            counts = Counter(write_frame(valid, batch_size))
+    except ROW_ERRORS:
+        # Find the rows at fault, each in its own savepoint
+        counts, failed = Counter(), []
+        for position in range(len(valid)):
+            row = valid.iloc[position:position + 1]
+            try:
+                with transaction.atomic():
+                    counts.update(write_frame(row, batch_size))
+            except ROW_ERRORS as e:
+                failed.append(row.assign(error=str(e)))
+        rejects = pd.concat([rejects, *failed])
+
+    counts['total'] += len(rejects)
+    counts['rejected'] = len(rejects)
+    return counts, rejects
+
+
+def run_import(run, write_frame, columns, required, nullable=(), progress=None, task_id=''):
+    """Import ``run``'s file from its checkpoint on, and return the run
+
+    ``write_frame(df, batch_size)`` imports a chunk of valid rows and returns its
+    result counts. ``required`` columns must be in the file; see ``invalid_rows`` for
+    ``columns`` and ``nullable``. ``progress(run)`` is called after each chunk
+    commits. A run that fails is marked so, with its error, and can be resumed.
+    """
+    run.status = 'running'
+    run.error = ''
+    run.task_id = task_id
+    run.attempts += 1
+    run.attempt_started_at = timezone.now()
+    run.attempt_start_row = run.rows_committed
+    run.reject_path = reject_path(run)
+    run.save()
+    os.makedirs(settings.IMPORT_REJECT_DIR, exist_ok=True)
+    trim_rejects(run.reject_path, run.rows_committed)
+
+    counts = Counter(run.counts)
+    try:
+        for df in iter_frames(run.path, run.batch_size, start=run.rows_committed):
+            missing = [column for column in required if column not in df]
+            if missing:
+                raise ValueError(f"Missing columns: {', '.join(missing)}")
+            end = run.rows_committed + len(df)
+            df.index = pd.RangeIndex(run.rows_committed + 1, end + 1)  # row numbers in the file
+
+            now = timezone.now()
+            with transaction.atomic():
+                chunk, rejects = write_chunk(df, write_frame, run.batch_size, columns, nullable)
+                counts.update(chunk)
+                advanced = ImportRun.objects.filter(pk=run.pk, rows_committed=run.rows_committed).update(
+                    rows_committed=end, counts=dict(counts), updated_at=now,
+                )
+                if not advanced:
+                    raise CheckpointConflict(f'Import {run.pk} was advanced past row {run.rows_committed} by another worker')
+                append_rejects(run.reject_path, rejects)
+            run.rows_committed, run.counts, run.updated_at = end, dict(counts), now
+            if progress:
+                progress(run)
+    except CheckpointConflict:
+        # The run belongs to the other worker now, so leave its state alone
+        raise
+    except Exception as e:
+        logger.exception('Import %s failed after row %s', run.pk, run.rows_committed)
+        run.status = 'failed'
+        run.error = str(e)
+        run.save(update_fields=['status', 'error', 'updated_at'])
+        return run
+
+    run.status = 'completed'
+    run.finished_at = timezone.now()
+    run.save(update_fields=['status', 'finished_at', 'updated_at'])
+    return run
+
+
+def run_result(run):
+    """What an import task returns for a run: its counts, its ID and any error"""
+    result = {**run.counts, 'import_id': run.pk}
+    if run.status == 'failed':
+        result['error'] = run.error
+    return result
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Customer
+from .models import Customer, ImportRun
 
 class CustomerSerializer(serializers.ModelSerializer):
     class Meta:
@@ -25,3 +25,14 @@ class CustomerDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Customer
         fields = ['customer_id', 'first_name', 'last_name', 'phone_number', 'age']
+
+class ImportRunSerializer(serializers.ModelSerializer):
+    import_id = serializers.IntegerField(source='id')
+    rows_per_second = serializers.FloatField(allow_null=True)
+
+    class Meta:
+        model = ImportRun
+        fields = [
+            'import_id', 'kind', 'path', 'delta', 'status', 'rows_committed', 'rows_per_second', 'counts',
+            'reject_path', 'error', 'task_id', 'attempts', 'created_at', 'updated_at', 'finished_at',
+        ]
@@ -0,0 +1,216 @@
+"""
+Columnar snapshots of the customers and loans tables for offline analysis.
+
+``export_snapshot`` copies rows into Parquet or Arrow IPC files one chunk at a
+time. Rows are read in primary-key order, so memory use is bounded by the chunk
+size rather than the table size. Every export is a new partition under
+``<directory>/<table>/run=<run id>/``. A manifest records each table's
+``updated_at`` watermark, and the next export only copies rows changed since then.
+Deletions are only picked up by a full export, which starts a new snapshot.
+
+``read_snapshot`` memory-maps the files of a table and keeps the newest version of
+each row. Uncompressed Arrow IPC files are read without copying. Parquet files are
+decoded from the mapped pages.
+
+pyarrow is an optional dependency; ``require_pyarrow`` reports it when missing.
+"""
+
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.db import models
+from django.utils import timezone
+
+from loans.models import Loan
+from .models import Customer
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+MANIFEST = 'manifest.json'
+
+
+def snapshot_models():
+    """Exported tables by name"""
+    return {'customers': Customer, 'loans': Loan}
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError('Snapshots need pyarrow; install it with `pip install pyarrow`')
+
+
+def arrow_type(field):
+    if isinstance(field, models.ForeignKey):
+        return arrow_type(field.target_field)
+    if isinstance(field, models.DecimalField):
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if isinstance(field, models.BooleanField):
+        return pa.bool_()
+    if isinstance(field, models.DateTimeField):
+        return pa.timestamp('us', tz='UTC')
+    if isinstance(field, models.DateField):
+        return pa.date32()
+    if isinstance(field, (models.AutoField, models.IntegerField)):
+        return pa.int64()
+    return pa.string()
+
+
+def table_schema(model):
+    """Arrow schema of a model's concrete columns, named like the database columns"""
+    return pa.schema([
+        pa.field(field.column, arrow_type(field), nullable=field.null)
+        for field in model._meta.concrete_fields
+    ])
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {'tables': {}}
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def write_manifest(directory, manifest):
+    # Written last and replaced atomically, so readers never see a run that is still being written
+    temporary = os.path.join(directory, MANIFEST + '.tmp')
+    with open(temporary, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(temporary, os.path.join(directory, MANIFEST))
+
+
+class _RunWriter:
+    """Writes the record batches of one export run into a single file"""
+
+    def __init__(self, path, schema, file_format):
+        self.path = path
+        self.schema = schema
+        self.file_format = file_format
+        self.writer = None
+
+    def write(self, batch):
+        if self.writer is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if self.file_format == 'parquet':
+                self.writer = pq.ParquetWriter(self.path, self.schema)
+            else:
+                self.writer = pa.ipc.new_file(self.path, self.schema)
+        self.writer.write_batch(batch)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def export_table(model, path, file_format, since, until, chunk_size):
+    """Write rows with ``since < updated_at <= until`` to ``path``, ``chunk_size`` rows at a time
+
+    Returns the number of rows written; no file is created when there are none.
+    """
+    schema = table_schema(model)
+    fields = [field.attname for field in model._meta.concrete_fields]
+    pk = model._meta.pk.attname
+    rows = model.objects.filter(updated_at__lte=until).order_by(pk)
+    if since is not None:
+        rows = rows.filter(updated_at__gt=since)
+
+    writer = _RunWriter(path, schema, file_format)
+    written = 0
+    last_pk = None
+    try:
+        while True:
+            chunk = rows if last_pk is None else rows.filter(**{f'{pk}__gt': last_pk})
+            values = list(chunk.values_list(*fields)[:chunk_size])
+            if not values:
+                break
+            columns = list(zip(*values))
+            writer.write(pa.RecordBatch.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema,
+            ))
+            written += len(values)
+            last_pk = values[-1][fields.index(pk)]
+    finally:
+        writer.close()
+    return written
+
+
+def export_snapshot(directory, tables=None, file_format='parquet', full=False, chunk_size=50_000, lag_seconds=60):
+    """Export changed rows of ``tables`` (default: all) and advance their watermarks
+
+    Rows updated in the last ``lag_seconds`` are left for the next export, so a
+    transaction still in flight cannot commit a row behind the watermark. ``full``
+    ignores the watermark and starts a new snapshot, dropping earlier runs from the
+    manifest. Returns ``{table: rows_written}``.
+    """
+    require_pyarrow()
+    if file_format not in FORMATS:
+        raise ValueError(f'Unknown snapshot format {file_format!r}')
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    until = timezone.now() - timedelta(seconds=lag_seconds)
+    run_id = until.strftime('%Y%m%dT%H%M%S%fZ')
+
+    result = {}
+    for name, model in snapshot_models().items():
+        if tables and name not in tables:
+            continue
+        state = manifest['tables'].get(name)
+        if full or state is None or state['format'] != file_format:
+            state = {'format': file_format, 'watermark': None, 'runs': []}
+        since = state['watermark'] and datetime.fromisoformat(state['watermark'])
+
+        relative = os.path.join(name, f'run={run_id}', f'part-0{FORMATS[file_format]}')
+        rows = export_table(model, os.path.join(directory, relative), file_format, since, until, chunk_size)
+        if rows:
+            state['runs'].append({'run': run_id, 'file': relative, 'rows': rows})
+        state['watermark'] = until.isoformat()
+        manifest['tables'][name] = state
+        result[name] = rows
+
+    write_manifest(directory, manifest)
+    return result
+
+
+def _map_file(path, file_format):
+    if file_format == 'arrow':
+        return pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return pq.read_table(path, memory_map=True)
+
+
+def read_snapshot(directory, table, columns=None):
+    """The current rows of a snapshotted table as a pyarrow Table
+
+    Runs are memory-mapped and, where an incremental run re-exported a row, only its
+    newest version is kept. ``columns`` restricts the result to those columns.
+    """
+    require_pyarrow()
+    model = snapshot_models()[table]
+    state = read_manifest(directory)['tables'].get(table)
+    if state is None or not state['runs']:
+        empty = table_schema(model).empty_table()
+        return empty.select(columns) if columns else empty
+
+    pk = model._meta.pk.column
+    parts, seen = [], None
+    # Newest run first, so the first version seen of a row is the current one
+    for run in reversed(state['runs']):
+        part = _map_file(os.path.join(directory, run['file']), state['format'])
+        ids = part.column(pk).to_numpy()
+        if seen is not None:
+            keep = ~np.isin(ids, seen)
+            if not keep.all():
+                part = part.filter(pa.array(keep))
+                ids = ids[keep]
+            seen = np.concatenate([seen, ids])
+        else:
+            seen = ids
+        parts.append(part.select(columns) if columns else part)
+    parts.reverse()
+    return pa.concat_tables(parts)
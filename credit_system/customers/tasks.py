@@ -1,47 +1,195 @@
 import pandas as pd
-from decimal import Decimal
+from functools import partial
 from django.conf import settings
+from django.db import transaction
 import os
-from .models import Customer
+from .cache import bump_customer_versions
+from .importing import (
+    batches, empty_delta_result, empty_result, fingerprint_rows, get_batch_size, iter_frames, read_sheet,
+    reset_sequence, shard_frame, split_changed, stored_fingerprints, to_decimals,
+)
+from .idempotency import purge_expired_keys
+from .models import Customer, ImportRun
+from .runs import open_run, run_import, run_result
 
 # Try to import Celery, if not available, create a dummy decorator
 try:
-    from celery import shared_task
+    from celery import current_task, shared_task
     CELERY_AVAILABLE = True
 except ImportError:
     CELERY_AVAILABLE = False
     def shared_task(func):
         return func
 
+# Source columns a customer row is fingerprinted over, for delta imports
+CUSTOMER_FINGERPRINT_COLUMNS = {
+    'customer_id': 'number', 'first_name': 'text', 'last_name': 'text', 'age': 'number', 'phone_number': 'text',
+    'monthly_salary': 'number', 'approved_limit': 'number', 'current_debt': 'number',
+}
+# Columns a customer file must have; age and current_debt default when missing
+CUSTOMER_REQUIRED_COLUMNS = ['customer_id', 'first_name', 'last_name', 'phone_number', 'monthly_salary', 'approved_limit']
+# Fields a delta import overwrites on customers that already exist
+CUSTOMER_IMPORT_FIELDS = [
+    'first_name', 'last_name', 'age', 'phone_number', 'monthly_salary', 'approved_limit', 'current_debt',
+    'import_fingerprint', 'updated_at',
+]
+
+def report_progress(**meta):
+    """Publish PROGRESS state for the running Celery task, if any"""
+    if CELERY_AVAILABLE and current_task and current_task.request.id:
+        current_task.update_state(state='PROGRESS', meta=meta)
+
+def current_task_id():
+    return (current_task.request.id or '') if CELERY_AVAILABLE and current_task else ''
+
+def report_run_progress(run):
+    """Publish an import run's progress as the running task's state"""
+    report_progress(import_id=run.pk, rows=run.rows_committed, rows_per_second=run.rows_per_second, counts=run.counts)
+
+def customer_file(path=None):
+    return path or os.path.join(settings.BASE_DIR, 'customer_data.xlsx')
+
+def build_customers(df):
+    """Turn a normalized customer frame into unsaved Customer instances
+
+    A ``fingerprint`` column, when present, is stored as the rows' import fingerprint.
+    """
+    ages = df['age'] if 'age' in df else pd.Series(25, index=df.index)  # Default age if not provided
+    current_debt = df['current_debt'] if 'current_debt' in df else pd.Series(0, index=df.index)
+    fingerprints = df['fingerprint'] if 'fingerprint' in df else pd.Series(None, index=df.index, dtype=object)
+
+    return [
+        Customer(
+            customer_id=customer_id,
+            first_name=first_name,
+            last_name=last_name,
+            age=age,
+            phone_number=phone_number,
+            monthly_salary=monthly_salary,
+            approved_limit=approved_limit,
+            current_debt=debt,
+            import_fingerprint=fingerprint,
+        )
+        for customer_id, first_name, last_name, age, phone_number, monthly_salary, approved_limit, debt, fingerprint in zip(
+            df['customer_id'].astype(int).tolist(),
+            df['first_name'].tolist(),
+            df['last_name'].tolist(),
+            ages.astype(int).tolist(),
+            df['phone_number'].astype(str).tolist(),
+            to_decimals(df['monthly_salary']),
+            to_decimals(df['approved_limit']),
+            to_decimals(current_debt),
+            fingerprints.tolist(),
+        )
+    ]
+
+def import_customer_frame(df, existing_ids, batch_size, result):
+    """Bulk insert the rows of ``df`` whose customer ID is not in ``existing_ids``"""
+    result['total'] += len(df)
+    df = df[~df['customer_id'].isin(existing_ids)].drop_duplicates('customer_id')
+    df = df.assign(fingerprint=fingerprint_rows(df, CUSTOMER_FINGERPRINT_COLUMNS))
+
+    for batch in batches(build_customers(df), batch_size):
+        with transaction.atomic():
+            Customer.objects.bulk_create(batch)
+        result['inserted'] += len(batch)
+
+    result['skipped'] = result['total'] - result['inserted']
+
+def delta_customer_frame(df, stored, batch_size, result):
+    """Upsert the rows of ``df`` that are new, or differ from their ``stored`` fingerprint"""
+    result['total'] += len(df)
+    df = df.drop_duplicates('customer_id')
+    changed, inserted, updated = split_changed(
+        df, 'customer_id', fingerprint_rows(df, CUSTOMER_FINGERPRINT_COLUMNS), stored
+    )
+
+    for batch in batches(build_customers(changed), batch_size):
+        with transaction.atomic():
+            Customer.objects.bulk_create(
+                batch, update_conflicts=True, unique_fields=['customer_id'], update_fields=CUSTOMER_IMPORT_FIELDS,
+            )
+            # Upserts bypass Customer.save(), so invalidate cached eligibility here
+            bump_customer_versions(customer.customer_id for customer in batch if customer.customer_id in stored)
+
+    result['inserted'] += inserted
+    result['updated'] += updated
+    result['unchanged'] += len(df) - len(changed)
+    result['skipped'] = result['total'] - result['inserted'] - result['updated'] - result['unchanged']
+
+def import_customer_chunk(df, batch_size, result, delta=False):
+    """Import one chunk of a streamed customer file, looking up only its IDs"""
+    if delta:
+        delta_customer_frame(df, stored_fingerprints(Customer, df['customer_id'].tolist()), batch_size, result)
+        return result
+    existing_ids = set(
+        Customer.objects.filter(customer_id__in=df['customer_id'].tolist())
+        .values_list('customer_id', flat=True)
+    )
+    import_customer_frame(df, existing_ids, batch_size, result)
+    return result
+
+def write_customer_chunk(df, batch_size, delta=False):
+    """Result counts of importing one chunk of a checkpointed run"""
+    return import_customer_chunk(df, batch_size, empty_delta_result() if delta else empty_result(), delta)
+
 @shared_task
-def import_customer_data():
-    """Import customer data from Excel file"""
+def import_customer_data(path=None, batch_size=None, stream=False, shard=None, delta=False, checkpoint=False,
+                         import_id=None):
+    """Import customer data from Excel file
+
+    Returns counts of ``inserted`` rows and rows ``skipped`` because the ID already
+    exists (in the database or earlier in the file). With ``stream`` the file is
+    read and written one batch at a time so memory use does not grow with its size.
+    ``shard`` (``[index, count]``) restricts the import to customer IDs with
+    ``customer_id % count == index`` and implies streaming.
+
+    With ``delta``, existing customers are updated rather than skipped when their
+    row changed since it was imported, as told by the row's fingerprint; rows are
+    then counted as ``inserted``, ``updated``, ``unchanged`` or ``skipped`` (repeated
+    IDs).
+
+    With ``checkpoint`` the import is recorded as an ``ImportRun`` that commits a
+    checkpoint per batch and rejects bad rows to a file (see ``customers.runs``),
+    resuming the unfinished run of the same file if there is one; ``import_id``
+    resumes a given run. The result then also has ``rejected`` rows and the
+    ``import_id``.
+    """
+    result = empty_delta_result() if delta else empty_result()
     try:
         # Path to the Excel file
-        excel_path = os.path.join(settings.BASE_DIR, 'customer_data.xlsx')
-        
-        # Read Excel file
-        df = pd.read_excel(excel_path)
-
-        # Normalize column names: e.g., "Customer ID" -> "customer_id"
-        df.columns = [col.strip().lower().replace(' ', '_') for col in df.columns]
-
-        # Process each row
-        for _, row in df.iterrows():
-            # Check if customer already exists
-            if not Customer.objects.filter(customer_id=row['customer_id']).exists():
-                Customer.objects.create(
-                    customer_id=row['customer_id'],
-                    first_name=row['first_name'],
-                    last_name=row['last_name'],
-                    age=row.get('age', 25),  # Default age if not provided
-                    phone_number=str(row['phone_number']),
-                    monthly_salary=Decimal(str(row['monthly_salary'])),
-                    approved_limit=Decimal(str(row['approved_limit'])),
-                    current_debt=Decimal(str(row.get('current_debt', 0)))
-                )
-        
-        return f"Successfully imported {len(df)} customers"
-        
+        excel_path = customer_file(path)
+        batch_size = get_batch_size(batch_size)
+
+        if checkpoint or import_id:
+            run = ImportRun.objects.get(pk=import_id) if import_id else open_run('customers', excel_path, delta, batch_size)
+            run = run_import(
+                run, partial(write_customer_chunk, delta=run.delta), CUSTOMER_FINGERPRINT_COLUMNS,
+                CUSTOMER_REQUIRED_COLUMNS, progress=report_run_progress, task_id=current_task_id(),
+            )
+            reset_sequence(Customer)
+            return run_result(run)
+
+        if stream or shard:
+            for df in iter_frames(excel_path, batch_size):
+                if shard:
+                    df = shard_frame(df, 'customer_id', shard)
+                import_customer_chunk(df, batch_size, result, delta)
+        elif delta:
+            delta_customer_frame(read_sheet(excel_path), stored_fingerprints(Customer), batch_size, result)
+        else:
+            # Fetch existing IDs once instead of an exists() per row
+            existing_ids = set(Customer.objects.values_list('customer_id', flat=True))
+            import_customer_frame(read_sheet(excel_path), existing_ids, batch_size, result)
+
+        reset_sequence(Customer)
+        return result
+
     except Exception as e:
-        return f"Error importing customer data: {str(e)}" 
\ No newline at end of file
+        result['error'] = f"Error importing customer data: {str(e)}"
+        return result
+
+@shared_task
+def purge_idempotency_keys():
+    """Delete expired Idempotency-Key responses"""
+    return {'deleted': purge_expired_keys()}
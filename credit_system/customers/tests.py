@@ -1,3 +1,519 @@
-from django.test import TestCase
+import os
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.db.models import Sum
+from django.db import DataError, OperationalError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from credit_system import celery_app
+from credit_system.benchmarking import sample_customer_frame, sample_loan_frame
+from loans.models import CustomerCreditProfile, Loan
+from .idempotency import IDEMPOTENCY_HEADER, REPLAYED_HEADER
+from .models import Customer, IdempotencyKey, ImportRun
+from .parallel import ShardFailed, run_parallel_import
+from .snapshots import export_snapshot, pa, read_snapshot
+from . import importing, tasks as customer_tasks
+from .tasks import import_customer_data
+from loans import tasks as loan_tasks
+from loans.tasks import import_loan_data
+
+# Size of the generated loan file and the allowed peak of traced allocations
+STREAM_TEST_ROWS = int(os.getenv('IMPORT_STREAM_TEST_ROWS', '20000'))
+STREAM_MEMORY_LIMIT_MB = float(os.getenv('IMPORT_STREAM_MEMORY_LIMIT_MB', '16'))
+
+
+class BatchedImportTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.customers = sample_customer_frame(30)
+        self.loans = sample_loan_frame(100, 35)  # loans of customers 31-35 are orphans
+        self.customers_path = os.path.join(self.tmp.name, 'customers.xlsx')
+        self.loans_path = os.path.join(self.tmp.name, 'loans.xlsx')
+        self.customers.to_excel(self.customers_path, index=False)
+        self.loans.to_excel(self.loans_path, index=False)
+        self.orphans = int((self.loans['Customer ID'] > 30).sum())
+
+    def test_import_returns_counts_and_writes_rows_in_batches(self):
+        with CaptureQueriesContext(connection) as captured:
+            customer_result = import_customer_data(self.customers_path, batch_size=7)
+        loan_result = import_loan_data(self.loans_path, batch_size=7)
+
+        self.assertEqual(customer_result, {'total': 30, 'inserted': 30, 'skipped': 0, 'orphaned': 0})
+        self.assertEqual(loan_result, {'total': 100, 'inserted': 100 - self.orphans, 'skipped': 0,
+                                       'orphaned': self.orphans})
+        inserts = [query for query in captured if query['sql'].startswith('INSERT INTO "customers"')]
+        self.assertEqual(len(inserts), 5)  # ceil(30 / 7)
+
+        row = self.customers.iloc[4]
+        customer = Customer.objects.get(customer_id=int(row['Customer ID']))
+        self.assertEqual(customer.first_name, row['First Name'])
+        self.assertEqual(customer.phone_number, str(row['Phone Number']))
+        self.assertEqual(customer.monthly_salary, Decimal(int(row['Monthly Salary'])))
+        self.assertEqual(customer.approved_limit, Decimal(int(row['Approved Limit'])))
+
+        row = self.loans.iloc[0]
+        loan = Loan.objects.get(loan_id=int(row['Loan ID']))
+        self.assertEqual(loan.customer_id, int(row['Customer ID']))
+        self.assertEqual(loan.loan_amount, Decimal(int(row['Loan Amount'])))
+        self.assertEqual(loan.interest_rate, Decimal(str(row['Interest Rate'])))
+        self.assertEqual((loan.tenure, loan.emis_paid_on_time), (row['Tenure'], row['EMIs paid on Time']))
+        self.assertEqual(loan.start_date, row['Date of Approval'].date())
+        self.assertEqual(Loan.objects.count(), 100 - self.orphans)
+
+    def test_reimport_skips_existing_ids(self):
+        import_customer_data(self.customers_path)
+        import_loan_data(self.loans_path)
+        Customer.objects.filter(customer_id=1).update(first_name='Edited')
+
+        loan_result = import_loan_data(self.loans_path)
+        self.assertEqual(loan_result, {'total': 100, 'inserted': 0, 'skipped': 100 - self.orphans,
+                                       'orphaned': self.orphans})
+        self.assertEqual(Loan.objects.count(), 100 - self.orphans)
+
+        # The same rows again, plus two new customers, one of them listed twice
+        customers = pd.concat([self.customers, sample_customer_frame(32).tail(2), sample_customer_frame(32).tail(1)])
+        customers.to_csv(os.path.join(self.tmp.name, 'more.csv'), index=False)
+        customer_result = import_customer_data(os.path.join(self.tmp.name, 'more.csv'))
+
+        self.assertEqual(customer_result, {'total': 33, 'inserted': 2, 'skipped': 31, 'orphaned': 0})
+        self.assertEqual(Customer.objects.count(), 32)
+        # Existing customers are left as they are
+        self.assertEqual(Customer.objects.get(customer_id=1).first_name, 'Edited')
+
+
+class StreamingImportTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.customers_path = os.path.join(cls.tmp.name, 'customers.csv')
+        cls.loans_path = os.path.join(cls.tmp.name, 'loans.csv')
+        sample_customer_frame(500).to_csv(cls.customers_path, index=False)
+        sample_loan_frame(STREAM_TEST_ROWS, 500).to_csv(cls.loans_path, index=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+        super().tearDownClass()
+
+    def import_with_peak(self, task, path, **kwargs):
+        """Run an import and return (result, peak traced memory in MB)"""
+        tracemalloc.start()
+        try:
+            result = task(path, stream=True, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return result, peak / (1024 * 1024)
+
+    def test_stream_reads_xlsx_in_chunks(self):
+        sample_customer_frame(20).to_excel(os.path.join(self.tmp.name, 'small.xlsx'), index=False)
+        result = import_customer_data(os.path.join(self.tmp.name, 'small.xlsx'), batch_size=7, stream=True)
+        self.assertEqual(result, {'total': 20, 'inserted': 20, 'skipped': 0, 'orphaned': 0})
+
+        result = import_customer_data(os.path.join(self.tmp.name, 'small.xlsx'), batch_size=7, stream=True)
+        self.assertEqual(result['skipped'], 20)
+
+    def test_large_loan_file_stays_under_memory_limit(self):
+        import_customer_data(self.customers_path, stream=True)
+        result, peak_mb = self.import_with_peak(import_loan_data, self.loans_path, batch_size=1000)
+
+        self.assertNotIn('error', result)
+        self.assertEqual(result['inserted'], STREAM_TEST_ROWS)
+        self.assertEqual(Loan.objects.count(), STREAM_TEST_ROWS)
+        self.assertEqual(Customer.objects.count(), 500)
+        self.assertLess(peak_mb, STREAM_MEMORY_LIMIT_MB)
+
+
+
+class DeltaImportTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.customers = sample_customer_frame(50)
+        self.loans = sample_loan_frame(200, 50)
+        self.customers.to_csv(self.path('customers.csv'), index=False)
+        self.loans.to_csv(self.path('loans.csv'), index=False)
+        import_customer_data(self.path('customers.csv'))
+        import_loan_data(self.path('loans.csv'))
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def test_only_changed_and_new_rows_are_written(self):
+        customers = self.customers.copy()
+        customers.loc[[3, 7], 'Monthly Salary'] += 1000
+        customers = pd.concat([customers, sample_customer_frame(51).tail(1)])
+        loans = self.loans.copy()
+        loans.loc[10, 'EMIs paid on Time'] = 0
+        # Same data as .xlsx, where dates come back as timestamps rather than text
+        customers.to_excel(self.path('customers.xlsx'), index=False)
+        loans.to_excel(self.path('loans.xlsx'), index=False)
+
+        customer_result = import_customer_data(self.path('customers.xlsx'), delta=True)
+        loan_result = import_loan_data(self.path('loans.xlsx'), delta=True)
+
+        self.assertEqual(customer_result, {'total': 51, 'inserted': 1, 'updated': 2, 'unchanged': 48,
+                                           'skipped': 0, 'orphaned': 0})
+        self.assertEqual(loan_result, {'total': 200, 'inserted': 0, 'updated': 1, 'unchanged': 199,
+                                       'skipped': 0, 'orphaned': 0})
+        salary = Customer.objects.get(customer_id=int(self.customers.loc[3, 'Customer ID'])).monthly_salary
+        self.assertEqual(salary, Decimal(int(self.customers.loc[3, 'Monthly Salary']) + 1000))
+        loan = Loan.objects.get(loan_id=int(loans.loc[10, 'Loan ID']))
+        self.assertEqual(loan.emis_paid_on_time, 0)
+        profile = CustomerCreditProfile.objects.get(customer_id=loan.customer_id)
+        expected = loans.loc[loans['Customer ID'] == loan.customer_id, 'EMIs paid on Time'].sum()
+        self.assertEqual(profile.emis_paid_on_time, int(expected))
+
+    def test_unchanged_file_writes_nothing(self):
+        with CaptureQueriesContext(connection) as captured:
+            customer_result = import_customer_data(self.path('customers.csv'), delta=True)
+            loan_result = import_loan_data(self.path('loans.csv'), delta=True)
+
+        self.assertEqual((customer_result['unchanged'], loan_result['unchanged']), (50, 200))
+        writes = [query['sql'] for query in captured if not query['sql'].lstrip().upper().startswith('SELECT')]
+        self.assertEqual(writes, [])
+
+
+class CheckpointedImportTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        rejects = override_settings(IMPORT_REJECT_DIR=self.path('rejects'))
+        rejects.enable()
+        self.addCleanup(rejects.disable)
+        self.customers = sample_customer_frame(50)
+        self.loans = sample_loan_frame(200, 50)
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def test_bad_rows_are_rejected_to_a_file(self):
+        customers = self.customers.astype({'Age': object})
+        customers.loc[4, 'Age'] = 'unknown'
+        customers.loc[9, 'Phone Number'] = None
+        customers.to_csv(self.path('customers.csv'), index=False)
+        # A row that parses, but that the database refuses
+        refused = int(self.customers.loc[20, 'Customer ID'])
+        import_chunk = customer_tasks.import_customer_chunk
+
+        def refusing_chunk(df, *args, **kwargs):
+            if refused in df['customer_id'].tolist():
+                raise DataError('value out of range')
+            return import_chunk(df, *args, **kwargs)
+
+        with mock.patch.object(customer_tasks, 'import_customer_chunk', refusing_chunk):
+            result = import_customer_data(self.path('customers.csv'), batch_size=10, checkpoint=True)
+
+        self.assertEqual(result['inserted'], 47)
+        self.assertEqual(result['rejected'], 3)
+        self.assertEqual(result['total'], 50)
+        run = ImportRun.objects.get(pk=result['import_id'])
+        self.assertEqual((run.status, run.rows_committed), ('completed', 50))
+        rejects = pd.read_csv(run.reject_path)
+        self.assertEqual(rejects['row'].tolist(), [5, 10, 21])
+        self.assertEqual(rejects['error'].tolist(), ['invalid age', 'missing phone_number', 'value out of range'])
+        self.assertEqual(rejects.loc[2, 'customer_id'], refused)
+        self.assertFalse(Customer.objects.filter(customer_id=refused).exists())
+
+    def test_only_row_errors_reject_rows_and_importer_bugs_fail_the_run(self):
+        self.customers.to_csv(self.path('customers.csv'), index=False)
+        import_chunk = customer_tasks.import_customer_chunk
+
+        def row_error(df, *args, **kwargs):
+            if 7 in df['customer_id'].tolist():
+                raise importing.RowError('invalid monthly_salary: 1e999')
+            return import_chunk(df, *args, **kwargs)
+
+        with mock.patch.object(customer_tasks, 'import_customer_chunk', row_error):
+            result = import_customer_data(self.path('customers.csv'), batch_size=10, checkpoint=True)
+        self.assertEqual((result['inserted'], result['rejected']), (49, 1))
+
+        Customer.objects.all().delete()
+        with mock.patch.object(customer_tasks, 'import_customer_chunk', side_effect=TypeError('a bug')), \
+                self.assertLogs('customers.runs', 'ERROR'):
+            result = import_customer_data(self.path('customers.csv'), batch_size=10, checkpoint=True)
+
+        self.assertEqual(result['error'], 'a bug')
+        run = ImportRun.objects.get(pk=result['import_id'])
+        self.assertEqual((run.status, run.rows_committed), ('failed', 0))
+        self.assertFalse(os.path.exists(run.reject_path))
+
+    def test_non_finite_numbers_are_rejected(self):
+        customers = self.customers.astype({'Monthly Salary': object})
+        customers.loc[3, 'Monthly Salary'] = 'inf'
+        customers.to_csv(self.path('customers.csv'), index=False)
+
+        result = import_customer_data(self.path('customers.csv'), batch_size=10, checkpoint=True)
+
+        self.assertEqual((result['inserted'], result['rejected']), (49, 1))
+        rejects = pd.read_csv(ImportRun.objects.get(pk=result['import_id']).reject_path)
+        self.assertEqual(rejects['error'].tolist(), ['invalid monthly_salary'])
+        with self.assertRaisesMessage(importing.RowError, 'invalid monthly_salary: nan'):
+            importing.to_decimals(pd.Series(['1', 'nan'], name='monthly_salary'))
+
+    def test_failed_import_resumes_from_its_checkpoint(self):
+        self.customers.to_csv(self.path('customers.csv'), index=False)
+        self.loans.to_csv(self.path('loans.csv'), index=False)
+        import_customer_data(self.path('customers.csv'))
+        import_chunk = loan_tasks.import_loan_chunk
+        calls = []
+
+        def failing_chunk(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 4:
+                raise OperationalError('connection lost')
+            return import_chunk(*args, **kwargs)
+
+        with mock.patch.object(loan_tasks, 'import_loan_chunk', failing_chunk), self.assertLogs('customers.runs', 'ERROR'):
+            failed = import_loan_data(self.path('loans.csv'), batch_size=30, checkpoint=True)
+
+        self.assertEqual(failed['error'], 'connection lost')
+        run = ImportRun.objects.get(pk=failed['import_id'])
+        self.assertEqual((run.status, run.rows_committed), ('failed', 90))
+        self.assertEqual(Loan.objects.count(), 90)
+
+        resumed = import_loan_data(self.path('loans.csv'), batch_size=30, checkpoint=True)
+
+        self.assertEqual(resumed['import_id'], run.pk)
+        self.assertEqual((resumed['inserted'], resumed['total'], resumed['rejected']), (200, 200, 0))
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.rows_committed, run.attempts, run.attempt_start_row),
+                         ('completed', 200, 2, 90))
+        self.assertEqual(Loan.objects.count(), 200)
+        # A completed run is not resumed: the same file again is a new, idle run
+        again = import_loan_data(self.path('loans.csv'), checkpoint=True)
+        self.assertNotEqual(again['import_id'], run.pk)
+        self.assertEqual(again['skipped'], 200)
+
+    def test_status_endpoint(self):
+        self.customers.to_csv(self.path('customers.csv'), index=False)
+        result = import_customer_data(self.path('customers.csv'), batch_size=20, checkpoint=True)
+
+        response = self.client.get(reverse('import_status', args=[result['import_id']]))
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['kind'], body['status'], body['rows_committed']), ('customers', 'completed', 50))
+        self.assertEqual(body['counts']['inserted'], 50)
+        self.assertIn('rows_per_second', body)
+        missing = self.client.get(reverse('import_status', args=[result['import_id'] + 1]))
+        self.assertEqual(missing.status_code, 404)
+
+
+class ParallelImportTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.customers_path = os.path.join(self.tmp.name, 'customers.csv')
+        self.loans_path = os.path.join(self.tmp.name, 'loans.xlsx')
+        sample_customer_frame(60).to_csv(self.customers_path, index=False)
+        loans = sample_loan_frame(400, 70)  # some loans reference unknown customers
+        loans.to_excel(self.loans_path, index=False)
+        self.expected_orphans = int((loans['Customer ID'] > 60).sum())
+
+        # Run shards in-process without a broker
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+
+    def test_sharded_import_matches_serial_counts(self):
+        result = run_parallel_import(self.customers_path, self.loans_path, shards=3, batch_size=50)
+
+        self.assertEqual(result['customers']['inserted'], 60)
+        self.assertEqual(len(result['customers']['shards']), 3)
+        self.assertEqual(result['loans']['orphaned'], self.expected_orphans)
+        self.assertEqual(result['loans']['inserted'], 400 - self.expected_orphans)
+        self.assertEqual(Loan.objects.count(), 400 - self.expected_orphans)
+
+        # Profiles are rebuilt after the loan phase and agree with the loans table
+        profile_total = CustomerCreditProfile.objects.aggregate(total=Sum('loan_count'))['total']
+        self.assertEqual(profile_total, Loan.objects.count())
+        self.assertEqual(result['profiles'], CustomerCreditProfile.objects.count())
+
+    def test_each_file_is_parsed_once(self):
+        with mock.patch.object(importing.openpyxl, 'load_workbook', wraps=importing.openpyxl.load_workbook) as load:
+            result = run_parallel_import(self.customers_path, self.loans_path, shards=3, batch_size=50)
+
+        # The coordinator reads the loan workbook; shards read their own CSV slices
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual([shard['total'] > 0 for shard in result['loans']['shards']], [True] * 3)
+        self.assertEqual(sum(shard['total'] for shard in result['loans']['shards']), 400)
+        # The slices are removed afterwards
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ['customers.csv', 'loans.xlsx'])
+
+    def test_failed_customer_shard_stops_before_loans(self):
+        shard_frame = customer_tasks.shard_frame
+
+        def fail_second_shard(df, column, shard):
+            if list(shard) == [1, 3]:
+                raise OperationalError('connection lost')
+            return shard_frame(df, column, shard)
+
+        with mock.patch.object(customer_tasks, 'shard_frame', side_effect=fail_second_shard), \
+                self.assertRaisesMessage(ShardFailed, '1 customer shard(s) failed') as failure:
+            run_parallel_import(self.customers_path, self.loans_path, shards=3, batch_size=50)
+
+        self.assertEqual(failure.exception.result['errors'], ['Error importing customer data: connection lost'])
+        self.assertEqual(Customer.objects.count(), failure.exception.result['inserted'])
+        self.assertEqual(Loan.objects.count(), 0)
+        self.assertEqual(CustomerCreditProfile.objects.count(), 0)
+
+    def test_rerun_skips_everything(self):
+        run_parallel_import(self.customers_path, self.loans_path, shards=2)
+        result = run_parallel_import(self.customers_path, self.loans_path, shards=2)
+        self.assertEqual(result['customers']['inserted'], 0)
+        self.assertEqual(result['loans']['inserted'], 0)
+        self.assertEqual(result['customers']['skipped'], 60)
+
+
+@skipUnless(pa is not None, 'needs pyarrow')
+class SnapshotExportTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.customers_path = os.path.join(self.tmp.name, 'customers.csv')
+        self.loans_path = os.path.join(self.tmp.name, 'loans.csv')
+        sample_customer_frame(30).to_csv(self.customers_path, index=False)
+        sample_loan_frame(200, 30).to_csv(self.loans_path, index=False)
+        import_customer_data(self.customers_path)
+        import_loan_data(self.loans_path)
+        self.snapshot = os.path.join(self.tmp.name, 'snapshot')
+
+    def test_full_export_round_trips(self):
+        for file_format in ('parquet', 'arrow'):
+            with self.subTest(file_format=file_format):
+                result = export_snapshot(self.snapshot, file_format=file_format, full=True, chunk_size=64,
+                                         lag_seconds=0)
+                self.assertEqual(result, {'customers': 30, 'loans': 200})
+
+                loans = read_snapshot(self.snapshot, 'loans')
+                self.assertEqual(sorted(loans.column('loan_id').to_pylist()),
+                                 sorted(Loan.objects.values_list('loan_id', flat=True)))
+                total = sum(loans.column('loan_amount').to_pylist())
+                self.assertEqual(total, Loan.objects.aggregate(total=Sum('loan_amount'))['total'])
+
+    def test_incremental_export_keeps_newest_rows(self):
+        export_snapshot(self.snapshot, lag_seconds=0)
+        customer = Customer.objects.get(customer_id=7)
+        customer.monthly_salary = Decimal('123456.00')
+        customer.save()
+
+        result = export_snapshot(self.snapshot, lag_seconds=0)
+
+        self.assertEqual(result, {'customers': 1, 'loans': 0})
+        customers = read_snapshot(self.snapshot, 'customers', columns=['customer_id', 'monthly_salary'])
+        self.assertEqual(customers.num_rows, 30)
+        salaries = dict(zip(customers.column('customer_id').to_pylist(), customers.column('monthly_salary').to_pylist()))
+        self.assertEqual(salaries[7], Decimal('123456.00'))
+
+
+class RegisterIdempotencyTests(TestCase):
+    payload = {'first_name': 'Asha', 'last_name': 'Rao', 'age': 30, 'monthly_salary': 50000,
+               'phone_number': '9876543210'}
+
+    def register(self, key, **changes):
+        return self.client.post(reverse('register_customer'), {**self.payload, **changes},
+                                content_type='application/json', headers={IDEMPOTENCY_HEADER: key})
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.register('retry-1')
+        second = self.register('retry-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((second.status_code, second.content), (201, first.content))
+        self.assertEqual(second[REPLAYED_HEADER], 'true')
+        self.assertNotIn(REPLAYED_HEADER, first)
+        self.assertEqual(Customer.objects.count(), 1)
+
+    def test_key_reused_with_another_body_is_rejected(self):
+        self.register('retry-2')
+        response = self.register('retry-2', monthly_salary=60000)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Customer.objects.count(), 1)
+
+    def test_expired_key_runs_the_view_again(self):
+        self.register('retry-3')
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+
+        response = self.register('retry-3')
+
+        self.assertNotIn(REPLAYED_HEADER, response)
+        self.assertEqual(Customer.objects.count(), 2)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_requests_without_a_key_are_not_stored(self):
+        self.client.post(reverse('register_customer'), self.payload, content_type='application/json')
+        self.client.post(reverse('register_customer'), self.payload, content_type='application/json')
+
+        self.assertEqual(Customer.objects.count(), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class RegisterBulkTests(TestCase):
+    def payload(self, index, **changes):
+        return {'first_name': 'Bulk', 'last_name': f'Customer{index}', 'age': 30,
+                'monthly_salary': 50000 + index, 'phone_number': f'98765{index:05d}', **changes}
+
+    def test_partial_mode_registers_valid_items_in_order(self):
+        payloads = [self.payload(0), self.payload(1, age=12), self.payload(2)]
+
+        response = self.client.post(reverse('register_customer_bulk'), payloads, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        items = response.json()
+        self.assertIn('age', items[1]['errors'])
+        self.assertEqual([items[0]['name'], items[2]['name']], ['Bulk Customer0', 'Bulk Customer2'])
+        self.assertEqual(
+            sorted(Customer.objects.values_list('customer_id', flat=True)),
+            [items[0]['customer_id'], items[2]['customer_id']],
+        )
+
+    def test_bulk_matches_single_registration(self):
+        single = self.client.post(reverse('register_customer'), self.payload(7), content_type='application/json')
+        bulk = self.client.post(reverse('register_customer_bulk'), [self.payload(7)], content_type='application/json')
+
+        self.assertEqual(bulk.status_code, 201)
+        expected = {key: value for key, value in single.json().items() if key != 'customer_id'}
+        self.assertEqual({key: value for key, value in bulk.json()[0].items() if key != 'customer_id'}, expected)
+
+    def test_atomic_mode_registers_nothing_on_any_error(self):
+        payloads = [self.payload(0), self.payload(1, monthly_salary='lots')]
+
+        response = self.client.post(reverse('register_customer_bulk') + '?mode=atomic', payloads,
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(response.json()[0])
+        self.assertIn('monthly_salary', response.json()[1]['errors'])
+        self.assertFalse(Customer.objects.exists())
+
+    def test_rejects_oversized_and_unknown_modes(self):
+        url = reverse('register_customer_bulk')
+        with self.settings(REGISTER_BULK_MAX_SIZE=2):
+            response = self.client.post(url, [self.payload(i) for i in range(3)], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url + '?mode=maybe', [self.payload(0)], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_approved_limits_match_the_decimal_formula(self):
+        rng = np.random.default_rng(0)
+        salaries = [Decimal(int(cents)) / 100 for cents in rng.integers(0, 10 ** 9, 5000)]
+        # Salaries whose limit lands exactly halfway between two lakhs
+        salaries += [Decimal(lakhs * 100000 + 50000) / 36 for lakhs in range(0, 36 * 5, 1)]
+        salaries = [salary for salary in salaries if salary == salary.quantize(Decimal('0.01'))]
+
+        self.assertEqual(Customer.approved_limits(salaries),
+                         [round(salary * 36 / 100000) * 100000 for salary in salaries])
 
-# Create your tests here.
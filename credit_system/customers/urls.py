@@ -3,4 +3,6 @@ from . import views
 
 urlpatterns = [
     path('register/', views.register_customer, name='register_customer'),
+    path('register/bulk/', views.register_customer_bulk, name='register_customer_bulk'),
+    path('imports/<int:import_id>/', views.import_status, name='import_status'),
 ] 
\ No newline at end of file
@@ -1,10 +1,17 @@
+from django.conf import settings
 from django.shortcuts import render
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .models import Customer
-from .serializers import RegisterCustomerSerializer, RegisterCustomerResponseSerializer
+from credit_system.metrics import serializing
+from .idempotency import idempotent
+from .models import Customer, ImportRun
+from .serializers import ImportRunSerializer, RegisterCustomerSerializer, RegisterCustomerResponseSerializer
 
+# Partial-failure semantics of /register/bulk/
+BULK_MODES = ('partial', 'atomic')
+
+@idempotent('register_customer')
 @api_view(['POST'])
 def register_customer(request):
     """Register a new customer"""
@@ -12,7 +19,7 @@ def register_customer(request):
     if serializer.is_valid():
         # Calculate approved limit
         monthly_salary = serializer.validated_data['monthly_salary']
-        approved_limit = round(monthly_salary * 36 / 100000) * 100000  # Round to nearest lakh
+        approved_limit = Customer.approved_limits([monthly_salary])[0]
         
         # Create customer
         customer = Customer.objects.create(
@@ -24,17 +31,84 @@ def register_customer(request):
             approved_limit=approved_limit
         )
         
-        # Prepare response
-        response_data = {
-            'customer_id': customer.customer_id,
-            'name': f"{customer.first_name} {customer.last_name}",
-            'age': customer.age,
-            'monthly_salary': customer.monthly_salary,
-            'approved_limit': customer.approved_limit,
-            'phone_number': customer.phone_number
-        }
-        
-        response_serializer = RegisterCustomerResponseSerializer(response_data)
-        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+        return Response(registration(customer), status=status.HTTP_201_CREATED)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+def registration(customer):
+    """Response body of a registered customer"""
+    response_data = {
+        'customer_id': customer.customer_id,
+        'name': f"{customer.first_name} {customer.last_name}",
+        'age': customer.age,
+        'monthly_salary': customer.monthly_salary,
+        'approved_limit': customer.approved_limit,
+        'phone_number': customer.phone_number
+    }
+    with serializing():
+        return RegisterCustomerResponseSerializer(response_data).data
+
+@idempotent('register_customer_bulk')
+@api_view(['POST'])
+def register_customer_bulk(request):
+    """Register a list of customers in one request
+
+    ``?mode=partial`` (the default, see REGISTER_BULK_DEFAULT_MODE) registers the
+    valid items and reports errors for the rest; ``?mode=atomic`` registers nothing
+    unless every item is valid.
+    """
+    payloads = request.data
+    max_size = settings.REGISTER_BULK_MAX_SIZE
+    mode = request.query_params.get('mode', settings.REGISTER_BULK_DEFAULT_MODE)
+    if mode not in BULK_MODES:
+        return Response(
+            {'error': f"mode must be one of {', '.join(BULK_MODES)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not isinstance(payloads, list) or not payloads:
+        return Response(
+            {'error': 'Expected a non-empty list of customers'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(payloads) > max_size:
+        return Response(
+            {'error': f'Batch size {len(payloads)} exceeds the maximum of {max_size}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    item_serializers = [RegisterCustomerSerializer(data=payload) for payload in payloads]
+    valid = [serializer.validated_data for serializer in item_serializers if serializer.is_valid()]
+    if mode == 'atomic' and len(valid) < len(payloads):
+        errors = [{'errors': serializer.errors} if serializer.errors else None for serializer in item_serializers]
+        return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+    approved_limits = Customer.approved_limits([data['monthly_salary'] for data in valid])
+    customers = iter(Customer.objects.bulk_create([
+        Customer(
+            first_name=data['first_name'],
+            last_name=data['last_name'],
+            age=data['age'],
+            phone_number=data['phone_number'],
+            monthly_salary=data['monthly_salary'],
+            approved_limit=approved_limit,
+        )
+        for data, approved_limit in zip(valid, approved_limits)
+    ]))
+
+    with serializing():
+        response_data = [
+            registration(next(customers)) if not serializer.errors else {'errors': serializer.errors}
+            for serializer in item_serializers
+        ]
+    created = len(valid) == len(payloads)
+    return Response(response_data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+@api_view(['GET'])
+def import_status(request, import_id):
+    """Progress of a checkpointed import: its checkpoint, counts so far and throughput"""
+    try:
+        run = ImportRun.objects.get(pk=import_id)
+    except ImportRun.DoesNotExist:
+        return Response({'error': 'Import not found'}, status=status.HTTP_404_NOT_FOUND)
+    with serializing():
+        return Response(ImportRunSerializer(run).data, status=status.HTTP_200_OK)
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class LoansConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'loans'
+
+    def ready(self):
+        from . import emi
+
+        emi.configure_annuity_cache(settings.EMI_ANNUITY_CACHE_SIZE)
+        if settings.EMI_ANNUITY_CACHE_WARMUP:
+            emi.warm_annuity_cache(settings.EMI_ANNUITY_WARMUP_RATES, range(1, emi.MAX_TENURE + 1))
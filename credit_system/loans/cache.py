@@ -0,0 +1,197 @@
+"""
+Cache for eligibility results.
+
+Results are stored in Django's default cache, keyed on the customer, the request
+parameters and the customer's cache version (see ``customers.cache``). Loan writes,
+profile rebuilds and changes to a customer's approved limit or salary bump the
+version, so a cached result is never served after the data behind it changed.
+
+Misses are coalesced: concurrent identical lookups in a process share one
+computation (see ``credit_system.singleflight``), also with the cache disabled
+(``ELIGIBILITY_CACHE_TIMEOUT = 0``). With
+``ELIGIBILITY_SINGLE_FLIGHT_LOCK_SECONDS`` set, the process computing a key also
+holds a short lock in the cache, and other processes wait for its result instead
+of computing it again.
+"""
+
+import asyncio
+import threading
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+
+from credit_system.singleflight import SingleFlight
+from customers.cache import aget_customer_version, get_customer_version
+from .emi import to_decimal
+
+
+class EligibilityCacheStats:
+    """Process-wide hit/miss counters and the compute time saved by hits"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.saved_seconds = 0.0
+            self.coalesced = 0
+
+    def record_hit(self, saved_seconds):
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += max(saved_seconds, 0.0)
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def record_coalesced(self):
+        with self._lock:
+            self.coalesced += 1
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'saved_seconds': self.saved_seconds,
+                'coalesced': self.coalesced,
+            }
+
+
+stats = EligibilityCacheStats()
+flights = SingleFlight()
+
+# How often a process waiting on another's computation checks for its result
+PEER_POLL_SECONDS = 0.01
+
+
+def eligibility_cache_stats():
+    """Hit rate, latency saved and lookups coalesced by the eligibility cache in this process"""
+    return stats.snapshot()
+
+
+def eligibility_key(customer_id, version, loan_amount, interest_rate, tenure):
+    # The current year is part of the credit score, so results never outlive it
+    return 'eligibility:{}:{}:{}:{}:{}:{}'.format(
+        customer_id, version, date.today().year,
+        to_decimal(loan_amount).normalize(), to_decimal(interest_rate).normalize(), int(tenure),
+    )
+
+
+def lock_key(key):
+    return f'{key}:computing'
+
+
+def cached_eligibility(customer_id, loan_amount, interest_rate, tenure, compute):
+    """Return the cached result for these parameters, or ``compute()`` and cache it
+
+    Concurrent misses on the same key run ``compute`` once. A ``None`` result is
+    returned as is and never cached. With the cache disabled nothing is stored, but
+    concurrent identical calls in the process still share one ``compute``.
+    """
+    timeout = settings.ELIGIBILITY_CACHE_TIMEOUT
+    started = time.perf_counter()
+    key = eligibility_key(customer_id, get_customer_version(customer_id), loan_amount, interest_rate, tenure)
+    if timeout:
+        entry = cache.get(key)
+        if entry is not None:
+            result, compute_seconds = entry
+            stats.record_hit(compute_seconds - (time.perf_counter() - started))
+            return result
+
+    led = []
+
+    def lead():
+        led.append(True)
+        return compute_and_cache(key, compute, timeout) if timeout else compute()
+
+    result = flights.do(key, lead, settings.ELIGIBILITY_SINGLE_FLIGHT_TIMEOUT)
+    if not led:
+        stats.record_coalesced()
+    return result
+
+
+def compute_and_cache(key, compute, timeout):
+    """Compute and cache a missed result, or take it from another process computing it"""
+    lock_seconds = settings.ELIGIBILITY_SINGLE_FLIGHT_LOCK_SECONDS
+    locked = lock_seconds and cache.add(lock_key(key), 1, lock_seconds)
+    if lock_seconds and not locked:
+        deadline = time.monotonic() + lock_seconds
+        while time.monotonic() < deadline:
+            time.sleep(PEER_POLL_SECONDS)
+            entries = cache.get_many([key, lock_key(key)])
+            if key in entries:
+                stats.record_coalesced()
+                return entries[key][0]
+            if lock_key(key) not in entries:
+                break  # the other process failed or found no customer
+
+    try:
+        started = time.perf_counter()
+        result = compute()
+        stats.record_miss()
+        if result is not None:
+            cache.set(key, (result, time.perf_counter() - started), timeout)
+        return result
+    finally:
+        if locked:
+            cache.delete(lock_key(key))
+
+
+async def acached_eligibility(customer_id, loan_amount, interest_rate, tenure, compute):
+    """Async version of ``cached_eligibility``; ``compute`` is a coroutine function"""
+    timeout = settings.ELIGIBILITY_CACHE_TIMEOUT
+    started = time.perf_counter()
+    key = eligibility_key(customer_id, await aget_customer_version(customer_id), loan_amount, interest_rate, tenure)
+    if timeout:
+        entry = await cache.aget(key)
+        if entry is not None:
+            result, compute_seconds = entry
+            stats.record_hit(compute_seconds - (time.perf_counter() - started))
+            return result
+
+    led = []
+
+    async def lead():
+        led.append(True)
+        return await acompute_and_cache(key, compute, timeout) if timeout else await compute()
+
+    result = await flights.ado(key, lead, settings.ELIGIBILITY_SINGLE_FLIGHT_TIMEOUT)
+    if not led:
+        stats.record_coalesced()
+    return result
+
+
+async def acompute_and_cache(key, compute, timeout):
+    """Async version of ``compute_and_cache``"""
+    lock_seconds = settings.ELIGIBILITY_SINGLE_FLIGHT_LOCK_SECONDS
+    locked = lock_seconds and await cache.aadd(lock_key(key), 1, lock_seconds)
+    if lock_seconds and not locked:
+        deadline = time.monotonic() + lock_seconds
+        while time.monotonic() < deadline:
+            await asyncio.sleep(PEER_POLL_SECONDS)
+            entries = await cache.aget_many([key, lock_key(key)])
+            if key in entries:
+                stats.record_coalesced()
+                return entries[key][0]
+            if lock_key(key) not in entries:
+                break
+
+    try:
+        started = time.perf_counter()
+        result = await compute()
+        stats.record_miss()
+        if result is not None:
+            await cache.aset(key, (result, time.perf_counter() - started), timeout)
+        return result
+    finally:
+        if locked:
+            await cache.adelete(lock_key(key))
@@ -0,0 +1,182 @@
+"""
+EMI (equated monthly installment) engine.
+
+``monthly_installment`` is the reference scalar implementation: the compound
+interest formula evaluated with 10 significant digits of Decimal precision, as
+``Loan.calculate_monthly_installment`` always has, but in a local context so the
+process-wide Decimal context is left alone. The rate/tenure part of the formula,
+including the costly ``(1 + r) ** n``, is memoized per (rate, tenure) pair in a
+bounded LRU cache (see ``annuity_terms``), so a repeated pair costs only the
+principal-dependent multiply, multiply and divide.
+
+``monthly_installments`` computes the same figures for whole arrays with NumPy.
+The rate/tenure terms, including ``(1 + r) ** n`` whose Decimal rounding cannot
+be reproduced in float, are looked up once per distinct (rate, tenure) pair. The
+principal-dependent steps are vectorized, reproducing each 10-digit Decimal
+rounding in float64; the rare elements where float noise could tip one of those
+roundings fall back to the scalar path, so both paths agree to the cent.
+"""
+
+from decimal import Context, Decimal, localcontext
+from functools import lru_cache
+
+import numpy as np
+
+# Precision of the historical Decimal EMI computation
+EMI_PRECISION = 10
+
+_EMI_CONTEXT = Context(prec=EMI_PRECISION)
+
+# Rounding the final EMI to cents needs more digits than the formula itself
+_QUANTIZE_CONTEXT = Context(prec=28)
+_CENT = Decimal('0.01')
+
+# Longest tenure accepted by the API, in months
+MAX_TENURE = 120
+
+# Default number of (rate, tenure) pairs whose annuity terms are kept
+ANNUITY_CACHE_SIZE = 4096
+
+# Distance from a rounding tie, in units of the last kept digit, below which
+# float noise could flip the result
+_TIE_WINDOW = 1e-3
+
+
+def to_decimal(value):
+    """Convert ints, floats (via their shortest repr) and Decimals to Decimal"""
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, (float, np.floating)):
+        return Decimal(repr(float(value)))
+    return Decimal(int(value)) if isinstance(value, np.integer) else Decimal(value)
+
+
+def _annuity_terms(interest_rate, tenure):
+    with localcontext(_EMI_CONTEXT):
+        annual_rate = interest_rate / Decimal('100')  # Convert to decimal
+        monthly_rate = annual_rate / Decimal('12')    # Monthly interest rate
+        if monthly_rate == 0:
+            return monthly_rate, None, None
+        growth = (1 + monthly_rate) ** tenure
+        return monthly_rate, growth, growth - 1
+
+
+_cached_annuity_terms = lru_cache(maxsize=ANNUITY_CACHE_SIZE)(_annuity_terms)
+
+
+def annuity_terms(interest_rate, tenure):
+    """Return ``(monthly_rate, (1 + r) ** n, (1 + r) ** n - 1)`` at EMI precision
+
+    The last two are None for a zero rate. Results are memoized per (rate, tenure)
+    in a bounded LRU cache, so repeated quotes skip the exponentiation.
+    """
+    return _cached_annuity_terms(to_decimal(interest_rate), int(tenure))
+
+
+def configure_annuity_cache(maxsize):
+    """Replace the annuity cache with an empty one holding at most ``maxsize`` pairs"""
+    global _cached_annuity_terms
+    _cached_annuity_terms = lru_cache(maxsize=maxsize)(_annuity_terms)
+
+
+def warm_annuity_cache(interest_rates, tenures):
+    """Precompute the annuity terms of every (rate, tenure) combination"""
+    for interest_rate in interest_rates:
+        for tenure in tenures:
+            annuity_terms(interest_rate, tenure)
+
+
+def annuity_cache_info():
+    """Hit/miss counters and size of the annuity cache, as a dict"""
+    return _cached_annuity_terms.cache_info()._asdict()
+
+
+def monthly_installment(loan_amount, interest_rate, tenure):
+    """Calculate monthly installment using compound interest formula with Decimal"""
+    monthly_rate, growth, denominator = annuity_terms(interest_rate, tenure)
+    with localcontext(_EMI_CONTEXT):
+        principal = to_decimal(loan_amount)
+        if monthly_rate == 0:
+            emi = principal / int(tenure)
+        else:
+            emi = principal * monthly_rate * growth / denominator
+
+    return emi.quantize(_CENT, context=_QUANTIZE_CONTEXT)
+
+
+def _round_significant(values, uncertain):
+    """Round to EMI_PRECISION significant digits, half to even, like the Decimal context
+
+    Returns ``(mantissa, scale)`` with the rounded value equal to ``mantissa / scale``;
+    both are integral floats, so the pair is exact. Elements whose rounding could
+    go either way under float noise are flagged in ``uncertain``.
+    """
+    magnitude = np.abs(values)
+    exponent = np.floor(np.log10(np.where(magnitude > 0, magnitude, 1.0)))
+    scale = 10.0 ** (EMI_PRECISION - 1 - exponent)
+    scaled = values * scale
+    mantissa = np.round(scaled)
+
+    uncertain |= ~np.isfinite(values)
+    uncertain |= np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < _TIE_WINDOW
+    # Scales below 1 are not exact powers of ten in binary; log10 may also miss a decade
+    uncertain |= exponent >= EMI_PRECISION
+    uncertain |= (magnitude > 0) & ((np.abs(mantissa) >= 10.0 ** EMI_PRECISION) | (np.abs(mantissa) < 10.0 ** (EMI_PRECISION - 1)))
+    return mantissa, scale
+
+
+def _to_cents(mantissa, scale):
+    """Exactly round ``mantissa / scale`` to whole cents, half to even"""
+    with np.errstate(invalid='ignore'):
+        # Fewer than two decimals: the value is already a whole number of cents
+        whole = mantissa * (100 / np.minimum(scale, 100))
+        divisor = np.maximum(scale / 100, 1)
+        remainder = np.mod(mantissa, divisor)
+        cents = (mantissa - remainder) / divisor
+        twice = remainder * 2
+        cents += (twice > divisor) | ((twice == divisor) & (np.mod(cents, 2) == 1))
+    return np.where(scale < 100, whole, cents)
+
+
+def monthly_installments(loan_amounts, interest_rates, tenures):
+    """Vectorized ``monthly_installment`` over broadcastable arrays
+
+    Returns a float64 array of EMIs rounded to 2 decimal places.
+    """
+    principal, rates, months = np.broadcast_arrays(
+        np.asarray(loan_amounts, dtype=np.float64),
+        np.asarray(interest_rates, dtype=np.float64),
+        np.asarray(tenures, dtype=np.int64),
+    )
+    shape = principal.shape
+    principal, rates, months = principal.ravel(), rates.ravel(), months.ravel()
+
+    # Exact rate/tenure terms, once per distinct pair; the pair is packed into one
+    # integer key because a 1-d unique is far cheaper than a unique over rows
+    distinct_rates, rate_index = np.unique(rates, return_inverse=True)
+    span = int(months.max(initial=0)) + 1
+    keys, inverse = np.unique(rate_index.ravel() * span + months, return_inverse=True)
+    terms = [annuity_terms(distinct_rates[key // span], key % span) for key in keys.tolist()]
+    inverse = inverse.ravel()
+    monthly_rate = np.array([float(rate) for rate, _, _ in terms])[inverse]
+    growth = np.array([float(growth or 0) for _, growth, _ in terms])[inverse]
+    denominator = np.array([float(denominator or 1) for _, _, denominator in terms])[inverse]
+
+    uncertain = np.zeros(principal.shape, dtype=bool)
+
+    def rounded(values):
+        mantissa, scale = _round_significant(values, uncertain)
+        return mantissa / scale
+
+    # Mirror each rounded Decimal operation of the scalar formula
+    numerator = rounded(rounded(principal * monthly_rate) * growth)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        emi_mantissa, emi_scale = _round_significant(
+            np.where(monthly_rate == 0, principal / months, numerator / denominator), uncertain
+        )
+    result = _to_cents(emi_mantissa, emi_scale) / 100
+
+    # The few results whose float emulation is in doubt are recomputed exactly
+    for index in np.flatnonzero(uncertain):
+        result[index] = float(monthly_installment(principal[index], rates[index], months[index]))
+    return result.reshape(shape)
@@ -0,0 +1,55 @@
+import logging
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from credit_system.benchmarking import concurrent_create_loans, throwaway_database
+from customers.models import Customer
+from loans.models import CustomerCreditProfile, Loan
+
+
+class Command(BaseCommand):
+    help = 'Fire parallel /create-loan/ requests at one customer and check the approved limit holds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--attempts', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=16)
+        parser.add_argument('--loan-amount', type=int, default=100000)
+        parser.add_argument('--limit-loans', type=int, default=50,
+                            help='Approved limit, as a number of loans of --loan-amount')
+
+    def handle(self, *args, **options):
+        loan_amount = Decimal(options['loan_amount'])
+        approved_limit = loan_amount * options['limit_loans']
+
+        with throwaway_database():
+            customer = Customer.objects.create(
+                first_name='Bench', last_name='Customer', age=30, phone_number='9999999999',
+                monthly_salary=approved_limit, approved_limit=approved_limit,
+            )
+            # A repaid loan this year, so the customer scores above the approval threshold
+            Loan.objects.create(
+                customer=customer, loan_amount=loan_amount, tenure=12, interest_rate=Decimal('12'),
+                monthly_repayment=Decimal('8884.88'), emis_paid_on_time=12,
+                start_date=date.today(), end_date=date.today(), is_active=False,
+            )
+            # Rejections are expected; keep their warnings out of the report
+            logging.getLogger('django.request').setLevel(logging.ERROR)
+            codes, elapsed = concurrent_create_loans(
+                customer.customer_id, options['attempts'], options['workers'], loan_amount
+            )
+
+            active_debt = Loan.objects.active_for_customer(customer.customer_id).aggregate(total=Sum('loan_amount'))['total']
+            profile = CustomerCreditProfile.objects.get(customer=customer)
+            self.stdout.write(f'responses: {dict(codes)}')
+            self.stdout.write(
+                f"{options['attempts']} requests from {options['workers']} threads in {elapsed:.2f}s, "
+                f"{options['attempts'] / elapsed:,.0f} requests/s"
+            )
+            self.stdout.write(f'active debt {active_debt} of approved limit {approved_limit}, profile {profile.active_debt}')
+
+            if codes[201] != options['limit_loans'] or active_debt > approved_limit or profile.active_debt != active_debt:
+                self.stderr.write(self.style.ERROR('Approved limit was not enforced under concurrency'))
+            else:
+                self.stdout.write(self.style.SUCCESS('Approved limit held under concurrency'))
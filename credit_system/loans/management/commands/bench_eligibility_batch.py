@@ -0,0 +1,61 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from credit_system.benchmarking import bench_client, seed_database, throwaway_database
+
+
+class Command(BaseCommand):
+    help = 'Measure per-application cost of /check-eligibility/batch/ across batch sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--loans', type=int, default=10000)
+        parser.add_argument('--batch-sizes', default='1,10,100,1000',
+                            help='Comma separated batch sizes to compare')
+        parser.add_argument('--applications', type=int, default=2000,
+                            help='Applications scored per batch size')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        client = bench_client()
+        url = reverse('check_eligibility_batch')
+
+        with throwaway_database():
+            seed_database(options['customers'], options['loans'])
+            applications = [
+                {
+                    'customer_id': int(customer_id),
+                    'loan_amount': str(int(amount) * 1000),
+                    'interest_rate': str(round(float(rate), 2)),
+                    'tenure': int(tenure),
+                }
+                for customer_id, amount, rate, tenure in zip(
+                    rng.integers(1, options['customers'] + 1, options['applications']),
+                    rng.integers(10, 500, options['applications']),
+                    rng.uniform(8, 20, options['applications']),
+                    rng.integers(6, 120, options['applications']),
+                )
+            ]
+
+            for batch_size in [int(size) for size in options['batch_sizes'].split(',')]:
+                queries = 0
+                started = time.perf_counter()
+                for start in range(0, len(applications), batch_size):
+                    body = json.dumps(applications[start:start + batch_size])
+                    with CaptureQueriesContext(connection) as captured:
+                        response = client.post(url, body, content_type='application/json')
+                    assert response.status_code == 200, response.content
+                    queries += len(captured)
+                elapsed = time.perf_counter() - started
+
+                requests = -(-len(applications) // batch_size)
+                self.stdout.write(
+                    f'batch {batch_size:>5}: {elapsed / len(applications) * 1e6:8.1f} us/application, '
+                    f'{queries / requests:.1f} queries/request, '
+                    f'{len(applications) / elapsed:,.0f} applications/s'
+                )
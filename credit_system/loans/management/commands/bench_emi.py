@@ -0,0 +1,61 @@
+import time
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from loans import emi
+from loans.emi import monthly_installment, monthly_installments
+
+
+class Command(BaseCommand):
+    help = 'Measure EMI throughput of the vectorized engine against the scalar Decimal path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quotes', type=int, default=1_000_000)
+        parser.add_argument('--scalar-sample', type=int, default=20_000,
+                            help='Quotes run through the scalar path, and checked against the vector results')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        count = options['quotes']
+        amounts = np.round(rng.uniform(10_000, 5_000_000, count), 2)
+        # Quoted rates have two decimals; most products sit on a few standard rates
+        rates = np.round(rng.uniform(8, 20, count), 2)
+        standard = rng.random(count) < 0.8
+        rates[standard] = rng.choice([8.5, 10.0, 12.0, 14.5, 16.0], int(standard.sum()))
+        tenures = rng.integers(6, 121, count)
+
+        started = time.perf_counter()
+        vector = monthly_installments(amounts, rates, tenures)
+        vector_elapsed = time.perf_counter() - started
+
+        sample = min(options['scalar_sample'], count)
+        started = time.perf_counter()
+        scalar = [
+            monthly_installment(amount, rate, tenure)
+            for amount, rate, tenure in zip(amounts[:sample].tolist(), rates[:sample].tolist(), tenures[:sample].tolist())
+        ]
+        scalar_elapsed = time.perf_counter() - started
+
+        mismatches = sum(
+            expected != Decimal(f'{actual:.2f}') for expected, actual in zip(scalar, vector[:sample].tolist())
+        )
+        self.stdout.write(f'vector: {count:,} quotes in {vector_elapsed:.2f}s, {count / vector_elapsed:,.0f} quotes/s')
+        self.stdout.write(f'scalar: {sample:,} quotes in {scalar_elapsed:.2f}s, {sample / scalar_elapsed:,.0f} quotes/s')
+        self.stdout.write(f'mismatches in scalar sample: {mismatches}')
+
+        # Repeat quotes on the standard grid are served from the annuity cache
+        emi.configure_annuity_cache(settings.EMI_ANNUITY_CACHE_SIZE)
+        emi.warm_annuity_cache(settings.EMI_ANNUITY_WARMUP_RATES, range(1, emi.MAX_TENURE + 1))
+        grid_rates = [Decimal(rate) for rate in settings.EMI_ANNUITY_WARMUP_RATES]
+        quotes = [
+            (Decimal(f'{amount:.2f}'), grid_rates[index % len(grid_rates)], tenure)
+            for index, (amount, tenure) in enumerate(zip(amounts[:sample].tolist(), tenures[:sample].tolist()))
+        ]
+        started = time.perf_counter()
+        for amount, rate, tenure in quotes:
+            monthly_installment(amount, rate, tenure)
+        cached_elapsed = time.perf_counter() - started
+        self.stdout.write(f'scalar, cached grid: {sample / cached_elapsed:,.0f} quotes/s, cache {emi.annuity_cache_info()}')
@@ -0,0 +1,132 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from credit_system.benchmarking import (
+    endpoint_label, read_traffic, replay_in_process, seed_database, synthetic_traffic, throwaway_database,
+    write_traffic,
+)
+from credit_system.loadtest import run_load
+
+# Figures compared against a baseline, and whether a higher value is better
+COMPARED = {'requests_per_second': True, 'p95_ms': False, 'queries_per_request': False}
+
+
+def regressions(result, baseline, threshold):
+    """Figures of ``result`` that are worse than ``baseline`` by more than ``threshold`` percent"""
+    found = []
+    pairs = [('overall', result, baseline)] + [
+        (label, endpoint, baseline['endpoints'][label])
+        for label, endpoint in result['endpoints'].items()
+        if label in baseline.get('endpoints', {})
+    ]
+    for label, current, previous in pairs:
+        for figure, higher_is_better in COMPARED.items():
+            if current.get(figure) is None or not previous.get(figure):
+                continue
+            change = (current[figure] - previous[figure]) / previous[figure] * 100
+            if (-change if higher_is_better else change) > threshold:
+                found.append(f'{label} {figure}: {previous[figure]:.2f} -> {current[figure]:.2f} ({change:+.1f}%)')
+    return found
+
+
+class Command(BaseCommand):
+    help = 'Replay recorded or synthetic API traffic and report throughput, latency and queries per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--traffic', help='JSON lines of {"method", "path", "body"} to replay; '
+                                              'defaults to a synthetic register/eligibility/create/view mix')
+        parser.add_argument('--record', help='Write the replayed traffic as JSON lines to this path')
+        parser.add_argument('--url', help='Send the traffic over HTTP to this base URL instead of in-process')
+        parser.add_argument('--host', default='localhost', help='Host header to send over HTTP')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--warmup', type=int, default=200, help='Unmeasured requests sent first')
+        parser.add_argument('--customers', type=int, default=500,
+                            help='Customers seeded in-process, and the ID range of synthetic traffic')
+        parser.add_argument('--loans', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Save the results as JSON to this path')
+        parser.add_argument('--baseline', help='Results JSON of an earlier run to compare against')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Percent by which throughput, p95 or queries may worsen against the baseline')
+
+    def handle(self, *args, **options):
+        if options['traffic']:
+            requests, skipped = read_traffic(options['traffic'])
+            if skipped:
+                self.stderr.write(f'Skipped {skipped} lines of {options["traffic"]} that are not request records')
+            if not requests:
+                raise CommandError(f'{options["traffic"]} holds no request records to replay')
+        else:
+            requests = synthetic_traffic(options['requests'], options['customers'], options['loans'], options['seed'])
+        if options['record']:
+            write_traffic(options['record'], requests)
+
+        if options['url']:
+            result = self.run_http(requests, options)
+        else:
+            # Declined loans answer 400; one warning per request would drown the report
+            request_logger = logging.getLogger('django.request')
+            level = request_logger.level
+            request_logger.setLevel(logging.ERROR)
+            try:
+                result = self.run_in_process(requests, options)
+            finally:
+                request_logger.setLevel(level)
+        result.update(
+            mode='http' if options['url'] else 'in-process',
+            concurrency=options['concurrency'],
+        )
+
+        self.report(result)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(result, output, indent=2)
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                found = regressions(result, json.load(baseline), options['threshold'])
+            if found:
+                raise CommandError('Regressions past {}%:\n  {}'.format(options['threshold'], '\n  '.join(found)))
+            self.stdout.write(f'No regressions past {options["threshold"]}% against {options["baseline"]}')
+
+    def run_in_process(self, requests, options):
+        with throwaway_database():
+            seed_database(options['customers'], options['loans'], options['seed'])
+            concurrency = options['concurrency']
+            if concurrency > 1 and connection.vendor == 'sqlite' and connection.is_in_memory_db():
+                self.stderr.write('In-memory SQLite cannot serve concurrent threads; running with concurrency 1. '
+                                  'Set DJANGO_TEST_DB_NAME to a file path to benchmark concurrency.')
+                options['concurrency'] = concurrency = 1
+            if options['warmup']:
+                replay_in_process(requests, concurrency, min(options['warmup'], len(requests)))
+            return replay_in_process(requests, concurrency, options['requests'])
+
+    def run_http(self, requests, options):
+        labelled = [(method, path, body, endpoint_label(path)) for method, path, body in requests]
+        if options['warmup']:
+            run_load(options['url'], labelled, options['concurrency'], options['warmup'], options['host'])
+        result = run_load(options['url'], labelled, options['concurrency'], options['requests'], options['host'])
+        # The server's queries are not visible from the client
+        result['queries_per_request'] = None
+        for endpoint in result['endpoints'].values():
+            endpoint['queries_per_request'] = None
+        return result
+
+    def report(self, result):
+        self.stdout.write(
+            f"{result['mode']}: {result['requests']} requests, {result['concurrency']} concurrent, "
+            f"{result['seconds']:.2f}s"
+        )
+        rows = [('overall', result)] + list(result['endpoints'].items())
+        for label, figures in rows:
+            queries = figures['queries_per_request']
+            queries = 'n/a' if queries is None else f'{queries:.1f}'
+            errors = sum(count for status, count in figures['statuses'].items()
+                         if status == 'error' or int(status) >= 500)
+            self.stdout.write(
+                f"{label:>28}: {figures['requests']:6} req  {figures['requests_per_second']:8,.0f} req/s  "
+                f"p50 {figures['p50_ms']:7.1f} ms  p95 {figures['p95_ms']:7.1f} ms  p99 {figures['p99_ms']:7.1f} ms  "
+                f"queries {queries:>5}  errors {errors}"
+            )
@@ -0,0 +1,65 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from credit_system.loadtest import run_load
+
+# Path templates of each endpoint on the sync (WSGI) and async (ASGI) stacks
+ENDPOINTS = {
+    'view-loan': ('/view-loan/{loan_id}/', '/async/view-loan/{loan_id}/'),
+    'view-loans': ('/view-loans/{customer_id}/', '/async/view-loans/{customer_id}/'),
+    'check-eligibility': ('/check-eligibility/', '/async/check-eligibility/'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare requests/s and latency percentiles of the sync WSGI and async ASGI stacks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sync-url', help='Base URL of the WSGI deployment, e.g. http://localhost:8000')
+        parser.add_argument('--async-url', help='Base URL of the ASGI deployment, e.g. http://localhost:8001')
+        parser.add_argument('--endpoint', choices=ENDPOINTS, default='view-loans')
+        parser.add_argument('--concurrency', type=int, default=256)
+        parser.add_argument('--requests', type=int, default=20000)
+        parser.add_argument('--customers', type=int, default=300,
+                            help='Requests cycle through customer (and loan) IDs 1..N')
+        parser.add_argument('--host', default='localhost', help='Host header to send')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def build_requests(self, template, count):
+        if '{loan_id}' in template:
+            return [('GET', template.format(loan_id=index), None) for index in range(1, count + 1)]
+        if '{customer_id}' in template:
+            return [('GET', template.format(customer_id=index), None) for index in range(1, count + 1)]
+        return [
+            ('POST', template, {'customer_id': index, 'loan_amount': 100000, 'interest_rate': 14, 'tenure': 12})
+            for index in range(1, count + 1)
+        ]
+
+    def handle(self, *args, **options):
+        stacks = [
+            (name, url, template)
+            for name, url, template in zip(('sync', 'async'), (options['sync_url'], options['async_url']),
+                                           ENDPOINTS[options['endpoint']])
+            if url
+        ]
+        if not stacks:
+            raise CommandError('Pass --sync-url and/or --async-url')
+
+        results = {}
+        for name, url, template in stacks:
+            requests = self.build_requests(template, options['customers'])
+            # Warm up connections, caches and lazily imported code before measuring
+            run_load(url, requests, min(options['concurrency'], 16), min(options['requests'], 500), options['host'])
+            results[name] = run_load(url, requests, options['concurrency'], options['requests'], options['host'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(
+            f"{options['endpoint']}: {options['requests']} requests, {options['concurrency']} concurrent"
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:>5}: {result['requests_per_second']:8,.0f} req/s  p50 {result['p50_ms']:7.1f} ms  "
+                f"p95 {result['p95_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  statuses {result['statuses']}"
+            )
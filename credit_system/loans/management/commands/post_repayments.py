@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from loans.repayments import parse_period, post_repayment_file, previous_period, retire_matured_in_batches
+
+class Command(BaseCommand):
+    help = 'Post the EMI payments of a repayment CSV for a period, and/or retire matured loans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Repayment CSV with loan_id and optional paid_on_time columns')
+        parser.add_argument('--period', help='YYYY-MM period the payments are for (default: last month)')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Number of rows (or matured loans) handled per transaction')
+        parser.add_argument('--retire-matured', action='store_true',
+                            help='Mark active loans whose end date has passed inactive')
+
+    def handle(self, *args, **options):
+        if not options['path'] and not options['retire_matured']:
+            raise CommandError('Give a repayment file, --retire-matured, or both')
+
+        if options['path']:
+            try:
+                period = parse_period(options['period']) if options['period'] else previous_period()
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f'Posting {options["path"]} for {period:%Y-%m}...')
+            result = post_repayment_file(options['path'], period, options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Posted {result['on_time']} on-time and {result['late']} late payments; "
+                f"{result['already_posted']} already posted, {result['skipped']} skipped of {result['total']} rows"
+            ))
+
+        if options['retire_matured']:
+            retired = 0
+            for count in retire_matured_in_batches(timezone.localdate(), options['chunk_size']):
+                retired += count
+                self.stdout.write(f'Retired {retired} loans')
+            self.stdout.write(self.style.SUCCESS(f'Retired {retired} matured loans'))
@@ -0,0 +1,86 @@
+import os
+import pstats
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from credit_system.profiling import list_captures, profile_dir
+
+# Code shown ahead of everything else in summaries: the loan services and DRF serialization
+FOCUS = (
+    os.path.join('loans', 'services.py'),
+    os.path.join('rest_framework', 'serializers.py'),
+    os.path.join('rest_framework', 'fields.py'),
+    os.path.join('rest_framework', 'renderers.py'),
+)
+
+
+def hottest_functions(stats, top):
+    """``(focus, rest)`` lists of ``(cumulative_s, own_s, calls, location)``, hottest first"""
+    rows = []
+    for (filename, line, name), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append((cumulative, own, calls, f'{filename}:{line}({name})', filename.endswith(FOCUS)))
+    rows.sort(reverse=True)
+    focus = [row[:4] for row in rows if row[4]][:top]
+    rest = [row[:4] for row in rows if not row[4]][:top]
+    return focus, rest
+
+
+class Command(BaseCommand):
+    help = 'List captured request profiles, or summarize the given (or all matching) captures'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', help='Capture IDs to summarize together')
+        parser.add_argument('--endpoint', help='Only captures of this URL name')
+        parser.add_argument('--summarize', action='store_true', help='Summarize every matching capture')
+        parser.add_argument('--top', type=int, default=15, help='Functions shown per section')
+        parser.add_argument('--dir', help='Capture directory (default REQUEST_PROFILING_DIR)')
+
+    def handle(self, *args, **options):
+        directory = Path(options['dir'] or profile_dir())
+        captures = list_captures(directory) if directory.exists() else []
+        if options['endpoint']:
+            captures = [capture for capture in captures if capture['endpoint'] == options['endpoint']]
+
+        if options['ids']:
+            by_id = {capture['id']: capture for capture in captures}
+            missing = [capture_id for capture_id in options['ids'] if capture_id not in by_id]
+            if missing:
+                raise CommandError(f'No such capture: {", ".join(missing)}')
+            self.summarize([by_id[capture_id] for capture_id in options['ids']], directory, options['top'])
+        elif options['summarize']:
+            if not captures:
+                raise CommandError('No captures to summarize')
+            self.summarize(captures, directory, options['top'])
+        else:
+            self.list(captures)
+
+    def list(self, captures):
+        if not captures:
+            self.stdout.write('No captures')
+            return
+        for capture in captures:
+            self.stdout.write(
+                f"{capture['id']}  {capture['method']:4} {capture['status']}  {capture['ms']:8.1f} ms  "
+                f"{len(capture['queries']):3} queries  {'sampled' if capture['sampled'] else 'on demand'}  "
+                f"{capture['path']}"
+            )
+
+    def summarize(self, captures, directory, top):
+        stats = pstats.Stats(*(str(directory / f"{capture['id']}.prof") for capture in captures))
+        total_ms = sum(capture['ms'] for capture in captures)
+        queries = [query for capture in captures for query in capture['queries']]
+        self.stdout.write(
+            f'{len(captures)} capture(s), {total_ms / len(captures):.1f} ms per request, '
+            f'{len(queries) / len(captures):.1f} queries per request, '
+            f"{sum(query['ms'] for query in queries) / len(captures):.1f} ms SQL per request"
+        )
+
+        focus, rest = hottest_functions(stats, top)
+        for title, rows in (('loans.services and DRF serialization', focus), ('everything else', rest)):
+            self.stdout.write(f'\nHottest in {title} (cumulative ms, own ms, calls):')
+            for cumulative, own, calls, location in rows:
+                self.stdout.write(f'{cumulative * 1000:10.2f} {own * 1000:10.2f} {calls:8}  {location}')
+
+        self.stdout.write('\nSlowest SQL statements (ms):')
+        for query in sorted(queries, key=lambda query: query['ms'], reverse=True)[:top]:
+            self.stdout.write(f"{query['ms']:10.2f}  {query['sql']}")
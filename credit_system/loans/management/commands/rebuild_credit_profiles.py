@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from customers.models import Customer
+from loans.models import CustomerCreditProfile
+
+class Command(BaseCommand):
+    help = 'Recompute customer credit profiles from the loans table to reconcile drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of customers rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding credit profiles...')
+
+        customers = 0
+        profiles = 0
+        for customer_count, profile_count in CustomerCreditProfile.rebuild_in_chunks(
+            Customer.objects.all(), options['chunk_size']
+        ):
+            customers += customer_count
+            profiles += profile_count
+            self.stdout.write(f'Processed {customers} customers')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {profiles} credit profiles for {customers} customers'
+        ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from loans.scoring import rescore_in_chunks
+
+class Command(BaseCommand):
+    help = 'Recompute and store the credit score of every customer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Number of customers scored per transaction')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rescoring customers...')
+
+        customers = 0
+        profiles = 0
+        for customer_count, profile_count in rescore_in_chunks(options['chunk_size']):
+            customers += customer_count
+            profiles += profile_count
+            self.stdout.write(f'Processed {customers} customers')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored scores on {profiles} credit profiles for {customers} customers'
+        ))
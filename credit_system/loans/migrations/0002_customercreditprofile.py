@@ -0,0 +1,82 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+# Customers whose profiles are built per query and bulk insert
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def backfill_credit_profiles(apps, schema_editor):
+    """Build the profiles of customers who already have loans, one chunk of customer IDs at a time
+
+    Without them, existing customers would read as having no loans and no active debt.
+    """
+    Loan = apps.get_model('loans', 'Loan')
+    CustomerCreditProfile = apps.get_model('loans', 'CustomerCreditProfile')
+    active = Q(is_active=True)
+    customer_ids = Loan.objects.order_by('customer_id').values_list('customer_id', flat=True).distinct()
+
+    last_id = 0
+    while True:
+        chunk = list(customer_ids.filter(customer_id__gt=last_id)[:BACKFILL_CHUNK_SIZE])
+        if not chunk:
+            return
+        rows = (
+            Loan.objects.filter(customer_id__in=chunk)
+            .values('customer_id')
+            .annotate(
+                loan_count=Count('pk'),
+                emis_paid_on_time=Sum('emis_paid_on_time'),
+                emis_expected=Sum('tenure'),
+                total_loan_volume=Sum('loan_amount'),
+                active_debt=Sum('loan_amount', filter=active),
+                active_emi_total=Sum('monthly_repayment', filter=active),
+                last_start_date=Max('start_date'),
+            )
+            .order_by()
+        )
+        CustomerCreditProfile.objects.bulk_create([
+            CustomerCreditProfile(
+                customer_id=row['customer_id'],
+                active_debt=row['active_debt'] or 0,
+                active_emi_total=row['active_emi_total'] or 0,
+                loan_count=row['loan_count'],
+                emis_paid_on_time=row['emis_paid_on_time'] or 0,
+                emis_expected=row['emis_expected'] or 0,
+                total_loan_volume=row['total_loan_volume'] or 0,
+                last_loan_year=row['last_start_date'].year,
+            )
+            for row in rows
+        ])
+        last_id = chunk[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0001_initial'),
+        ('loans', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerCreditProfile',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='credit_profile', serialize=False, to='customers.customer')),
+                ('active_debt', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('active_emi_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('loan_count', models.IntegerField(default=0)),
+                ('emis_paid_on_time', models.IntegerField(default=0)),
+                ('emis_expected', models.IntegerField(default=0)),
+                ('total_loan_volume', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('last_loan_year', models.IntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'customer_credit_profiles',
+            },
+        ),
+        migrations.RunPython(backfill_credit_profiles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0003_loan_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customercreditprofile',
+            name='credit_score',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='customercreditprofile',
+            name='credit_scored_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
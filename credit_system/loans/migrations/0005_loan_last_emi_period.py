@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0004_customercreditprofile_credit_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loan',
+            name='last_emi_period',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
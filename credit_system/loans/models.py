@@ -1,27 +1,103 @@
-from django.db import models
-from decimal import Decimal, getcontext
+from django.db import models, transaction
+from django.db.models import Count, F, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from decimal import Decimal
+from customers.cache import bump_customer_versions
 from customers.models import Customer
+from .emi import monthly_installment
+
+# Loan fields that feed into CustomerCreditProfile
+CREDIT_FIELDS = ('customer_id', 'loan_amount', 'tenure', 'monthly_repayment', 'emis_paid_on_time', 'start_date', 'is_active')
+
+class LoanQuerySet(models.QuerySet):
+    """Hot-path filters, written to match the indexes declared on Loan"""
+
+    def active_for_customer(self, customer_id):
+        return self.filter(customer_id=customer_id, is_active=True)
+
+    def matured(self, as_of):
+        """Loans still marked active whose end date is before ``as_of``"""
+        return self.filter(is_active=True, end_date__lt=as_of)
+
 
 class Loan(models.Model):
     loan_id = models.AutoField(primary_key=True)
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='loans')
+    # No index of its own: loans_customer_active_idx leads with customer_id and serves
+    # every lookup by customer, including cascade deletes
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='loans', db_index=False)
     loan_amount = models.DecimalField(max_digits=12, decimal_places=2)
     tenure = models.IntegerField()  # in months
     interest_rate = models.DecimalField(max_digits=5, decimal_places=2)  # percentage
     monthly_repayment = models.DecimalField(max_digits=12, decimal_places=2)  # EMI
     emis_paid_on_time = models.IntegerField(default=0)
+    # First day of the last month whose EMI was posted (see loans.repayments)
+    last_emi_period = models.DateField(null=True, blank=True)
     start_date = models.DateField()
     end_date = models.DateField()
     is_active = models.BooleanField(default=True)
+    # Fingerprint of the spreadsheet row last imported into this loan (see customers.importing)
+    import_fingerprint = models.BigIntegerField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = LoanQuerySet.as_manager()
+
     class Meta:
         db_table = 'loans'
+        indexes = [
+            # A customer's active loans, in loan ID order for keyset pagination
+            models.Index(fields=['customer', 'is_active', 'loan_id'], name='loans_customer_active_idx'),
+            # Maturity sweep: only active loans are ever looked up by end date
+            models.Index(fields=['end_date'], condition=Q(is_active=True), name='loans_active_end_date_idx'),
+        ]
 
     def __str__(self):
         return f"Loan {self.loan_id} - {self.customer.full_name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what this loan contributed to the credit profile so save() can apply a delta
+        if all(field in field_names for field in CREDIT_FIELDS):
+            instance._credit_snapshot = instance.credit_contribution()
+        return instance
+
+    def save(self, *args, **kwargs):
+        previous = getattr(self, '_credit_snapshot', None)
+        if previous is None and not self._state.adding:
+            previous = CustomerCreditProfile.UNKNOWN
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            CustomerCreditProfile.apply_loan_change(previous, self.credit_contribution())
+            customer_ids = {self.customer_id}
+            if isinstance(previous, dict):
+                customer_ids.add(previous['customer_id'])
+            bump_customer_versions(customer_ids)
+        self._credit_snapshot = self.credit_contribution()
+
+    def delete(self, *args, **kwargs):
+        customer_id = self.customer_id
+        with transaction.atomic(savepoint=False):
+            result = super().delete(*args, **kwargs)
+            # Also invalidates the customer's cached eligibility
+            CustomerCreditProfile.rebuild([customer_id])
+        self._credit_snapshot = None
+        return result
+
+    def credit_contribution(self):
+        """What this loan adds to its customer's CustomerCreditProfile"""
+        zero = Decimal('0')
+        return {
+            'customer_id': self.customer_id,
+            'active_debt': Decimal(self.loan_amount) if self.is_active else zero,
+            'active_emi_total': Decimal(self.monthly_repayment) if self.is_active else zero,
+            'loan_count': 1,
+            'emis_paid_on_time': self.emis_paid_on_time,
+            'emis_expected': self.tenure,
+            'total_loan_volume': Decimal(self.loan_amount),
+            'start_year': self.start_date.year,
+        }
+
     @property
     def repayments_left(self):
         """Calculate remaining EMIs"""
@@ -33,17 +109,148 @@ class Loan(models.Model):
 
     def calculate_monthly_installment(self):
         """Calculate monthly installment using compound interest formula with Decimal"""
-        getcontext().prec = 10  # Set precision for Decimal operations
+        return monthly_installment(self.loan_amount, self.interest_rate, self.tenure)
+
+
+class CustomerCreditProfile(models.Model):
+    """Per-customer loan aggregates used for credit scoring, maintained on every Loan write
+
+    Bulk paths that bypass Loan.save() (bulk_create, queryset updates) must call
+    ``rebuild`` for the customers they touched; it also invalidates their cached
+    eligibility results.
+    """
+    # Sentinel for "the loan's previous contribution is not known"
+    UNKNOWN = object()
+
+    DELTA_FIELDS = ('active_debt', 'active_emi_total', 'loan_count', 'emis_paid_on_time', 'emis_expected', 'total_loan_volume')
+
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='credit_profile')
+    active_debt = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    active_emi_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    loan_count = models.IntegerField(default=0)
+    emis_paid_on_time = models.IntegerField(default=0)
+    emis_expected = models.IntegerField(default=0)
+    total_loan_volume = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    last_loan_year = models.IntegerField(null=True, blank=True)
+    # Written by the portfolio rescoring job (see loans.scoring), not on every loan write
+    credit_score = models.IntegerField(null=True, blank=True)
+    credit_scored_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'customer_credit_profiles'
+
+    def __str__(self):
+        return f"Credit profile for customer {self.customer_id}"
+
+    @staticmethod
+    def loan_aggregates():
+        """Aggregates over Loan rows that make up a profile"""
+        active = Q(is_active=True)
+        return {
+            'loan_count': Count('pk'),
+            'emis_paid_on_time': Sum('emis_paid_on_time'),
+            'emis_expected': Sum('tenure'),
+            'total_loan_volume': Sum('loan_amount'),
+            'active_debt': Sum('loan_amount', filter=active),
+            'active_emi_total': Sum('monthly_repayment', filter=active),
+            'last_start_date': Max('start_date'),
+        }
+
+    @classmethod
+    def apply_loan_change(cls, old, new):
+        """Apply the difference between two loan contributions to the affected profile(s)
+
+        ``old`` is None for a newly created loan and ``UNKNOWN`` when the previous
+        state was not loaded, in which case the customer is rebuilt from scratch.
+        """
+        if old is cls.UNKNOWN:
+            cls.rebuild([new['customer_id']])
+            return
+        if old is not None and old['customer_id'] != new['customer_id']:
+            cls.rebuild([old['customer_id'], new['customer_id']])
+            return
+        if old is not None and old['start_year'] != new['start_year']:
+            # The latest year cannot be decremented in place
+            cls.rebuild([new['customer_id']])
+            return
+
+        deltas = {
+            field: new[field] - (old[field] if old else 0)
+            for field in cls.DELTA_FIELDS
+        }
+        if old is not None and not any(deltas.values()):
+            return
+
+        year = new['start_year']
+        updated = cls.objects.filter(customer_id=new['customer_id']).update(
+            last_loan_year=Greatest(Coalesce('last_loan_year', Value(year)), Value(year)),
+            **{field: F(field) + delta for field, delta in deltas.items() if delta},
+        )
+        if not updated:
+            cls.rebuild([new['customer_id']])
+
+    @classmethod
+    def rebuild(cls, customer_ids):
+        """Recompute the profiles of the given customers from the loans table"""
+        customer_ids = set(customer_ids)
+        if not customer_ids:
+            return 0
+
+        rows = (
+            Loan.objects.filter(customer_id__in=customer_ids)
+            .values('customer_id')
+            .annotate(**cls.loan_aggregates())
+            .order_by()
+        )
+        zero = Decimal('0')
+        profiles = [
+            cls(
+                customer_id=row['customer_id'],
+                active_debt=row['active_debt'] or zero,
+                active_emi_total=row['active_emi_total'] or zero,
+                loan_count=row['loan_count'],
+                emis_paid_on_time=row['emis_paid_on_time'] or 0,
+                emis_expected=row['emis_expected'] or 0,
+                total_loan_volume=row['total_loan_volume'] or zero,
+                last_loan_year=row['last_start_date'].year,
+            )
+            for row in rows
+        ]
+        cls.objects.bulk_create(
+            profiles,
+            update_conflicts=True,
+            unique_fields=['customer'],
+            update_fields=[*cls.DELTA_FIELDS, 'last_loan_year', 'updated_at'],
+        )
+
+        # Customers whose last loan went away
+        without_loans = customer_ids - {profile.customer_id for profile in profiles}
+        if without_loans:
+            cls.objects.filter(customer_id__in=without_loans).delete()
+
+        bump_customer_versions(customer_ids)
+        return len(profiles)
 
-        principal = self.loan_amount
-        annual_rate = self.interest_rate / Decimal('100')  # Convert to decimal
-        monthly_rate = annual_rate / Decimal('12')         # Monthly interest rate
+    @classmethod
+    def rebuild_in_chunks(cls, customers, chunk_size):
+        """Rebuild the profiles of a customer queryset, one transaction per chunk
 
-        if monthly_rate == 0:
-            return round(principal / self.tenure, 2)
+        Yields ``(customers, profiles)`` counts for each chunk as it commits.
+        """
+        # Walk customers by primary key so each chunk is a cheap range scan
+        last_id = 0
+        while True:
+            customer_ids = list(
+                customers.filter(customer_id__gt=last_id)
+                .order_by('customer_id')
+                .values_list('customer_id', flat=True)[:chunk_size]
+            )
+            if not customer_ids:
+                return
 
-        numerator = principal * monthly_rate * (1 + monthly_rate) ** self.tenure
-        denominator = ((1 + monthly_rate) ** self.tenure) - 1
+            with transaction.atomic():
+                profiles = cls.rebuild(customer_ids)
 
-        emi = numerator / denominator
-        return round(emi, 2)
+            last_id = customer_ids[-1]
+            yield len(customer_ids), profiles
@@ -0,0 +1,137 @@
+"""
+Month-end EMI posting and the loan maturity sweep.
+
+A repayment file is a CSV with one row per loan whose EMI for the period was
+received: a ``loan_id`` column and an optional ``paid_on_time`` column (true/false,
+yes/no or 1/0; true when missing or blank). ``post_repayment_file`` reads it in chunks and
+posts each chunk in one transaction, with an UPDATE for the on-time payments and
+one for the late ones. An on-time payment increments ``emis_paid_on_time``. Both
+kinds set ``last_emi_period``. Loans whose ``last_emi_period`` is already at or
+past the period are left alone, so posting the same file again changes nothing.
+
+``retire_matured_in_batches`` marks active loans whose ``end_date`` has passed as
+inactive, ``batch_size`` loans per transaction, walking the partial index on
+``end_date``. It is safe to re-run, since retired loans no longer match.
+
+Both paths bypass ``Loan.save()``, so they rebuild the credit profiles of the
+customers they touched, which also invalidates their cached eligibility.
+"""
+
+from datetime import date
+
+import pandas as pd
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Least
+from django.utils import timezone
+
+from customers.importing import iter_frames
+from .models import CustomerCreditProfile, Loan
+
+TRUE_VALUES = ('1', 'true', 't', 'yes', 'y')
+
+
+def parse_period(value):
+    """The first day of a ``YYYY-MM`` period, or of the month of a date"""
+    if isinstance(value, date):
+        return value.replace(day=1)
+    try:
+        year, month = (int(part) for part in str(value).split('-'))
+        return date(year, month, 1)
+    except ValueError:
+        raise ValueError(f'Period must look like YYYY-MM, got {value!r}')
+
+
+def previous_period(today=None):
+    """The month before ``today``'s, which month-end posting closes"""
+    first = (today or timezone.localdate()).replace(day=1)
+    return date(first.year - 1, 12, 1) if first.month == 1 else date(first.year, first.month - 1, 1)
+
+
+def empty_posting_result():
+    return {'total': 0, 'on_time': 0, 'late': 0, 'already_posted': 0, 'skipped': 0}
+
+
+def repayment_frame(df):
+    """Normalize a chunk of a repayment file to ``loan_id`` and boolean ``paid_on_time`` columns
+
+    Rows without a usable loan ID are dropped.
+    """
+    loan_ids = pd.to_numeric(df['loan_id'], errors='coerce')
+    if 'paid_on_time' in df:
+        values = df['paid_on_time'].astype(str).str.strip().str.lower()
+        # A blank cell counts as on time, like a missing column; pandas reads it as NaN
+        on_time = values.isin(TRUE_VALUES) | values.eq('') | df['paid_on_time'].isna()
+    else:
+        on_time = pd.Series(True, index=df.index)
+    frame = pd.DataFrame({'loan_id': loan_ids, 'paid_on_time': on_time}).dropna(subset=['loan_id'])
+    return frame.astype({'loan_id': 'int64'})
+
+
+def post_repayment_frame(df, period, result):
+    """Post one chunk of payments for ``period`` in a single transaction"""
+    result['total'] += len(df)
+    df = repayment_frame(df).drop_duplicates('loan_id')
+    # Loans already at or past the period are excluded by the UPDATEs too, so a
+    # concurrent run of the same file cannot post a payment twice
+    pending = Q(is_active=True) & (Q(last_emi_period__isnull=True) | Q(last_emi_period__lt=period))
+
+    with transaction.atomic():
+        loans = Loan.objects.filter(loan_id__in=df['loan_id'].tolist()).values_list(
+            'loan_id', 'customer_id', 'is_active', 'last_emi_period',
+        )
+        due = {}
+        for loan_id, customer_id, is_active, last_period in loans:
+            if not is_active:
+                continue
+            if last_period is not None and last_period >= period:
+                result['already_posted'] += 1
+                continue
+            due[loan_id] = customer_id
+
+        df = df[df['loan_id'].isin(due)]
+        now = timezone.now()
+        result['on_time'] += Loan.objects.filter(pending, loan_id__in=df.loc[df['paid_on_time'], 'loan_id'].tolist()).update(
+            emis_paid_on_time=Least(F('emis_paid_on_time') + 1, F('tenure')), last_emi_period=period, updated_at=now,
+        )
+        result['late'] += Loan.objects.filter(pending, loan_id__in=df.loc[~df['paid_on_time'], 'loan_id'].tolist()).update(
+            last_emi_period=period, updated_at=now,
+        )
+        CustomerCreditProfile.rebuild(set(due.values()))
+
+    result['skipped'] = result['total'] - result['on_time'] - result['late'] - result['already_posted']
+
+
+def post_repayment_file(path, period, chunk_size):
+    """Post every payment of a repayment file for ``period``
+
+    Returns counts of ``on_time`` and ``late`` payments posted, rows ``already_posted``
+    for the period, and rows ``skipped`` (unknown or inactive loans, duplicate or
+    unreadable rows).
+    """
+    period = parse_period(period)
+    result = empty_posting_result()
+    for df in iter_frames(path, chunk_size):
+        post_repayment_frame(df, period, result)
+    return result
+
+
+def retire_matured_in_batches(as_of, batch_size):
+    """Mark loans that ended before ``as_of`` inactive, ``batch_size`` per transaction
+
+    Yields the number of loans retired by each batch as it commits.
+    """
+    while True:
+        with transaction.atomic():
+            matured = list(
+                Loan.objects.matured(as_of)
+                .order_by('end_date', 'loan_id')
+                .values_list('loan_id', 'customer_id')[:batch_size]
+            )
+            if not matured:
+                return
+            retired = Loan.objects.filter(loan_id__in=[loan_id for loan_id, _ in matured], is_active=True).update(
+                is_active=False, updated_at=timezone.now(),
+            )
+            CustomerCreditProfile.rebuild({customer_id for _, customer_id in matured})
+        yield retired
@@ -0,0 +1,132 @@
+"""
+Portfolio-wide credit scoring.
+
+``score_frames`` computes ``CreditScoreService.calculate_credit_score`` for many
+customers at once. The loans are pulled as columns with ``values_list`` and
+aggregated per customer with a pandas groupby. The four score components are then
+evaluated as whole-array NumPy expressions. Money is handled in integer cents, so
+each threshold comparison gives exactly the same result as the Decimal comparison
+of the per-customer path.
+
+``rescore_in_chunks`` walks customers by ID in chunks. It stores each chunk's
+scores on the credit profiles with one UPDATE per distinct score, and yields after
+each chunk for progress reporting.
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, ExtractYear, Round
+from django.utils import timezone
+
+from customers.models import Customer
+from .models import CustomerCreditProfile, Loan
+
+# Loan volume thresholds of score component 4, in cents, highest first, with their points
+VOLUME_POINTS = ((100_000_000, 20), (50_000_000, 15), (10_000_000, 10))
+# Loan count thresholds of score component 2, highest first, with their points
+COUNT_POINTS = ((5, 25), (3, 20), (1, 15))
+
+
+def cents(field):
+    """Database expression for a two-decimal money column as whole cents"""
+    return Cast(Round(F(field) * 100), BigIntegerField())
+
+
+def load_customer_frame(first_id, last_id):
+    """Customers with ``first_id <= customer_id <= last_id`` and their approved limits in cents"""
+    rows = (
+        Customer.objects.filter(customer_id__gte=first_id, customer_id__lte=last_id)
+        .order_by('customer_id')
+        .values_list('customer_id', cents('approved_limit'))
+    )
+    return pd.DataFrame(list(rows), columns=['customer_id', 'approved_limit'])
+
+
+def load_loan_frame(first_id, last_id):
+    """The scoring columns of the loans of customers in the ID range"""
+    rows = (
+        Loan.objects.filter(customer_id__gte=first_id, customer_id__lte=last_id)
+        .order_by()
+        .values_list('customer_id', cents('loan_amount'), 'tenure', 'emis_paid_on_time', 'is_active',
+                     ExtractYear('start_date'))
+    )
+    return pd.DataFrame(
+        list(rows), columns=['customer_id', 'loan_amount', 'tenure', 'emis_paid_on_time', 'is_active', 'start_year'],
+    )
+
+
+def score_frames(customers, loans, year=None):
+    """Credit scores of the ``customers`` frame's rows, as an int array in the same order
+
+    ``loans`` holds every loan of those customers, as from ``load_loan_frame``.
+    ``year`` defaults to the current year, like the per-customer path.
+    """
+    if year is None:
+        year = datetime.now().year
+    loans = loans.assign(active_amount=loans['loan_amount'].where(loans['is_active'].astype(bool), 0))
+    stats = loans.groupby('customer_id', sort=False).agg(
+        loan_count=('tenure', 'size'),
+        emis_paid_on_time=('emis_paid_on_time', 'sum'),
+        emis_expected=('tenure', 'sum'),
+        total_loan_volume=('loan_amount', 'sum'),
+        active_debt=('active_amount', 'sum'),
+        last_loan_year=('start_year', 'max'),
+    ).reindex(customers['customer_id'], fill_value=0)
+
+    loan_count = stats['loan_count'].to_numpy(dtype=np.int64)
+    paid = stats['emis_paid_on_time'].to_numpy(dtype=np.int64)
+    expected = stats['emis_expected'].to_numpy(dtype=np.int64)
+    volume = stats['total_loan_volume'].to_numpy(dtype=np.int64)
+
+    # 1. Past loans paid on time; true division then truncation, like int(paid / expected * 30)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        on_time = np.where(expected > 0, np.minimum(30, np.floor(paid / expected * 30)), 0).astype(np.int64)
+    # 2. Number of loans taken in past
+    count = np.select([loan_count >= threshold for threshold, _ in COUNT_POINTS],
+                      [points for _, points in COUNT_POINTS], 0)
+    # 3. Loan activity in current year
+    activity = np.where(stats['last_loan_year'].to_numpy(dtype=np.int64) == year, 25, 0)
+    # 4. Loan approved volume
+    approved = np.select([volume >= threshold for threshold, _ in VOLUME_POINTS],
+                         [points for _, points in VOLUME_POINTS], 0)
+
+    over_limit = stats['active_debt'].to_numpy(dtype=np.int64) > customers['approved_limit'].to_numpy(dtype=np.int64)
+    scored = (loan_count > 0) & ~over_limit
+    return np.where(scored, np.minimum(100, on_time + count + activity + approved), 0)
+
+
+def rescore_in_chunks(chunk_size, year=None):
+    """Score every customer and store the scores on their credit profiles
+
+    Customers are processed in ID order, ``chunk_size`` at a time, one transaction per
+    chunk. Yields ``(customers, profiles_updated)`` counts per chunk as it commits.
+    Customers without loans have no profile; their score is 0.
+    """
+    last_id = 0
+    while True:
+        customer_ids = list(
+            Customer.objects.filter(customer_id__gt=last_id)
+            .order_by('customer_id')
+            .values_list('customer_id', flat=True)[:chunk_size]
+        )
+        if not customer_ids:
+            return
+        first_id, last_id = customer_ids[0], customer_ids[-1]
+
+        customers = load_customer_frame(first_id, last_id)
+        scores = score_frames(customers, load_loan_frame(first_id, last_id), year)
+        ids = customers['customer_id'].to_numpy()
+        scored_at = timezone.now()
+        # Scores take at most 101 values, so one UPDATE per distinct score is far
+        # cheaper than a per-row CASE from bulk_update
+        updated = 0
+        with transaction.atomic():
+            for score in np.unique(scores).tolist():
+                updated += CustomerCreditProfile.objects.filter(
+                    customer_id__in=ids[scores == score].tolist()
+                ).update(credit_score=score, credit_scored_at=scored_at)
+        yield len(customers), updated
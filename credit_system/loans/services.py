@@ -1,44 +1,74 @@
 from decimal import Decimal
-from datetime import datetime, date
-from django.db.models import Sum, Count
+from datetime import datetime, date, timedelta
+from django.db import transaction
 from customers.models import Customer
-from .models import Loan
+from .models import CustomerCreditProfile, Loan
+from . import emi
+from .cache import acached_eligibility, cached_eligibility
 
 class CreditScoreService:
     @staticmethod
-    def calculate_credit_score(customer_id):
-        """Calculate credit score based on historical loan data"""
+    def get_customer_with_loan_stats(customer_id):
+        """Fetch the customer together with its maintained credit profile in a single query"""
+        customer = Customer.objects.select_related('credit_profile').get(customer_id=customer_id)
+        return CreditScoreService._ensure_profile(customer)
+
+    @staticmethod
+    async def aget_customer_with_loan_stats(customer_id):
+        """Async version of ``get_customer_with_loan_stats``"""
+        customer = await Customer.objects.select_related('credit_profile').aget(customer_id=customer_id)
+        return CreditScoreService._ensure_profile(customer)
+
+    @staticmethod
+    def get_customers_with_loan_stats(customer_ids):
+        """Batch version of ``get_customer_with_loan_stats``: one query, keyed by customer ID"""
+        customers = Customer.objects.select_related('credit_profile').in_bulk(customer_ids)
+        for customer in customers.values():
+            CreditScoreService._ensure_profile(customer)
+        return customers
+
+    @staticmethod
+    def _ensure_profile(customer):
         try:
-            customer = Customer.objects.get(customer_id=customer_id)
-        except Customer.DoesNotExist:
-            return 0
+            customer.credit_profile
+        except CustomerCreditProfile.DoesNotExist:
+            # No loans recorded yet
+            customer.credit_profile = CustomerCreditProfile(customer=customer)
+        return customer
 
-        # Get all loans for the customer
-        loans = Loan.objects.filter(customer=customer)
-        
-        if not loans.exists():
+    @staticmethod
+    def calculate_credit_score(customer_id, customer=None):
+        """Calculate credit score based on historical loan data
+
+        ``customer`` may be a result of ``get_customer_with_loan_stats`` so callers
+        that already loaded the profile don't pay for it twice.
+        """
+        if customer is None:
+            try:
+                customer = CreditScoreService.get_customer_with_loan_stats(customer_id)
+            except Customer.DoesNotExist:
+                return 0
+
+        profile = customer.credit_profile
+        if profile.loan_count == 0:
             return 0
 
         # Check if current debt exceeds approved limit
-        current_debt = loans.filter(is_active=True).aggregate(
-            total_debt=Sum('loan_amount')
-        )['total_debt'] or Decimal('0')
-        
-        if current_debt > customer.approved_limit:
+        if profile.active_debt > customer.approved_limit:
             return 0
 
         # Calculate credit score components
         score = 0
         
         # 1. Past loans paid on time (30 points)
-        total_emis_paid = sum(loan.emis_paid_on_time for loan in loans)
-        total_emis_expected = sum(loan.tenure for loan in loans)
+        total_emis_paid = profile.emis_paid_on_time
+        total_emis_expected = profile.emis_expected
         if total_emis_expected > 0:
             on_time_ratio = total_emis_paid / total_emis_expected
             score += min(30, int(on_time_ratio * 30))
 
         # 2. Number of loans taken in past (25 points)
-        loan_count = loans.count()
+        loan_count = profile.loan_count
         if loan_count >= 5:
             score += 25
         elif loan_count >= 3:
@@ -47,15 +77,11 @@ class CreditScoreService:
             score += 15
 
         # 3. Loan activity in current year (25 points)
-        current_year = datetime.now().year
-        current_year_loans = loans.filter(start_date__year=current_year)
-        if current_year_loans.exists():
+        if profile.last_loan_year == datetime.now().year:
             score += 25
 
         # 4. Loan approved volume (20 points)
-        total_loan_volume = loans.aggregate(
-            total_volume=Sum('loan_amount')
-        )['total_volume'] or Decimal('0')
+        total_loan_volume = profile.total_loan_volume
         
         if total_loan_volume >= Decimal('1000000'):  # 10 lakhs
             score += 20
@@ -68,29 +94,24 @@ class CreditScoreService:
 
 class LoanEligibilityService:
     @staticmethod
-    def check_eligibility(customer_id, loan_amount, interest_rate, tenure):
-        """Check loan eligibility and return appropriate response"""
-        try:
-            customer = Customer.objects.get(customer_id=customer_id)
-        except Customer.DoesNotExist:
-            return {
-                'customer_id': customer_id,
-                'approval': False,
-                'interest_rate': interest_rate,
-                'corrected_interest_rate': interest_rate,
-                'tenure': tenure,
-                'monthly_installment': 0,
-                'message': 'Customer not found'
-            }
+    def check_eligibility(customer_id, loan_amount, interest_rate, tenure, customer=None, quote=True):
+        """Check loan eligibility and return appropriate response
+
+        ``customer`` may be passed in from ``get_customer_with_loan_stats`` to reuse
+        an already loaded profile. With ``quote=False`` the EMI of an approved loan is
+        left for the caller to fill in.
+        """
+        if customer is None:
+            try:
+                customer = CreditScoreService.get_customer_with_loan_stats(customer_id)
+            except Customer.DoesNotExist:
+                return LoanEligibilityService.customer_not_found(customer_id, interest_rate, tenure)
 
         # Calculate credit score
-        credit_score = CreditScoreService.calculate_credit_score(customer_id)
+        credit_score = CreditScoreService.calculate_credit_score(customer_id, customer=customer)
         
         # Check current debt vs approved limit
-        current_loans = Loan.objects.filter(customer=customer, is_active=True)
-        current_debt = current_loans.aggregate(
-            total_debt=Sum('loan_amount')
-        )['total_debt'] or Decimal('0')
+        current_debt = customer.credit_profile.active_debt
         
         if current_debt + loan_amount > customer.approved_limit:
             return {
@@ -104,9 +125,7 @@ class LoanEligibilityService:
             }
 
         # Check if current EMIs > 50% of monthly salary
-        current_monthly_emis = current_loans.aggregate(
-            total_emi=Sum('monthly_repayment')
-        )['total_emi'] or Decimal('0')
+        current_monthly_emis = customer.credit_profile.active_emi_total
         
         if current_monthly_emis > customer.monthly_salary * Decimal('0.5'):
             return {
@@ -145,14 +164,8 @@ class LoanEligibilityService:
 
         # Calculate monthly installment
         monthly_installment = 0
-        if approval:
-            # Create temporary loan object to calculate EMI
-            temp_loan = Loan(
-                loan_amount=loan_amount,
-                interest_rate=corrected_interest_rate,
-                tenure=tenure
-            )
-            monthly_installment = temp_loan.calculate_monthly_installment()
+        if approval and quote:
+            monthly_installment = emi.monthly_installment(loan_amount, corrected_interest_rate, tenure)
 
         return {
             'customer_id': customer_id,
@@ -162,4 +175,135 @@ class LoanEligibilityService:
             'tenure': tenure,
             'monthly_installment': monthly_installment,
             'message': 'Loan approved' if approval else 'Loan not approved based on credit score'
-        } 
\ No newline at end of file
+        }
+
+    @staticmethod
+    def check_eligibility_cached(customer_id, loan_amount, interest_rate, tenure):
+        """``check_eligibility`` served from the eligibility cache when possible"""
+        def compute():
+            try:
+                customer = CreditScoreService.get_customer_with_loan_stats(customer_id)
+            except Customer.DoesNotExist:
+                return None
+            return LoanEligibilityService.check_eligibility(
+                customer_id, loan_amount, interest_rate, tenure, customer=customer
+            )
+
+        # Unknown customers are not cached; they may register at any moment
+        result = cached_eligibility(customer_id, loan_amount, interest_rate, tenure, compute)
+        if result is None:
+            return LoanEligibilityService.customer_not_found(customer_id, interest_rate, tenure)
+        return result
+
+    @staticmethod
+    async def acheck_eligibility_cached(customer_id, loan_amount, interest_rate, tenure):
+        """Async version of ``check_eligibility_cached``
+
+        The customer and its profile are loaded with the async ORM; the check itself
+        then runs on the loaded objects without further queries.
+        """
+        async def compute():
+            try:
+                customer = await CreditScoreService.aget_customer_with_loan_stats(customer_id)
+            except Customer.DoesNotExist:
+                return None
+            return LoanEligibilityService.check_eligibility(
+                customer_id, loan_amount, interest_rate, tenure, customer=customer
+            )
+
+        result = await acached_eligibility(customer_id, loan_amount, interest_rate, tenure, compute)
+        if result is None:
+            return LoanEligibilityService.customer_not_found(customer_id, interest_rate, tenure)
+        return result
+
+    @staticmethod
+    def check_eligibility_batch(applications):
+        """Check many applications, loading every referenced customer in one query
+
+        ``applications`` is a list of dicts with the ``check_eligibility`` arguments;
+        results come back in the same order.
+        """
+        customers = CreditScoreService.get_customers_with_loan_stats(
+            {application['customer_id'] for application in applications}
+        )
+        results = []
+        for application in applications:
+            customer = customers.get(application['customer_id'])
+            if customer is None:
+                results.append(LoanEligibilityService.customer_not_found(
+                    application['customer_id'], application['interest_rate'], application['tenure']
+                ))
+                continue
+            results.append(LoanEligibilityService.check_eligibility(
+                application['customer_id'],
+                application['loan_amount'],
+                application['interest_rate'],
+                application['tenure'],
+                customer=customer,
+                quote=False,
+            ))
+
+        # Quote every approved loan in one vectorized pass
+        approved = [(application, result) for application, result in zip(applications, results) if result['approval']]
+        if approved:
+            installments = emi.monthly_installments(
+                [float(application['loan_amount']) for application, _ in approved],
+                [float(result['corrected_interest_rate']) for _, result in approved],
+                [int(application['tenure']) for application, _ in approved],
+            )
+            for (_, result), installment in zip(approved, installments.tolist()):
+                result['monthly_installment'] = Decimal(f'{installment:.2f}')
+        return results
+
+    @staticmethod
+    def customer_not_found(customer_id, interest_rate, tenure):
+        return {
+            'customer_id': customer_id,
+            'approval': False,
+            'interest_rate': interest_rate,
+            'corrected_interest_rate': interest_rate,
+            'tenure': tenure,
+            'monthly_installment': 0,
+            'message': 'Customer not found'
+        }
+
+
+class LoanOriginationService:
+    @staticmethod
+    def create_loan(customer_id, loan_amount, interest_rate, tenure):
+        """Check eligibility and create the loan in one transaction, holding the customer's row lock
+
+        Concurrent requests for the same customer queue on the lock, so each one sees
+        the debt and EMIs of the loans committed before it. Returns
+        ``(loan, eligibility_result)``; ``loan`` is None when the loan is not approved.
+        """
+        with transaction.atomic(savepoint=False):
+            try:
+                customer = Customer.objects.select_for_update().get(customer_id=customer_id)
+            except Customer.DoesNotExist:
+                return None, LoanEligibilityService.customer_not_found(customer_id, interest_rate, tenure)
+
+            # Read the profile only once the lock is held; a join in the locking query
+            # could return the profile as it was before the previous holder committed
+            customer.credit_profile = (
+                CustomerCreditProfile.objects.filter(customer_id=customer_id).first()
+                or CustomerCreditProfile(customer=customer)
+            )
+            eligibility = LoanEligibilityService.check_eligibility(
+                customer_id, loan_amount, interest_rate, tenure, customer=customer
+            )
+            if not eligibility['approval']:
+                return None, eligibility
+
+            today = datetime.now().date()
+            loan = Loan(
+                customer=customer,
+                loan_amount=loan_amount,
+                tenure=tenure,
+                interest_rate=eligibility['corrected_interest_rate'],
+                monthly_repayment=eligibility['monthly_installment'],
+                start_date=today,
+                end_date=today + timedelta(days=tenure * 30),
+            )
+            loan.save()
+            return loan, eligibility
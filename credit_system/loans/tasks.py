@@ -1,10 +1,22 @@
 import pandas as pd
-from decimal import Decimal
-from datetime import datetime
 from django.conf import settings
+from django.db import transaction
 import os
-from .models import Loan
-from customers.models import Customer
+from .emi import monthly_installments
+from .models import Loan, CustomerCreditProfile
+from .repayments import empty_posting_result, parse_period, post_repayment_file, previous_period, retire_matured_in_batches
+from .scoring import rescore_in_chunks
+from customers.importing import (
+    batches, empty_delta_result, empty_result, fingerprint_rows, get_batch_size, iter_frames, read_sheet,
+    reset_sequence, shard_frame, split_changed, stored_fingerprints, to_decimals,
+)
+from customers.runs import open_run, run_import, run_result
+from customers.tasks import current_task_id, report_progress, report_run_progress
+from django.db.models.functions import Mod
+from django.utils import timezone
+from datetime import date
+from functools import partial
+from customers.models import Customer, ImportRun
 
 # Try to import Celery, if not available, create a dummy decorator
 try:
@@ -15,49 +27,270 @@ except ImportError:
     def shared_task(func):
         return func
 
+def fill_monthly_payments(df):
+    """Quote the EMI for rows whose monthly payment is missing"""
+    missing = df['monthly_payment'].isna()
+    if not missing.any():
+        return df
+    quoted = monthly_installments(
+        df.loc[missing, 'loan_amount'].to_numpy(dtype=float),
+        df.loc[missing, 'interest_rate'].to_numpy(dtype=float),
+        df.loc[missing, 'tenure'].to_numpy(dtype=int),
+    )
+    df = df.copy()
+    df.loc[missing, 'monthly_payment'] = quoted.round(2)
+    return df
+
+# Source columns a loan row is fingerprinted over, for delta imports
+LOAN_FINGERPRINT_COLUMNS = {
+    'customer_id': 'number', 'loan_id': 'number', 'loan_amount': 'number', 'tenure': 'number',
+    'interest_rate': 'number', 'monthly_payment': 'number', 'emis_paid_on_time': 'number',
+    'date_of_approval': 'date', 'end_date': 'date',
+}
+# Columns a loan file must have; a blank monthly_payment is quoted from the loan's terms
+LOAN_REQUIRED_COLUMNS = list(LOAN_FINGERPRINT_COLUMNS)
+LOAN_NULLABLE_COLUMNS = ['monthly_payment']
+# Fields a delta import overwrites on loans that already exist; is_active and
+# last_emi_period are left as maturity and EMI posting set them
+LOAN_IMPORT_FIELDS = [
+    'customer', 'loan_amount', 'tenure', 'interest_rate', 'monthly_repayment', 'emis_paid_on_time',
+    'start_date', 'end_date', 'import_fingerprint', 'updated_at',
+]
+
+def loan_file(path=None):
+    return path or os.path.join(settings.BASE_DIR, 'loan_data.xlsx')
+
+def build_loans(df):
+    """Turn a normalized loan frame into unsaved Loan instances
+
+    A ``fingerprint`` column, when present, is stored as the rows' import fingerprint.
+    """
+    fingerprints = df['fingerprint'] if 'fingerprint' in df else pd.Series(None, index=df.index, dtype=object)
+    df = fill_monthly_payments(df)
+    # Parse dates from 'date_of_approval' and 'end_date'
+    start_dates = pd.to_datetime(df['date_of_approval']).dt.date
+    end_dates = pd.to_datetime(df['end_date']).dt.date
+
+    return [
+        Loan(
+            loan_id=loan_id,
+            customer_id=customer_id,
+            loan_amount=loan_amount,
+            tenure=tenure,
+            interest_rate=interest_rate,
+            monthly_repayment=monthly_repayment,
+            emis_paid_on_time=emis_paid_on_time,
+            start_date=start_date,
+            end_date=end_date,
+            is_active=True,
+            import_fingerprint=fingerprint,
+        )
+        for loan_id, customer_id, loan_amount, tenure, interest_rate, monthly_repayment, emis_paid_on_time, start_date, end_date, fingerprint in zip(
+            df['loan_id'].astype(int).tolist(),
+            df['customer_id'].astype(int).tolist(),
+            to_decimals(df['loan_amount']),
+            df['tenure'].astype(int).tolist(),
+            to_decimals(df['interest_rate']),
+            to_decimals(df['monthly_payment']),
+            df['emis_paid_on_time'].astype(int).tolist(),
+            start_dates.tolist(),
+            end_dates.tolist(),
+            fingerprints.tolist(),
+        )
+    ]
+
+def import_loan_frame(df, customer_ids, loan_ids, batch_size, result, rebuild_profiles=True):
+    """Bulk insert the rows of ``df`` for known customers whose loan ID is not in ``loan_ids``"""
+    result['total'] += len(df)
+    orphaned = ~df['customer_id'].isin(customer_ids)
+    result['orphaned'] += int(orphaned.sum())
+    df = df[~orphaned]
+    df = df[~df['loan_id'].isin(loan_ids)].drop_duplicates('loan_id')
+    df = df.assign(fingerprint=fingerprint_rows(df, LOAN_FINGERPRINT_COLUMNS))
+
+    for batch in batches(build_loans(df), batch_size):
+        with transaction.atomic():
+            Loan.objects.bulk_create(batch)
+            # bulk_create bypasses Loan.save(), so refresh the touched profiles here
+            if rebuild_profiles:
+                CustomerCreditProfile.rebuild({loan.customer_id for loan in batch})
+        result['inserted'] += len(batch)
+
+    result['skipped'] = result['total'] - result['inserted'] - result['orphaned']
+
+def delta_loan_frame(df, customer_ids, stored, batch_size, result, rebuild_profiles=True):
+    """Upsert the rows of ``df`` for known customers that are new, or differ from their ``stored`` fingerprint"""
+    result['total'] += len(df)
+    orphaned = ~df['customer_id'].isin(customer_ids)
+    result['orphaned'] += int(orphaned.sum())
+    df = df[~orphaned].drop_duplicates('loan_id')
+    changed, inserted, updated = split_changed(df, 'loan_id', fingerprint_rows(df, LOAN_FINGERPRINT_COLUMNS), stored)
+
+    for batch in batches(build_loans(changed), batch_size):
+        with transaction.atomic():
+            if rebuild_profiles:
+                # A loan moved to another customer changes its old customer's profile too
+                touched = {loan.customer_id for loan in batch}
+                touched.update(
+                    Loan.objects.filter(loan_id__in=[loan.loan_id for loan in batch if loan.loan_id in stored])
+                    .values_list('customer_id', flat=True)
+                )
+            Loan.objects.bulk_create(
+                batch, update_conflicts=True, unique_fields=['loan_id'], update_fields=LOAN_IMPORT_FIELDS,
+            )
+            # Upserts bypass Loan.save(), so refresh the touched profiles here
+            if rebuild_profiles:
+                CustomerCreditProfile.rebuild(touched)
+
+    result['inserted'] += inserted
+    result['updated'] += updated
+    result['unchanged'] += len(df) - len(changed)
+    result['skipped'] = (
+        result['total'] - result['inserted'] - result['updated'] - result['unchanged'] - result['orphaned']
+    )
+
+def import_loan_chunk(df, batch_size, result, delta=False, rebuild_profiles=True):
+    """Import one chunk of a streamed loan file, looking up only its customers and loans"""
+    customer_ids = set(
+        Customer.objects.filter(customer_id__in=df['customer_id'].unique().tolist())
+        .values_list('customer_id', flat=True)
+    )
+    if delta:
+        delta_loan_frame(
+            df, customer_ids, stored_fingerprints(Loan, df['loan_id'].tolist()), batch_size, result,
+            rebuild_profiles=rebuild_profiles,
+        )
+        return result
+    loan_ids = set(
+        Loan.objects.filter(loan_id__in=df['loan_id'].tolist())
+        .values_list('loan_id', flat=True)
+    )
+    import_loan_frame(df, customer_ids, loan_ids, batch_size, result, rebuild_profiles=rebuild_profiles)
+    return result
+
+def write_loan_chunk(df, batch_size, delta=False):
+    """Result counts of importing one chunk of a checkpointed run"""
+    return import_loan_chunk(df, batch_size, empty_delta_result() if delta else empty_result(), delta)
+
 @shared_task
-def import_loan_data():
-    """Import loan data from Excel file"""
+def import_loan_data(path=None, batch_size=None, stream=False, shard=None, delta=False, checkpoint=False,
+                     import_id=None):
+    """Import loan data from Excel file
+
+    Returns counts of ``inserted`` rows, rows ``skipped`` because the loan ID already
+    exists and ``orphaned`` rows whose customer is unknown. With ``stream`` the file
+    is read and written one batch at a time so memory use does not grow with its size.
+
+    ``shard`` (``[index, count]``) restricts the import to loan IDs with
+    ``loan_id % count == index`` and implies streaming. A customer's loans can then
+    land in several shards, so credit profiles are not touched and must be rebuilt
+    with ``rebuild_credit_profiles`` once every shard has finished.
+
+    With ``delta``, existing loans are updated rather than skipped when their row
+    changed since it was imported, as told by the row's fingerprint; rows are then
+    counted as ``inserted``, ``updated``, ``unchanged``, ``orphaned`` or ``skipped``
+    (repeated IDs).
+
+    ``checkpoint`` and ``import_id`` make the import a resumable ``ImportRun``, as
+    for ``import_customer_data``.
+    """
+    result = empty_delta_result() if delta else empty_result()
     try:
         # Path to the Excel file
-        excel_path = os.path.join(settings.BASE_DIR, 'loan_data.xlsx')
-        
-        # Read Excel file
-        df = pd.read_excel(excel_path)
-        
-        # Normalize column names: lower case, replace spaces with underscores
-        df.columns = [col.strip().lower().replace(' ', '_') for col in df.columns]
-        
-        # Process each row
-        for _, row in df.iterrows():
-            try:
-                # Get customer
-                customer = Customer.objects.get(customer_id=row['customer_id'])
-                
-                # Check if loan already exists
-                if not Loan.objects.filter(loan_id=row['loan_id']).exists():
-                    # Parse dates from 'date_of_approval' and 'end_date'
-                    start_date = pd.to_datetime(row['date_of_approval']).date()
-                    end_date = pd.to_datetime(row['end_date']).date()
-                    
-                    Loan.objects.create(
-                        loan_id=row['loan_id'],
-                        customer=customer,
-                        loan_amount=Decimal(str(row['loan_amount'])),
-                        tenure=row['tenure'],
-                        interest_rate=Decimal(str(row['interest_rate'])),
-                        monthly_repayment=Decimal(str(row['monthly_payment'])),
-                        emis_paid_on_time=row['emis_paid_on_time'],
-                        start_date=start_date,
-                        end_date=end_date,
-                        is_active=True
-                    )
-                    
-            except Customer.DoesNotExist:
-                print(f"Customer {row['customer_id']} not found for loan {row['loan_id']}")
-                continue
-        
-        return f"Successfully imported {len(df)} loans"
-        
+        excel_path = loan_file(path)
+        batch_size = get_batch_size(batch_size)
+
+        if checkpoint or import_id:
+            run = ImportRun.objects.get(pk=import_id) if import_id else open_run('loans', excel_path, delta, batch_size)
+            run = run_import(
+                run, partial(write_loan_chunk, delta=run.delta), LOAN_FINGERPRINT_COLUMNS, LOAN_REQUIRED_COLUMNS,
+                LOAN_NULLABLE_COLUMNS, progress=report_run_progress, task_id=current_task_id(),
+            )
+            reset_sequence(Loan)
+            return run_result(run)
+
+        if stream or shard:
+            for df in iter_frames(excel_path, batch_size):
+                if shard:
+                    df = shard_frame(df, 'loan_id', shard)
+                import_loan_chunk(df, batch_size, result, delta, rebuild_profiles=not shard)
+        elif delta:
+            customer_ids = set(Customer.objects.values_list('customer_id', flat=True))
+            delta_loan_frame(read_sheet(excel_path), customer_ids, stored_fingerprints(Loan), batch_size, result)
+        else:
+            # Fetch existing IDs once instead of a get()/exists() per row
+            customer_ids = set(Customer.objects.values_list('customer_id', flat=True))
+            loan_ids = set(Loan.objects.values_list('loan_id', flat=True))
+            import_loan_frame(read_sheet(excel_path), customer_ids, loan_ids, batch_size, result)
+
+        reset_sequence(Loan)
+        return result
+
     except Exception as e:
-        return f"Error importing loan data: {str(e)}"
+        result['error'] = f"Error importing loan data: {str(e)}"
+        return result
+
+@shared_task
+def rebuild_credit_profiles(shard=None, chunk_size=None):
+    """Rebuild credit profiles in chunks, for every customer or one ``[index, count]`` customer-id shard"""
+    customers = Customer.objects.all()
+    if shard:
+        index, count = shard
+        customers = customers.annotate(shard=Mod('customer_id', count)).filter(shard=index)
+
+    result = {'customers': 0, 'profiles': 0}
+    for customer_count, profile_count in CustomerCreditProfile.rebuild_in_chunks(customers, get_batch_size(chunk_size)):
+        result['customers'] += customer_count
+        result['profiles'] += profile_count
+    return result
+
+@shared_task
+def rescore_portfolio(chunk_size=None, year=None):
+    """Recompute and store the credit score of every customer, one chunk of customers at a time
+
+    Reports ``{'customers', 'total'}`` as PROGRESS state after each chunk.
+    """
+    total = Customer.objects.count()
+    result = {'customers': 0, 'profiles': 0}
+    for customer_count, profile_count in rescore_in_chunks(get_batch_size(chunk_size), year):
+        result['customers'] += customer_count
+        result['profiles'] += profile_count
+        report_progress(customers=result['customers'], total=total)
+    return result
+
+def repayment_file_path(period):
+    """Where month-end posting expects the repayment file of a period"""
+    return os.path.join(settings.REPAYMENT_FILE_DIR, f'{period:%Y-%m}.csv')
+
+@shared_task
+def post_emi_payments(path=None, period=None, chunk_size=None):
+    """Post the EMI payments of a repayment file, by default last month's file
+
+    Safe to re-run for the same period; see ``loans.repayments``.
+    """
+    result = empty_posting_result()
+    try:
+        period = parse_period(period) if period else previous_period()
+        path = path or repayment_file_path(period)
+        result['period'] = f'{period:%Y-%m}'
+        result.update(post_repayment_file(path, period, get_batch_size(chunk_size)))
+        return result
+    except Exception as e:
+        result['error'] = f"Error posting EMI payments: {str(e)}"
+        return result
+
+@shared_task
+def retire_matured_loans(as_of=None, batch_size=None):
+    """Mark active loans whose end date is before ``as_of`` (default today) inactive"""
+    as_of = date.fromisoformat(as_of) if as_of else timezone.localdate()
+    retired = 0
+    for count in retire_matured_in_batches(as_of, get_batch_size(batch_size)):
+        retired += count
+        report_progress(retired=retired)
+    return {'retired': retired}
+
+@shared_task
+def close_month(period=None):
+    """Month-end run: post the period's repayment file, then retire matured loans"""
+    return {'payments': post_emi_payments(period=period), 'maturity': retire_matured_loans()}
+
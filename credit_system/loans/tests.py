@@ -1,3 +1,1256 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import tracemalloc
+from datetime import date, timedelta
+from importlib import import_module
+from decimal import Decimal, localcontext
+
+import numpy as np
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from io import StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from credit_system.admission import AdmissionControlMiddleware, LocalBackend, RedisBackend, stats as admission_stats
+from credit_system.metrics import install_sql_recorder, registry
+from credit_system.profiling import RequestProfilingMiddleware, install_sql_trace, list_captures
+from credit_system.benchmarking import concurrent_create_loans, read_traffic, replay_in_process, write_traffic
+from customers.cache import version_key
+from customers.idempotency import IDEMPOTENCY_HEADER
+from customers.models import Customer
+from . import emi, views
+from .cache import eligibility_cache_stats, eligibility_key, lock_key, stats
+from .emi import monthly_installment, monthly_installments
+from .management.commands.benchmark import regressions
+from .models import CustomerCreditProfile, Loan
+from .views import LOAN_LIST_FIELDS
+from .scoring import rescore_in_chunks
+from .services import CreditScoreService, LoanEligibilityService, LoanOriginationService
+from .repayments import post_repayment_file, previous_period, retire_matured_in_batches
+from .tasks import post_emi_payments, rescore_portfolio, retire_matured_loans
+
+
+def make_customer(**kwargs):
+    defaults = {
+        'first_name': 'Test',
+        'last_name': 'Customer',
+        'age': 30,
+        'phone_number': '9999999999',
+        'monthly_salary': Decimal('100000'),
+        'approved_limit': Decimal('3600000'),
+    }
+    defaults.update(kwargs)
+    return Customer.objects.create(**defaults)
+
+
+def make_loan(customer, **kwargs):
+    defaults = {
+        'loan_amount': Decimal('100000'),
+        'tenure': 12,
+        'interest_rate': Decimal('12.00'),
+        'monthly_repayment': Decimal('8884.88'),
+        'emis_paid_on_time': 12,
+        'start_date': date(2020, 1, 1),
+        'end_date': date(2021, 1, 1),
+        'is_active': False,
+    }
+    defaults.update(kwargs)
+    return Loan.objects.create(customer=customer, **defaults)
+
+
+class CreditScoreQueryBudgetTests(TestCase):
+    """The scoring path must cost a fixed number of queries regardless of loan history size"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer()
+        for _ in range(25):
+            make_loan(cls.customer)
+        make_loan(cls.customer, is_active=True, emis_paid_on_time=3, start_date=date.today())
+
+    def setUp(self):
+        cache.clear()
+
+    def eligibility_payload(self, **kwargs):
+        payload = {
+            'customer_id': self.customer.customer_id,
+            'loan_amount': '50000',
+            'interest_rate': '14',
+            'tenure': 12,
+        }
+        payload.update(kwargs)
+        return payload
+
+    def test_score_components(self):
+        profile = CreditScoreService.get_customer_with_loan_stats(self.customer.customer_id).credit_profile
+        self.assertEqual(profile.loan_count, 26)
+        self.assertEqual(profile.emis_paid_on_time, 25 * 12 + 3)
+        self.assertEqual(profile.emis_expected, 26 * 12)
+        self.assertEqual(profile.last_loan_year, date.today().year)
+        self.assertEqual(profile.active_debt, Decimal('100000'))
+        self.assertEqual(profile.active_emi_total, Decimal('8884.88'))
+        # 29 (on time) + 25 (count) + 25 (current year) + 20 (volume)
+        self.assertEqual(CreditScoreService.calculate_credit_score(self.customer.customer_id), 99)
+
+    def test_score_for_unknown_customer_is_zero(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(CreditScoreService.calculate_credit_score(0), 0)
+
+    def test_check_eligibility_costs_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                reverse('check_eligibility'), self.eligibility_payload(), content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['approval'])
+
+    def test_check_eligibility_budget_independent_of_history(self):
+        for _ in range(25):
+            make_loan(self.customer)
+        with self.assertNumQueries(1):
+            self.client.post(
+                reverse('check_eligibility'), self.eligibility_payload(), content_type='application/json'
+            )
+
+    def test_create_loan_costs_four_queries(self):
+        # Customer row lock, profile read, loan insert, profile delta update
+        with self.assertNumQueries(4):
+            response = self.client.post(
+                reverse('create_loan'), self.eligibility_payload(), content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Loan.objects.filter(loan_id=response.json()['loan_id']).exists())
+
+
+
+@skipUnless(connection.features.has_select_for_update, 'needs row locks (SELECT ... FOR UPDATE)')
+class ConcurrentCreateLoanTests(TransactionTestCase):
+    def test_parallel_creates_never_exceed_approved_limit(self):
+        customer = make_customer(monthly_salary=Decimal('2000000'), approved_limit=Decimal('1000000'))
+        make_loan(customer, start_date=date.today())
+
+        codes, _ = concurrent_create_loans(customer.customer_id, attempts=40, workers=8, loan_amount=100000)
+
+        self.assertEqual(codes, {201: 10, 400: 30})
+        profile = CustomerCreditProfile.objects.get(customer=customer)
+        self.assertEqual(profile.active_debt, Decimal('1000000'))
+        self.assertEqual(Loan.objects.filter(customer=customer, is_active=True).count(), 10)
+
+
+class CreateLoanIdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = make_customer()
+        make_loan(self.customer, start_date=date.today())
+        self.payload = {'customer_id': self.customer.customer_id, 'loan_amount': '100000',
+                        'interest_rate': '20', 'tenure': 12}
+
+    def create(self, key):
+        return self.client.post(reverse('create_loan'), self.payload, content_type='application/json',
+                                headers={IDEMPOTENCY_HEADER: key})
+
+    def test_retry_returns_the_same_loan_without_scoring_again(self):
+        first = self.create('loan-1')
+        with mock.patch.object(LoanOriginationService, 'create_loan', side_effect=AssertionError('scored again')):
+            second = self.create('loan-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(Loan.objects.filter(customer=self.customer, is_active=True).count(), 1)
+
+    def test_failed_request_leaves_no_key(self):
+        with mock.patch.object(LoanOriginationService, 'create_loan', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.create('loan-2')
+
+        self.assertEqual(self.create('loan-2').status_code, 201)
+
+
+@skipUnless(connection.features.has_select_for_update, 'needs concurrent writers')
+class ConcurrentIdempotentCreateLoanTests(TransactionTestCase):
+    def test_concurrent_duplicates_wait_for_the_first(self):
+        customer = make_customer()
+        make_loan(customer, start_date=date.today())
+        payload = json.dumps({'customer_id': customer.customer_id, 'loan_amount': '100000',
+                              'interest_rate': '20', 'tenure': 12})
+        start = threading.Barrier(8)
+
+        def post():
+            client = Client()
+            start.wait()
+            try:
+                return client.post(reverse('create_loan'), payload, content_type='application/json',
+                                   headers={IDEMPOTENCY_HEADER: 'same'}).json()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(lambda _: post(), range(8)))
+
+        self.assertEqual(len({response['loan_id'] for response in responses}), 1)
+        self.assertEqual(Loan.objects.filter(customer=customer, is_active=True).count(), 1)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        # The test database connection is opened before any middleware is loaded
+        install_sql_recorder(connection)
+        self.customer = make_customer()
+        self.loan = make_loan(self.customer)
+
+    def test_server_timing_header_counts_queries(self):
+        response = self.client.get(reverse('view_loan', args=[self.loan.loan_id]))
+
+        timing = response['Server-Timing']
+        self.assertIn('sql;dur=', timing)
+        self.assertIn('desc="1 queries"', timing)
+        self.assertRegex(timing, r'serialize;dur=\d+\.\d+, total;dur=\d+\.\d+$')
+
+    def test_serialize_timing_covers_row_conversion_but_not_sql(self):
+        def slow_item(row):
+            time.sleep(0.05)
+            return loan_list_item(row)
+
+        loan_list_item = views.loan_list_item
+        make_loan(self.customer, is_active=True)
+        make_loan(self.customer, is_active=True)
+        with mock.patch.object(views, 'loan_list_item', side_effect=slow_item):
+            response = self.client.get(reverse('view_customer_loans', args=[self.customer.customer_id]))
+
+        timing = dict(re.findall(r'(\w+);dur=([\d.]+)', response['Server-Timing']))
+        self.assertGreaterEqual(float(timing['serialize']), 100)
+        self.assertLess(float(timing['sql']), 100)
+
+    def test_async_view_queries_are_counted(self):
+        response = async_to_sync(self.async_client.get)(reverse('view_loan_async', args=[self.loan.loan_id]))
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+    def test_metrics_endpoint_exposes_histograms_per_url_name(self):
+        for _ in range(3):
+            self.client.get(reverse('view_customer_loans', args=[self.customer.customer_id]))
+
+        body = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_count{endpoint="view_customer_loans"} 3', body)
+        self.assertIn('http_request_sql_queries_bucket{endpoint="view_customer_loans",le="2"} 3', body)
+        self.assertIn('http_request_sql_queries_sum{endpoint="view_customer_loans"} 6.0', body)
+        self.assertIn('http_responses_total{endpoint="view_customer_loans",method="GET",status="200"} 3', body)
+        self.assertNotIn('endpoint="metrics"', body)
+
+    @override_settings(METRICS_ALLOWED_IPS=['127.0.0.1'], METRICS_TOKEN='secret')
+    def test_metrics_endpoint_needs_an_allowed_address_or_the_token(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        remote = Client(REMOTE_ADDR='203.0.113.9')
+        self.assertEqual(remote.get(url).status_code, 403)
+        self.assertEqual(remote.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(remote.get(url, HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(remote.get(url, HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    @override_settings(REQUEST_BUDGET_QUERIES=1, REQUEST_BUDGET_SLOWEST_STATEMENTS=2)
+    def test_requests_over_budget_are_logged_with_slowest_statements(self):
+        with self.assertLogs('credit_system.metrics', 'WARNING') as logs:
+            self.client.get(reverse('view_customer_loans', args=[self.customer.customer_id]))
+            self.client.get(reverse('view_loan', args=[self.loan.loan_id]))
+
+        self.assertEqual(len(logs.records), 1)
+        message = logs.records[0].getMessage()
+        self.assertIn('(view_customer_loans) over budget: 2 queries', message)
+        self.assertEqual(message.count(' ms: SELECT'), 2)
+
+
+class RequestProfilingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.customer = make_customer()
+        make_loan(self.customer)
+        self.payload = {'customer_id': self.customer.customer_id, 'loan_amount': '100000',
+                        'interest_rate': '10', 'tenure': 12}
+
+    def profiling(self, **overrides):
+        options = {'REQUEST_PROFILING_ENABLED': True, 'REQUEST_PROFILING_TOKEN': 'secret',
+                   'REQUEST_PROFILING_SAMPLE_RATE': 0, 'REQUEST_PROFILING_DIR': self.tmp.name,
+                   'REQUEST_PROFILING_KEEP': 100}
+        options.update(overrides)
+        return self.settings(**options)
+
+    def check_eligibility(self, **headers):
+        return self.client.post(reverse('check_eligibility'), self.payload, content_type='application/json',
+                                headers=headers)
+
+    def test_disabled_profiling_ignores_the_header(self):
+        with self.profiling(REQUEST_PROFILING_ENABLED=False):
+            response = self.check_eligibility(**{'X-Profile-Token': 'secret'})
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_only_the_right_token_profiles_a_request(self):
+        with self.profiling():
+            response = self.check_eligibility(**{'X-Profile-Token': 'secret'})
+            self.assertNotIn('X-Profile-Id', self.check_eligibility())
+            self.assertNotIn('X-Profile-Id', self.check_eligibility(**{'X-Profile-Token': 'wrong'}))
+
+        self.assertEqual(response.status_code, 200)
+        captures = list_captures(self.tmp.name)
+        self.assertEqual([capture['id'] for capture in captures], [response['X-Profile-Id']])
+        self.assertEqual(captures[0]['endpoint'], 'check_eligibility')
+        self.assertFalse(captures[0]['sampled'])
+        self.assertTrue(captures[0]['queries'])
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, f"{captures[0]['id']}.prof")))
+
+    def test_overlapping_requests_are_not_profiled_together(self):
+        entered, release = threading.Event(), threading.Event()
+
+        def view(request):
+            if request.path == '/first':
+                entered.set()
+                release.wait(5)
+            return HttpResponse()
+
+        factory = RequestFactory(headers={'X-Profile-Token': 'secret'})
+        with self.profiling(), ThreadPoolExecutor(1) as pool:
+            middleware = RequestProfilingMiddleware(view)
+            first = pool.submit(middleware, factory.get('/first'))
+            entered.wait(5)
+            second = middleware(factory.get('/second'))
+            release.set()
+            first = first.result()
+            third = middleware(factory.get('/third'))
+
+        self.assertIn('X-Profile-Id', first)
+        self.assertNotIn('X-Profile-Id', second)
+        self.assertIn('X-Profile-Id', third)
+        self.assertEqual(len(list_captures(self.tmp.name)), 2)
+
+    async def test_overlapping_async_requests_are_not_profiled_together(self):
+        release = asyncio.Event()
+
+        async def view(request):
+            if request.path == '/first':
+                await release.wait()
+            return HttpResponse()
+
+        async def second():
+            response = await middleware(factory.get('/second'))
+            release.set()
+            return response
+
+        factory = RequestFactory(headers={'X-Profile-Token': 'secret'})
+        with self.profiling():
+            middleware = RequestProfilingMiddleware(view)
+            first, second = await asyncio.gather(middleware(factory.get('/first')), second())
+
+        self.assertIn('X-Profile-Id', first)
+        self.assertNotIn('X-Profile-Id', second)
+
+    async def test_async_views_are_profiled_without_a_thread_hop(self):
+        async def view(request):
+            return None
+
+        # The test database connection predates the middleware, so connection_created
+        # never installed the SQL trace on it
+        await sync_to_async(install_sql_trace)(connection)
+
+        with self.profiling():
+            self.assertTrue(iscoroutinefunction(RequestProfilingMiddleware(view)))
+            response = await self.async_client.get(
+                reverse('view_customer_loans_async', args=[self.customer.customer_id]),
+                headers={'X-Profile-Token': 'secret'},
+            )
+
+        self.assertEqual(response.status_code, 200)
+        captures = await sync_to_async(list_captures)(self.tmp.name)
+        self.assertEqual([capture['id'] for capture in captures], [response['X-Profile-Id']])
+        self.assertEqual(captures[0]['endpoint'], 'view_customer_loans_async')
+        self.assertTrue(captures[0]['queries'])
+
+    def test_sampled_captures_rotate(self):
+        with self.profiling(REQUEST_PROFILING_SAMPLE_RATE=1, REQUEST_PROFILING_KEEP=2):
+            ids = [self.check_eligibility()['X-Profile-Id'] for _ in range(3)]
+
+        self.assertEqual([capture['id'] for capture in list_captures(self.tmp.name)], ids[:0:-1])
+        self.assertEqual(len(os.listdir(self.tmp.name)), 4)
+
+    def test_summary_shows_services_first(self):
+        with self.profiling():
+            capture_id = self.check_eligibility(**{'X-Profile-Token': 'secret'})['X-Profile-Id']
+
+        out = StringIO()
+        call_command('profiles', capture_id, dir=self.tmp.name, stdout=out)
+
+        summary = out.getvalue()
+        focus = summary.split('Hottest in loans.services and DRF serialization')[1].split('Hottest in')[0]
+        self.assertIn(os.path.join('loans', 'services.py'), focus)
+        self.assertIn('Slowest SQL statements', summary)
+
+
+@override_settings(ALLOWED_HOSTS=['localhost'])
+class BenchmarkReplayTests(TransactionTestCase):
+    def test_replay_reports_queries_per_endpoint(self):
+        customer = make_customer()
+        loan = make_loan(customer)
+        traffic = [
+            ('GET', reverse('view_loan', args=[loan.loan_id]), None),
+            ('GET', reverse('view_customer_loans', args=[customer.customer_id]), None),
+        ]
+
+        result = replay_in_process(traffic, concurrency=1, total=6)
+
+        self.assertEqual(result['requests'], 6)
+        self.assertEqual(result['statuses'], {200: 6})
+        self.assertEqual(result['endpoints']['view_loan']['requests'], 3)
+        self.assertEqual(result['endpoints']['view_loan']['queries_per_request'], 1)
+        self.assertEqual(result['endpoints']['view_customer_loans']['queries_per_request'], 2)
+
+    def test_concurrent_replay_loses_no_counts(self):
+        customer = make_customer()
+        loan = make_loan(customer)
+        traffic = [('GET', reverse('view_loan', args=[loan.loan_id]), None)]
+
+        result = replay_in_process(traffic, concurrency=4, total=200)
+
+        self.assertEqual(result['requests'], 200)
+        self.assertEqual(result['endpoints']['view_loan']['queries_per_request'], 1)
+
+    def test_read_traffic_skips_non_request_lines(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as traffic_file:
+            self.addCleanup(os.unlink, traffic_file.name)
+        write_traffic(traffic_file.name, [('POST', '/check-eligibility/', {'customer_id': 1})])
+        with open(traffic_file.name, 'a') as traffic:
+            traffic.write('{"request_id": "user-001", "title": "not traffic"}\nnot json\n')
+
+        requests, skipped = read_traffic(traffic_file.name)
+
+        self.assertEqual(requests, [('POST', '/check-eligibility/', {'customer_id': 1})])
+        self.assertEqual(skipped, 2)
+
+    def test_regressions_past_threshold(self):
+        baseline = {'requests_per_second': 100, 'p95_ms': 10, 'queries_per_request': 2,
+                    'endpoints': {'view_loan': {'requests_per_second': 50, 'p95_ms': 5, 'queries_per_request': 1}}}
+        result = {'requests_per_second': 95, 'p95_ms': 12, 'queries_per_request': 2,
+                  'endpoints': {'view_loan': {'requests_per_second': 30, 'p95_ms': 5, 'queries_per_request': 2}}}
+
+        found = regressions(result, baseline, threshold=10)
+
+        self.assertEqual([line.split(':')[0] for line in found],
+                         ['overall p95_ms', 'view_loan requests_per_second', 'view_loan queries_per_request'])
+
+
+class CustomerCreditProfileTests(TestCase):
+    def setUp(self):
+        self.customer = make_customer()
+
+    def assertProfileMatchesLoans(self):
+        maintained = CustomerCreditProfile.objects.get(customer=self.customer)
+        CustomerCreditProfile.rebuild([self.customer.customer_id])
+        rebuilt = CustomerCreditProfile.objects.get(customer=self.customer)
+        for field in (*CustomerCreditProfile.DELTA_FIELDS, 'last_loan_year'):
+            self.assertEqual(getattr(maintained, field), getattr(rebuilt, field), field)
+        return maintained
+
+    def test_create_updates_profile(self):
+        make_loan(self.customer, is_active=True)
+        make_loan(self.customer, start_date=date(2022, 5, 1))
+        profile = self.assertProfileMatchesLoans()
+        self.assertEqual(profile.loan_count, 2)
+        self.assertEqual(profile.active_debt, Decimal('100000'))
+        self.assertEqual(profile.total_loan_volume, Decimal('200000'))
+        self.assertEqual(profile.last_loan_year, 2022)
+
+    def test_update_and_deactivate_apply_deltas(self):
+        loan = make_loan(self.customer, is_active=True, emis_paid_on_time=2)
+        loan.emis_paid_on_time = 5
+        loan.save()
+        self.assertEqual(self.assertProfileMatchesLoans().emis_paid_on_time, 5)
+
+        loan = Loan.objects.get(pk=loan.pk)
+        loan.is_active = False
+        loan.save()
+        profile = self.assertProfileMatchesLoans()
+        self.assertEqual(profile.active_debt, Decimal('0'))
+        self.assertEqual(profile.active_emi_total, Decimal('0'))
+
+    def test_start_date_change_recomputes_last_year(self):
+        make_loan(self.customer, start_date=date(2019, 1, 1))
+        loan = make_loan(self.customer, start_date=date(2023, 1, 1))
+        loan.start_date = date(2018, 1, 1)
+        loan.save()
+        self.assertEqual(self.assertProfileMatchesLoans().last_loan_year, 2019)
+
+    def test_delete_removes_contribution(self):
+        loan = make_loan(self.customer)
+        loan.delete()
+        self.assertFalse(CustomerCreditProfile.objects.filter(customer=self.customer).exists())
+
+    def test_rebuild_command_repairs_drift(self):
+        make_loan(self.customer, is_active=True)
+        CustomerCreditProfile.objects.filter(customer=self.customer).update(active_debt=0, loan_count=7)
+        call_command('rebuild_credit_profiles', chunk_size=1, stdout=StringIO())
+        profile = CustomerCreditProfile.objects.get(customer=self.customer)
+        self.assertEqual(profile.active_debt, Decimal('100000'))
+        self.assertEqual(profile.loan_count, 1)
+
+
+
+class CreditProfileBackfillTests(TransactionTestCase):
+    """Migration 0002 builds the profiles of customers whose loans predate it"""
+
+    def migrate(self, *targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        targets = [*targets, *executor.loader.graph.leaf_nodes('customers')]
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_existing_loans_get_profiles(self):
+        apps = self.migrate(('loans', '0001_initial'))
+        self.addCleanup(self.migrate, *MigrationExecutor(connection).loader.graph.leaf_nodes('loans'))
+        Customer = apps.get_model('customers', 'Customer')
+        HistoricalLoan = apps.get_model('loans', 'Loan')
+        customers = [
+            Customer.objects.create(first_name='Test', last_name='Customer', age=30, phone_number='9999999999',
+                                    monthly_salary=100000, approved_limit=3600000)
+            for _ in range(3)
+        ]
+        for customer, year, active in [(customers[0], 2020, True), (customers[0], 2023, False), (customers[2], 2021, True)]:
+            HistoricalLoan.objects.create(
+                customer=customer, loan_amount=100000, tenure=12, interest_rate=12, monthly_repayment='8884.88',
+                emis_paid_on_time=10, start_date=date(year, 1, 1), end_date=date(year + 1, 1, 1), is_active=active,
+            )
+
+        backfill = import_module('loans.migrations.0002_customercreditprofile')
+        with mock.patch.object(backfill, 'BACKFILL_CHUNK_SIZE', 1):
+            apps = self.migrate(('loans', '0002_customercreditprofile'))
+
+        profiles = apps.get_model('loans', 'CustomerCreditProfile').objects.in_bulk()
+        self.assertEqual(sorted(profiles), [customers[0].pk, customers[2].pk])
+        first = profiles[customers[0].pk]
+        self.assertEqual((first.loan_count, first.emis_paid_on_time, first.emis_expected), (2, 20, 24))
+        self.assertEqual((first.active_debt, first.total_loan_volume), (Decimal('100000'), Decimal('200000')))
+        self.assertEqual((first.active_emi_total, first.last_loan_year), (Decimal('8884.88'), 2023))
+        self.assertEqual(profiles[customers[2].pk].active_debt, Decimal('100000'))
+
+
+class ViewCustomerLoansTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer()
+        cls.loans = [make_loan(cls.customer, is_active=True, emis_paid_on_time=index) for index in range(7)]
+        make_loan(cls.customer)  # inactive loans are not listed
+
+    def get(self, **params):
+        return self.client.get(reverse('view_customer_loans', args=[self.customer.customer_id]), params)
+
+    def test_plain_list_is_unchanged(self):
+        response = self.get()
+        self.assertEqual(len(response.json()), 7)
+        self.assertEqual(response.json()[0], {
+            'loan_id': self.loans[0].loan_id,
+            'loan_amount': '100000.00',
+            'interest_rate': '12.00',
+            'monthly_installment': '8884.88',
+            'repayments_left': 12,
+        })
+
+    def test_keyset_pages_cover_every_loan_once(self):
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 3, **({'cursor': cursor} if cursor else {})}
+            with self.assertNumQueries(2):
+                page = self.get(**params).json()
+            seen += [loan['loan_id'] for loan in page['results']]
+            cursor = page['next']
+            if cursor is None:
+                break
+        self.assertEqual(seen, [loan.loan_id for loan in self.loans])
+        self.assertEqual(self.get(limit=0).status_code, 400)
+        self.assertEqual(self.get(cursor='abc').status_code, 400)
+
+    def test_stream_matches_plain_list(self):
+        response = self.get(stream=1)
+        self.assertTrue(response.streaming)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), self.get().json())
+
+    def test_stream_memory_does_not_grow_with_loan_count(self):
+        def streamed_peak():
+            with self.settings(VIEW_LOANS_STREAM_CHUNK_SIZE=200):
+                response = self.get(stream=1)
+            tracemalloc.start()
+            try:
+                size = sum(len(chunk) for chunk in response.streaming_content)
+                return size, tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        template = self.loans[0]
+        Loan.objects.bulk_create(
+            Loan(customer=self.customer, loan_amount=template.loan_amount, tenure=12, interest_rate=template.interest_rate,
+                 monthly_repayment=template.monthly_repayment, start_date=template.start_date, end_date=template.end_date)
+            for _ in range(2000)
+        )
+        small_size, small_peak = streamed_peak()
+        Loan.objects.bulk_create(
+            Loan(customer=self.customer, loan_amount=template.loan_amount, tenure=12, interest_rate=template.interest_rate,
+                 monthly_repayment=template.monthly_repayment, start_date=template.start_date, end_date=template.end_date)
+            for _ in range(18000)
+        )
+        large_size, large_peak = streamed_peak()
+
+        self.assertGreater(large_size, 9 * small_size)
+        self.assertLess(large_peak, 2 * small_peak)
+
+
+
+
+class AsyncReadPathTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer()
+        cls.loans = [make_loan(cls.customer, is_active=True, emis_paid_on_time=index) for index in range(5)]
+
+    def setUp(self):
+        cache.clear()
+
+    async def assertSameAsSync(self, name, args, params=None, method='get'):
+        sync_response = await sync_to_async(getattr(self.client, method))(
+            reverse(name, args=args), params, **({'content_type': 'application/json'} if method == 'post' else {})
+        )
+        async_response = await getattr(self.async_client, method)(
+            reverse(f'{name}_async', args=args), params, **({'content_type': 'application/json'} if method == 'post' else {})
+        )
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.content, sync_response.content)
+        return async_response
+
+    async def test_view_loan(self):
+        await self.assertSameAsSync('view_loan', [self.loans[0].loan_id])
+        await self.assertSameAsSync('view_loan', [0])
+
+    def test_view_loan_joins_customer_in_one_query(self):
+        with self.assertNumQueries(1):
+            async_to_sync(self.async_client.get)(reverse('view_loan_async', args=[self.loans[0].loan_id]))
+
+    async def test_view_customer_loans_modes(self):
+        customer_id = self.customer.customer_id
+        await self.assertSameAsSync('view_customer_loans', [customer_id])
+        await self.assertSameAsSync('view_customer_loans', [customer_id], {'limit': 2, 'cursor': self.loans[1].loan_id})
+        await self.assertSameAsSync('view_customer_loans', [customer_id], {'limit': 'x'})
+        await self.assertSameAsSync('view_customer_loans', [0])
+
+        # Several keyset pages per stream
+        with self.settings(VIEW_LOANS_STREAM_CHUNK_SIZE=2):
+            response = await self.async_client.get(
+                reverse('view_customer_loans_async', args=[customer_id]), {'stream': 1}
+            )
+            streamed = b''.join([chunk async for chunk in response.streaming_content])
+        plain = await sync_to_async(self.client.get)(reverse('view_customer_loans', args=[customer_id]))
+        self.assertEqual(json.loads(streamed), plain.json())
+
+    async def test_check_eligibility(self):
+        payload = {'customer_id': self.customer.customer_id, 'loan_amount': '50000', 'interest_rate': '14', 'tenure': 12}
+        await self.assertSameAsSync('check_eligibility', [], payload, method='post')
+        await self.assertSameAsSync('check_eligibility', [], {**payload, 'customer_id': 0}, method='post')
+        await self.assertSameAsSync('check_eligibility', [], {**payload, 'tenure': 500}, method='post')
+
+
+# Loans generated for the query plan tests; set to 1000000 for a production-sized run
+PLAN_TEST_LOANS = int(os.getenv('LOAN_PLAN_TEST_ROWS', '50000'))
+
+
+class HotQueryPlanTests(TestCase):
+    """EXPLAIN the hot loan queries on a generated dataset and reject full table scans"""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = np.random.default_rng(0)
+        customer_count = max(PLAN_TEST_LOANS // 50, 10)
+        Customer.objects.bulk_create(
+            Customer(customer_id=index, first_name='Plan', last_name='Customer', age=30, phone_number='9999999999',
+                     monthly_salary=Decimal('100000'), approved_limit=Decimal('3600000'))
+            for index in range(1, customer_count + 1)
+        )
+
+        cls.today = date.today()
+        first_day = date(cls.today.year - 10, 1, 1)
+        start_offsets = rng.integers(0, (cls.today - first_day).days, PLAN_TEST_LOANS).tolist()
+        tenures = rng.integers(6, 121, PLAN_TEST_LOANS).tolist()
+        # Matured loans are normally retired; leave a few behind for the sweep to find
+        stale = (rng.random(PLAN_TEST_LOANS) < 0.005).tolist()
+        customer_ids = rng.integers(1, customer_count + 1, PLAN_TEST_LOANS).tolist()
+
+        loans = []
+        for customer_id, offset, tenure, left_active in zip(customer_ids, start_offsets, tenures, stale):
+            start_date = first_day + timedelta(days=offset)
+            end_date = start_date + timedelta(days=tenure * 30)
+            loans.append(Loan(
+                customer_id=customer_id, loan_amount=Decimal('100000'), tenure=tenure, interest_rate=Decimal('12'),
+                monthly_repayment=Decimal('8884.88'), start_date=start_date, end_date=end_date,
+                is_active=end_date >= cls.today or left_active,
+            ))
+        Loan.objects.bulk_create(loans, batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            scans = re.findall(r'Seq Scan on loans\b', plan)
+        else:
+            # SQLite: SEARCH is an index lookup, SCAN walks a whole table or index
+            scans = re.findall(r'\bSCAN loans\b.*', plan)
+        self.assertFalse(scans, f'full scan of loans in plan:\n{plan}')
+
+    def test_customer_active_loans_page(self):
+        self.assertUsesIndex(
+            Loan.objects.active_for_customer(7).filter(loan_id__gt=100)
+            .order_by('loan_id').values_list(*LOAN_LIST_FIELDS)[:101]
+        )
+
+    def test_profile_rebuild_aggregates(self):
+        self.assertUsesIndex(
+            Loan.objects.filter(customer_id__in=range(1, 50)).values('customer_id')
+            .annotate(**CustomerCreditProfile.loan_aggregates()).order_by()
+        )
+
+    def test_matured_active_loans(self):
+        self.assertUsesIndex(Loan.objects.matured(self.today).values_list('loan_id'))
+
+
+class CheckEligibilityBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers = [make_customer() for _ in range(3)]
+        for customer in cls.customers[:2]:
+            make_loan(customer, is_active=True, start_date=date.today())
+
+    def setUp(self):
+        cache.clear()
+
+    def test_matches_single_endpoint_in_input_order(self):
+        payloads = [
+            {'customer_id': customer.customer_id, 'loan_amount': '200000', 'interest_rate': rate, 'tenure': 24}
+            for customer in reversed(self.customers) for rate in ('9', '14')
+        ]
+        payloads.insert(2, {'customer_id': 0, 'loan_amount': '1000', 'interest_rate': '12', 'tenure': 12})
+        payloads.append({'customer_id': self.customers[0].customer_id, 'tenure': 500})
+
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                reverse('check_eligibility_batch'), payloads, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual(len(results), len(payloads))
+        self.assertIn('errors', results[-1])
+
+        for payload, result in zip(payloads[:-1], results):
+            single = self.client.post(reverse('check_eligibility'), payload, content_type='application/json')
+            self.assertEqual(result, single.json())
+
+    def test_rejects_oversized_batch(self):
+        payload = {'customer_id': 1, 'loan_amount': '1000', 'interest_rate': '12', 'tenure': 12}
+        with self.settings(ELIGIBILITY_BATCH_MAX_SIZE=2):
+            response = self.client.post(
+                reverse('check_eligibility_batch'), [payload] * 3, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 400)
+
+
+
+class PortfolioRescoringTests(TestCase):
+    def make_portfolio(self, seed):
+        """Random customers and loans, biased towards the score thresholds"""
+        rng = np.random.default_rng(seed)
+        this_year = date.today().year
+        customers = [
+            make_customer(approved_limit=Decimal(int(rng.choice([0, 100000, 500000, 1000000, 5000000]))))
+            for _ in range(12)
+        ]
+        loans = []
+        for customer in customers:
+            for _ in range(int(rng.choice([0, 1, 2, 3, 4, 5, 7]))):
+                tenure = int(rng.integers(1, 24))
+                loans.append(Loan(
+                    customer=customer,
+                    loan_amount=Decimal(int(rng.choice([33333, 50000, 100000, 250000, 500000]))) + Decimal(
+                        int(rng.choice([0, 0, 1, 99]))) / 100,
+                    tenure=tenure,
+                    interest_rate=Decimal('12'),
+                    monthly_repayment=Decimal('1000'),
+                    emis_paid_on_time=int(rng.integers(0, tenure + 1)),
+                    start_date=date(int(rng.choice([this_year - 2, this_year - 1, this_year])), 1, 1),
+                    end_date=date(this_year + 2, 1, 1),
+                    is_active=bool(rng.random() < 0.5),
+                ))
+        Loan.objects.bulk_create(loans)
+        CustomerCreditProfile.rebuild(customer.customer_id for customer in customers)
+        return customers
+
+    def test_batch_scores_match_per_customer_scores(self):
+        for seed in range(8):
+            with self.subTest(seed=seed):
+                customers = self.make_portfolio(seed)
+                list(rescore_in_chunks(chunk_size=5))
+
+                stored = dict(CustomerCreditProfile.objects.values_list('customer_id', 'credit_score'))
+                for customer in customers:
+                    self.assertEqual(
+                        stored.get(customer.customer_id, 0),
+                        CreditScoreService.calculate_credit_score(customer.customer_id),
+                    )
+
+    def test_task_reports_counts(self):
+        customers = self.make_portfolio(0)
+        make_customer()  # no loans, so no profile
+
+        result = rescore_portfolio(chunk_size=4)
+
+        self.assertEqual(result, {'customers': len(customers) + 1, 'profiles': CustomerCreditProfile.objects.count()})
+        self.assertFalse(CustomerCreditProfile.objects.filter(credit_scored_at__isnull=True).exists())
+
+
+class EligibilityCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        stats.reset()
+        self.customer = make_customer(approved_limit=Decimal('300000'))
+        make_loan(self.customer, start_date=date.today())
+        self.payload = {
+            'customer_id': self.customer.customer_id,
+            'loan_amount': '200000',
+            'interest_rate': '14',
+            'tenure': 12,
+        }
+
+    def check(self, queries, **kwargs):
+        with self.assertNumQueries(queries):
+            response = self.client.post(
+                reverse('check_eligibility'), {**self.payload, **kwargs}, content_type='application/json'
+            )
+        return response.json()
+
+    def test_repeated_poll_is_served_from_cache(self):
+        first = self.check(1)
+        self.assertEqual(self.check(0), first)
+        self.assertEqual(self.check(0, loan_amount='200000.00'), first)
+        self.check(1, tenure=24)
+
+        snapshot = eligibility_cache_stats()
+        self.assertEqual((snapshot['hits'], snapshot['misses']), (2, 2))
+        self.assertEqual(snapshot['hit_rate'], 0.5)
+
+    def test_loan_write_invalidates_after_commit(self):
+        self.assertTrue(self.check(1)['approval'])
+        with self.captureOnCommitCallbacks(execute=True):
+            make_loan(self.customer, is_active=True, start_date=date.today(), loan_amount=Decimal('150000'))
+        result = self.check(1)
+        self.assertFalse(result['approval'])
+        self.assertEqual(result['monthly_installment'], '0.00')
+
+    def test_only_eligibility_fields_invalidate(self):
+        self.check(1)
+        customer = Customer.objects.get(pk=self.customer.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.first_name = 'Renamed'
+            customer.save()
+        self.check(0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.approved_limit = Decimal('100000')
+            customer.save()
+        self.assertFalse(self.check(1)['approval'])
+
+    def test_unknown_customer_is_not_cached(self):
+        self.assertFalse(self.check(1, customer_id=0)['approval'])
+        self.assertFalse(self.check(1, customer_id=0)['approval'])
+
+
+def legacy_monthly_installment(principal, rate, tenure):
+    """The original Loan.calculate_monthly_installment formula"""
+    with localcontext() as ctx:
+        ctx.prec = 10
+        monthly_rate = rate / Decimal('100') / Decimal('12')
+        if monthly_rate == 0:
+            return round(principal / tenure, 2)
+        numerator = principal * monthly_rate * (1 + monthly_rate) ** tenure
+        denominator = ((1 + monthly_rate) ** tenure) - 1
+        return round(numerator / denominator, 2)
+
+
+class EmiEngineTests(TestCase):
+    def test_scalar_matches_legacy_formula_and_keeps_global_context(self):
+        with localcontext() as ctx:
+            ctx.prec = 28
+            loan = Loan(loan_amount=Decimal('100000'), interest_rate=Decimal('12.00'), tenure=12)
+            self.assertEqual(loan.calculate_monthly_installment(), Decimal('8884.88'))
+            self.assertEqual(ctx.prec, 28)
+        self.assertEqual(monthly_installment(Decimal('120000'), Decimal('0'), 12), Decimal('10000.00'))
+
+    def test_vector_matches_scalar_to_the_cent(self):
+        rng = np.random.default_rng(7)
+        count = 20000
+        amounts = np.round(rng.uniform(1000, 5_000_000, count), 2)
+        amounts[::3] = np.round(amounts[::3], -3)
+        rates = np.round(rng.uniform(0, 30, count), 2)
+        rates[::7] = 12
+        rates[::13] = 0
+        tenures = rng.integers(1, 121, count)
+
+        vector = monthly_installments(amounts, rates, tenures)
+        for amount, rate, tenure, actual in zip(amounts.tolist(), rates.tolist(), tenures.tolist(), vector.tolist()):
+            expected = legacy_monthly_installment(Decimal(repr(amount)), Decimal(repr(rate)), tenure)
+            self.assertEqual(Decimal(f'{actual:.2f}'), expected, (amount, rate, tenure))
+            self.assertEqual(monthly_installment(amount, rate, tenure), expected)
+
+    def test_vector_broadcasts_scalars(self):
+        self.assertEqual(monthly_installments([100000, 200000], 12, 12).tolist(), [8884.88, 17769.76])
+
+    def test_annuity_cache_counts_hits_and_evicts_least_recent(self):
+        emi.configure_annuity_cache(2)
+        self.addCleanup(emi.configure_annuity_cache, settings.EMI_ANNUITY_CACHE_SIZE)
+
+        emi.warm_annuity_cache([Decimal('12')], [12, 24])
+        self.assertEqual(monthly_installment(Decimal('100000'), Decimal('12.00'), 12), Decimal('8884.88'))
+        self.assertEqual(monthly_installment(Decimal('50000'), 12, 12), Decimal('4442.44'))
+        self.assertEqual(emi.annuity_cache_info(), {'hits': 2, 'misses': 2, 'maxsize': 2, 'currsize': 2})
+
+        # (12, 24) is evicted by a new pair, and recomputed identically afterwards
+        monthly_installment(Decimal('100000'), Decimal('16'), 36)
+        self.assertEqual(
+            monthly_installment(Decimal('100000'), Decimal('12'), 24),
+            legacy_monthly_installment(Decimal('100000'), Decimal('12'), 24),
+        )
+        self.assertEqual(emi.annuity_cache_info()['misses'], 4)
+
+
+class MonthEndBatchTests(TestCase):
+    def setUp(self):
+        self.customer = make_customer()
+        self.future = date.today() + timedelta(days=365)
+        self.loans = [
+            make_loan(self.customer, emis_paid_on_time=3, end_date=self.future, is_active=True) for _ in range(4)
+        ]
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_file(self, lines):
+        path = os.path.join(self.directory.name, 'repayments.csv')
+        with open(path, 'w') as repayment_file:
+            repayment_file.write('\n'.join(lines) + '\n')
+        return path
+
+    def paid(self):
+        return [Loan.objects.get(pk=loan.pk).emis_paid_on_time for loan in self.loans]
+
+    def test_posting_counts_on_time_payments_once_per_period(self):
+        first, second, third, fourth = (loan.pk for loan in self.loans)
+        path = self.write_file([
+            'Loan ID,Paid On Time', f'{first},true', f'{second},no', f'{first},true', '999999,true', 'oops,true',
+        ])
+
+        result = post_repayment_file(path, '2026-09', chunk_size=2)
+        self.assertEqual(result, {'total': 5, 'on_time': 1, 'late': 1, 'already_posted': 1, 'skipped': 2})
+        self.assertEqual(self.paid(), [4, 3, 3, 3])
+        self.assertEqual(Loan.objects.get(pk=second).last_emi_period, date(2026, 9, 1))
+
+        # Re-running the same period posts nothing new
+        rerun = post_repayment_file(path, '2026-09', chunk_size=2)
+        self.assertEqual((rerun['on_time'], rerun['late'], rerun['already_posted']), (0, 0, 3))
+        self.assertEqual(self.paid(), [4, 3, 3, 3])
+
+        post_repayment_file(self.write_file(['loan_id', str(first), str(third)]), '2026-10', chunk_size=100)
+        self.assertEqual(self.paid(), [5, 3, 4, 3])
+        profile = CustomerCreditProfile.objects.get(customer=self.customer)
+        self.assertEqual(profile.emis_paid_on_time, 15)
+
+    def test_blank_paid_on_time_counts_as_on_time(self):
+        first, second, third, _ = (loan.pk for loan in self.loans)
+        path = self.write_file(['loan_id,paid_on_time', f'{first},', f'{second}, ', f'{third},0'])
+
+        result = post_repayment_file(path, '2026-09', chunk_size=100)
+        self.assertEqual((result['on_time'], result['late']), (2, 1))
+        self.assertEqual(self.paid(), [4, 4, 3, 3])
+
+    def test_task_defaults_to_last_months_file(self):
+        with self.settings(REPAYMENT_FILE_DIR=self.directory.name):
+            path = os.path.join(self.directory.name, f'{previous_period():%Y-%m}.csv')
+            with open(path, 'w') as repayment_file:
+                repayment_file.write(f'loan_id\n{self.loans[0].pk}\n')
+            result = post_emi_payments()
+
+        self.assertEqual(result['period'], f'{previous_period():%Y-%m}')
+        self.assertEqual(result['on_time'], 1)
+        self.assertIn('error', post_emi_payments(period='2001-01'))
+
+    def test_maturity_sweep_retires_in_batches(self):
+        for loan in self.loans[:3]:
+            Loan.objects.filter(pk=loan.pk).update(end_date=date.today() - timedelta(days=1))
+        CustomerCreditProfile.rebuild([self.customer.customer_id])
+
+        self.assertEqual(list(retire_matured_in_batches(date.today(), batch_size=2)), [2, 1])
+        self.assertEqual(Loan.objects.filter(is_active=True).count(), 1)
+        profile = CustomerCreditProfile.objects.get(customer=self.customer)
+        self.assertEqual(profile.active_debt, self.loans[3].loan_amount)
+        self.assertEqual(retire_matured_loans(), {'retired': 0})
+
+
+@override_settings(
+    ADMISSION_CONTROL_ENABLED=True, ADMISSION_BACKEND='local',
+    ADMISSION_LIMITS={'check_eligibility': {'concurrency': 1, 'rate': 1, 'burst': 2}},
+)
+class AdmissionControlTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        admission_stats.reset()
+        self.customer = make_customer()
+        self.payload = {'customer_id': self.customer.customer_id, 'loan_amount': '100000',
+                        'interest_rate': '12', 'tenure': 12}
+
+    def check(self, client):
+        return client.post(reverse('check_eligibility'), self.payload, content_type='application/json')
+
+    def test_clients_over_their_rate_get_429_with_retry_after(self):
+        client = Client()
+        statuses = [self.check(client).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(self.check(client)['Retry-After'], '1')
+
+        # Other clients and unlimited endpoints are not affected
+        self.assertEqual(self.check(Client(REMOTE_ADDR='10.0.0.2')).status_code, 200)
+        response = client.get(reverse('view_customer_loans', args=[self.customer.customer_id]))
+        self.assertEqual(response.status_code, 200)
+
+        body = client.get(reverse('metrics')).content.decode()
+        self.assertIn('admission_admitted_total{endpoint="check_eligibility"} 3', body)
+        self.assertIn('admission_shed_total{endpoint="check_eligibility",reason="rate"} 2', body)
+
+    def test_requests_over_the_concurrency_limit_get_503(self):
+        middleware = AdmissionControlMiddleware(lambda request: None)
+        factory = RequestFactory()
+        requests = []
+        for address in ('10.0.0.1', '10.0.0.2', '10.0.0.3'):
+            request = factory.post(reverse('check_eligibility'), REMOTE_ADDR=address)
+            request.resolver_match = resolve(request.path_info)
+            requests.append(request)
+
+        self.assertIsNone(middleware.process_view(requests[0], None, (), {}))
+        response = middleware.process_view(requests[1], None, (), {})
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '1'))
+
+        middleware.release(requests[0])
+        self.assertIsNone(middleware.process_view(requests[2], None, (), {}))
+        self.assertEqual(admission_stats.shed['check_eligibility', 'concurrency'], 1)
+
+    def test_shed_requests_do_not_spend_tokens_or_hold_slots(self):
+        middleware = AdmissionControlMiddleware(lambda request: None)
+        factory = RequestFactory()
+
+        def request(address):
+            request = factory.post(reverse('check_eligibility'), REMOTE_ADDR=address)
+            request.resolver_match = resolve(request.path_info)
+            return request
+
+        busy = request('10.0.0.1')
+        self.assertIsNone(middleware.process_view(busy, None, (), {}))
+        for _ in range(3):
+            self.assertEqual(middleware.process_view(request('10.0.0.2'), None, (), {}).status_code, 503)
+        middleware.release(busy)
+
+        # The burst of 2 is still there after the 503s, and the 429 frees its slot
+        for expected in (None, None):
+            admitted = request('10.0.0.2')
+            self.assertIs(middleware.process_view(admitted, None, (), {}), expected)
+            middleware.release(admitted)
+        self.assertEqual(middleware.process_view(request('10.0.0.2'), None, (), {}).status_code, 429)
+        self.assertIsNone(middleware.process_view(request('10.0.0.3'), None, (), {}))
+
+    def test_backend_failure_admits_requests(self):
+        with mock.patch.object(LocalBackend, 'take', side_effect=ConnectionError), \
+                self.assertLogs('credit_system.admission', 'WARNING'):
+            self.assertEqual(self.check(Client()).status_code, 200)
+        self.assertEqual(admission_stats.errors, 1)
+
+
+@skipUnless(fakeredis is not None, 'needs fakeredis[lua] (requirements-dev.txt)')
+class RedisAdmissionBackendTests(TestCase):
+    """The Lua scripts of the shared backend, run by fakeredis"""
+
+    def setUp(self):
+        self.now = 1000.0
+        with mock.patch('redis.Redis.from_url', return_value=fakeredis.FakeRedis()) as from_url:
+            self.backend = RedisBackend('redis://redis:6379/0', lease_seconds=30, timeout=0.1)
+        self.from_url = from_url
+        clock = mock.patch('credit_system.admission.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def test_client_has_short_timeouts(self):
+        self.from_url.assert_called_once_with(
+            'redis://redis:6379/0', socket_timeout=0.1, socket_connect_timeout=0.1,
+        )
+
+    def test_token_bucket_takes_and_refills(self):
+        # rate 2/s, burst 3: three tokens, then half a second per token
+        self.assertEqual([self.backend.take('client', 2, 3) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(self.backend.take('client', 2, 3), 0.5)
+        self.assertEqual(self.backend.take('other', 2, 3), 0)
+
+        self.now += 0.5
+        self.assertEqual(self.backend.take('client', 2, 3), 0)
+        self.assertAlmostEqual(self.backend.take('client', 2, 3), 0.5)
+
+        # A long pause refills no more than the burst
+        self.now += 60
+        self.assertEqual([self.backend.take('client', 2, 3) for _ in range(3)], [0, 0, 0])
+        self.assertGreater(self.backend.take('client', 2, 3), 0)
+
+    def test_leases_are_acquired_and_released(self):
+        first = self.backend.acquire('check_eligibility', 2)
+        second = self.backend.acquire('check_eligibility', 2)
+        self.assertTrue(first and second and first != second)
+        self.assertIsNone(self.backend.acquire('check_eligibility', 2))
+        self.assertIsNotNone(self.backend.acquire('check_eligibility_batch', 2))
+
+        self.backend.release('check_eligibility', first)
+        self.assertIsNotNone(self.backend.acquire('check_eligibility', 2))
+        self.assertIsNone(self.backend.acquire('check_eligibility', 2))
+
+    def test_leases_expire(self):
+        self.assertIsNotNone(self.backend.acquire('check_eligibility', 1))
+        self.now += 29
+        self.assertIsNone(self.backend.acquire('check_eligibility', 1))
+        # The holder never released its slot, as when its worker dies
+        self.now += 2
+        self.assertIsNotNone(self.backend.acquire('check_eligibility', 1))
+
+
+class EligibilityCoalescingTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        stats.reset()
+        self.customer = make_customer(approved_limit=Decimal('300000'))
+        make_loan(self.customer, start_date=date.today())
+        self.args = (self.customer.customer_id, Decimal('200000'), Decimal('14'), 12)
+
+    def slow_loader(self, name):
+        """Patch a customer loader of CreditScoreService to stay in flight while other callers arrive"""
+        original = getattr(CreditScoreService, name)
+        if name.startswith('a'):
+            async def load(customer_id):
+                await asyncio.sleep(0.2)
+                return await original(customer_id)
+        else:
+            def load(customer_id):
+                time.sleep(0.2)
+                return original(customer_id)
+        return mock.patch.object(CreditScoreService, name, side_effect=load)
+
+    def check_concurrently(self, callers):
+        """Run ``callers`` identical checks at once; returns (loader calls, results, queries per caller)"""
+        barrier = threading.Barrier(callers)
+
+        def check(_):
+            barrier.wait()
+            try:
+                with CaptureQueriesContext(connection) as captured:
+                    result = LoanEligibilityService.check_eligibility_cached(*self.args)
+                return result, len(captured)
+            finally:
+                connection.close()
+
+        with self.slow_loader('get_customer_with_loan_stats') as loader, ThreadPoolExecutor(callers) as pool:
+            results, queries = zip(*pool.map(check, range(callers)))
+        return loader.call_count, results, queries
+
+    def test_concurrent_identical_checks_share_one_set_of_queries(self):
+        callers = 8
+        loader_calls, results, queries = self.check_concurrently(callers)
+
+        self.assertEqual(loader_calls, 1)
+        # An uncached check is a single query
+        self.assertEqual(sorted(queries), [0] * (callers - 1) + [1])
+        self.assertTrue(all(result == results[0] for result in results))
+        self.assertEqual(eligibility_cache_stats()['coalesced'], callers - 1)
+
+    @override_settings(ELIGIBILITY_CACHE_TIMEOUT=0)
+    def test_checks_are_coalesced_with_the_cache_disabled(self):
+        callers = 8
+        loader_calls, results, queries = self.check_concurrently(callers)
+
+        self.assertEqual(loader_calls, 1)
+        self.assertEqual(sorted(queries), [0] * (callers - 1) + [1])
+        self.assertTrue(all(result == results[0] for result in results))
+        self.assertEqual(eligibility_cache_stats()['coalesced'], callers - 1)
+
+        # Nothing was cached: the next check computes afresh
+        self.assertEqual(self.check_concurrently(1)[0], 1)
+
+    @override_settings(ELIGIBILITY_CACHE_TIMEOUT=0)
+    def test_async_checks_are_coalesced_with_the_cache_disabled(self):
+        async def check_all():
+            return await asyncio.gather(
+                *(LoanEligibilityService.acheck_eligibility_cached(*self.args) for _ in range(5))
+            )
+
+        with self.slow_loader('aget_customer_with_loan_stats') as loader:
+            results = async_to_sync(check_all)()
+            async_to_sync(check_all)()
+
+        self.assertEqual(loader.call_count, 2)
+        self.assertTrue(all(result == results[0] for result in results))
+
+    def test_concurrent_async_checks_share_one_computation(self):
+        async def check_all():
+            return await asyncio.gather(
+                *(LoanEligibilityService.acheck_eligibility_cached(*self.args) for _ in range(5))
+            )
+
+        with self.slow_loader('aget_customer_with_loan_stats') as loader:
+            results = async_to_sync(check_all)()
+
+        self.assertEqual(loader.call_count, 1)
+        self.assertTrue(all(result == results[0] for result in results))
+
+    @override_settings(ELIGIBILITY_SINGLE_FLIGHT_LOCK_SECONDS=5)
+    def test_waits_for_another_process_holding_the_lock(self):
+        expected = LoanEligibilityService.check_eligibility(*self.args)
+        key = eligibility_key(self.customer.customer_id, 1, *self.args[1:])
+        cache.set(version_key(self.customer.customer_id), 1)
+        cache.add(lock_key(key), 1)
+        # The other process stores its result a moment later
+        threading.Timer(0.1, cache.set, [key, (expected, 0.01)]).start()
+
+        with mock.patch.object(CreditScoreService, 'get_customer_with_loan_stats') as loader:
+            result = LoanEligibilityService.check_eligibility_cached(*self.args)
+
+        self.assertEqual(result, expected)
+        loader.assert_not_called()
+        self.assertEqual(eligibility_cache_stats()['coalesced'], 1)
 
-# Create your tests here.
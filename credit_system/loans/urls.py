@@ -3,7 +3,12 @@ from . import views
 
 urlpatterns = [
     path('check-eligibility/', views.check_eligibility, name='check_eligibility'),
+    path('check-eligibility/batch/', views.check_eligibility_batch, name='check_eligibility_batch'),
     path('create-loan/', views.create_loan, name='create_loan'),
     path('view-loan/<int:loan_id>/', views.view_loan, name='view_loan'),
     path('view-loans/<int:customer_id>/', views.view_customer_loans, name='view_customer_loans'),
+    # Async read path for the ASGI deployment
+    path('async/check-eligibility/', views.check_eligibility_async, name='check_eligibility_async'),
+    path('async/view-loan/<int:loan_id>/', views.view_loan_async, name='view_loan_async'),
+    path('async/view-loans/<int:customer_id>/', views.view_customer_loans_async, name='view_customer_loans_async'),
 ] 
\ No newline at end of file
@@ -1,8 +1,17 @@
+import json
+
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from credit_system.metrics import serializing
+from customers.idempotency import idempotent
 from customers.models import Customer
 from .models import Loan
 from .serializers import (
@@ -10,8 +19,7 @@ from .serializers import (
     CreateLoanSerializer, CreateLoanResponseSerializer,
     ViewLoanResponseSerializer, ViewLoansResponseSerializer
 )
-from .services import LoanEligibilityService
-from datetime import datetime, timedelta
+from .services import LoanEligibilityService, LoanOriginationService
 
 # Create your views here.
 
@@ -21,7 +29,7 @@ def check_eligibility(request):
     serializer = CheckEligibilitySerializer(data=request.data)
     if serializer.is_valid():
         data = serializer.validated_data
-        result = LoanEligibilityService.check_eligibility(
+        result = LoanEligibilityService.check_eligibility_cached(
             data['customer_id'],
             data['loan_amount'],
             data['interest_rate'],
@@ -29,10 +37,41 @@ def check_eligibility(request):
         )
         
         response_serializer = CheckEligibilityResponseSerializer(result)
-        return Response(response_serializer.data, status=status.HTTP_200_OK)
+        with serializing():
+            return Response(response_serializer.data, status=status.HTTP_200_OK)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST'])
+def check_eligibility_batch(request):
+    """Check loan eligibility for a list of applications in one request"""
+    applications = request.data
+    max_size = settings.ELIGIBILITY_BATCH_MAX_SIZE
+    if not isinstance(applications, list) or not applications:
+        return Response(
+            {'error': 'Expected a non-empty list of applications'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(applications) > max_size:
+        return Response(
+            {'error': f'Batch size {len(applications)} exceeds the maximum of {max_size}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Validate each item on its own so one bad payload doesn't reject the batch
+    item_serializers = [CheckEligibilitySerializer(data=application) for application in applications]
+    valid = [serializer.validated_data for serializer in item_serializers if serializer.is_valid()]
+    results = LoanEligibilityService.check_eligibility_batch(valid)
+
+    with serializing():
+        results = iter(CheckEligibilityResponseSerializer(results, many=True).data)
+        response_data = [
+            next(results) if not serializer.errors else {'errors': serializer.errors}
+            for serializer in item_serializers
+        ]
+        return Response(response_data, status=status.HTTP_200_OK)
+
+@idempotent('create_loan')
 @api_view(['POST'])
 def create_loan(request):
     """Create a new loan based on eligibility"""
@@ -40,15 +79,15 @@ def create_loan(request):
     if serializer.is_valid():
         data = serializer.validated_data
         
-        # Check eligibility first
-        eligibility_result = LoanEligibilityService.check_eligibility(
+        # Check eligibility and insert under the customer's row lock
+        loan, eligibility_result = LoanOriginationService.create_loan(
             data['customer_id'],
             data['loan_amount'],
             data['interest_rate'],
             data['tenure']
         )
         
-        if not eligibility_result['approval']:
+        if loan is None:
             response_data = {
                 'loan_id': None,
                 'customer_id': data['customer_id'],
@@ -57,67 +96,48 @@ def create_loan(request):
                 'monthly_installment': None
             }
             response_serializer = CreateLoanResponseSerializer(response_data)
-            return Response(response_serializer.data, status=status.HTTP_400_BAD_REQUEST)
+            with serializing():
+                return Response(response_serializer.data, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create the loan
-        try:
-            customer = Customer.objects.get(customer_id=data['customer_id'])
-            loan = Loan.objects.create(
-                customer=customer,
-                loan_amount=data['loan_amount'],
-                tenure=data['tenure'],
-                interest_rate=eligibility_result['corrected_interest_rate'],
-                monthly_repayment=eligibility_result['monthly_installment'],
-                start_date=datetime.now().date(),
-                end_date=(datetime.now() + timedelta(days=data['tenure'] * 30)).date()
-            )
-            
-            response_data = {
-                'loan_id': loan.loan_id,
-                'customer_id': data['customer_id'],
-                'loan_approved': True,
-                'message': 'Loan approved successfully',
-                'monthly_installment': loan.monthly_repayment
-            }
-            response_serializer = CreateLoanResponseSerializer(response_data)
+        response_data = {
+            'loan_id': loan.loan_id,
+            'customer_id': data['customer_id'],
+            'loan_approved': True,
+            'message': 'Loan approved successfully',
+            'monthly_installment': loan.monthly_repayment
+        }
+        response_serializer = CreateLoanResponseSerializer(response_data)
+        with serializing():
             return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-            
-        except Customer.DoesNotExist:
-            response_data = {
-                'loan_id': None,
-                'customer_id': data['customer_id'],
-                'loan_approved': False,
-                'message': 'Customer not found',
-                'monthly_installment': None
-            }
-            response_serializer = CreateLoanResponseSerializer(response_data)
-            return Response(response_serializer.data, status=status.HTTP_400_BAD_REQUEST)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def loan_detail(loan):
+    """Serialize a loan loaded with its customer for the view-loan response"""
+    response_data = {
+        'loan_id': loan.loan_id,
+        'customer': {
+            'customer_id': loan.customer.customer_id,
+            'first_name': loan.customer.first_name,
+            'last_name': loan.customer.last_name,
+            'phone_number': loan.customer.phone_number,
+            'age': loan.customer.age
+        },
+        'loan_amount': loan.loan_amount,
+        'interest_rate': loan.interest_rate,
+        'monthly_installment': loan.monthly_repayment,
+        'tenure': loan.tenure
+    }
+    with serializing():
+        return ViewLoanResponseSerializer(response_data).data
+
 @api_view(['GET'])
 def view_loan(request, loan_id):
     """View loan details by loan ID"""
     try:
-        loan = Loan.objects.get(loan_id=loan_id)
-        
-        response_data = {
-            'loan_id': loan.loan_id,
-            'customer': {
-                'customer_id': loan.customer.customer_id,
-                'first_name': loan.customer.first_name,
-                'last_name': loan.customer.last_name,
-                'phone_number': loan.customer.phone_number,
-                'age': loan.customer.age
-            },
-            'loan_amount': loan.loan_amount,
-            'interest_rate': loan.interest_rate,
-            'monthly_installment': loan.monthly_repayment,
-            'tenure': loan.tenure
-        }
-        
-        response_serializer = ViewLoanResponseSerializer(response_data)
-        return Response(response_serializer.data, status=status.HTTP_200_OK)
+        # The customer comes back in the same query
+        loan = Loan.objects.select_related('customer').get(loan_id=loan_id)
+        return Response(loan_detail(loan), status=status.HTTP_200_OK)
         
     except Loan.DoesNotExist:
         return Response(
@@ -125,28 +145,181 @@ def view_loan(request, loan_id):
             status=status.HTTP_404_NOT_FOUND
         )
 
+# Columns needed to serialize one entry of a customer's loan list
+LOAN_LIST_FIELDS = ('loan_id', 'loan_amount', 'interest_rate', 'monthly_repayment', 'tenure', 'emis_paid_on_time')
+
+# Field objects of ViewLoansResponseSerializer; calling them directly is much cheaper
+# than instantiating a serializer per row
+LOAN_LIST_SERIALIZER_FIELDS = ViewLoansResponseSerializer().fields
+
+def loan_list_item(row):
+    """Serialize a ``LOAN_LIST_FIELDS`` row of an active loan like ViewLoansResponseSerializer"""
+    loan_id, loan_amount, interest_rate, monthly_repayment, tenure, emis_paid_on_time = row
+    values = {
+        'loan_id': loan_id,
+        'loan_amount': loan_amount,
+        'interest_rate': interest_rate,
+        'monthly_installment': monthly_repayment,
+        'repayments_left': max(0, tenure - emis_paid_on_time),
+    }
+    return {name: LOAN_LIST_SERIALIZER_FIELDS[name].to_representation(value) for name, value in values.items()}
+
+def stream_loan_list(rows):
+    """Yield a JSON array of loan list items one row at a time"""
+    yield '['
+    for index, row in enumerate(rows):
+        yield (',' if index else '') + json.dumps(loan_list_item(row), cls=JSONEncoder)
+    yield ']'
+
+def customer_loan_rows(customer_id):
+    """The customer's active loans as ``LOAN_LIST_FIELDS`` rows, in loan ID order"""
+    return (
+        Loan.objects.active_for_customer(customer_id)
+        .order_by('loan_id')
+        .values_list(*LOAN_LIST_FIELDS)
+    )
+
+def loan_page_params(params):
+    """Return ``(limit, cursor)`` from the query string; raises ValueError with a client message"""
+    try:
+        limit = int(params.get('limit', settings.VIEW_LOANS_MAX_PAGE_SIZE))
+        cursor = int(params.get('cursor', 0))
+    except ValueError:
+        raise ValueError('limit and cursor must be integers')
+    if not 1 <= limit <= settings.VIEW_LOANS_MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {settings.VIEW_LOANS_MAX_PAGE_SIZE}')
+    return limit, cursor
+
+def loan_page(page, limit):
+    """Page response from up to ``limit + 1`` rows; the extra row only signals a next page"""
+    next_cursor = str(page[limit - 1][0]) if len(page) > limit else None
+    with serializing():
+        return {'results': [loan_list_item(row) for row in page[:limit]], 'next': next_cursor}
+
 @api_view(['GET'])
 def view_customer_loans(request, customer_id):
-    """View all loans for a customer"""
-    try:
-        customer = Customer.objects.get(customer_id=customer_id)
-        loans = Loan.objects.filter(customer=customer, is_active=True)
-        
-        loans_data = []
-        for loan in loans:
-            loan_data = {
-                'loan_id': loan.loan_id,
-                'loan_amount': loan.loan_amount,
-                'interest_rate': loan.interest_rate,
-                'monthly_installment': loan.monthly_repayment,
-                'repayments_left': loan.repayments_left
-            }
-            loans_data.append(loan_data)
-        
-        return Response(loans_data, status=status.HTTP_200_OK)
-        
-    except Customer.DoesNotExist:
+    """View all active loans for a customer
+
+    ``?limit=N`` returns a page of loans ordered by loan ID plus the ``next`` cursor to
+    pass as ``?cursor=``; ``?stream=1`` streams the full list without building it in memory.
+    """
+    if not Customer.objects.filter(customer_id=customer_id).exists():
         return Response(
             {'error': 'Customer not found'}, 
             status=status.HTTP_404_NOT_FOUND
         )
+
+    rows = customer_loan_rows(customer_id)
+
+    if request.query_params.get('stream') in ('1', 'true'):
+        return StreamingHttpResponse(
+            stream_loan_list(rows.iterator(chunk_size=settings.VIEW_LOANS_STREAM_CHUNK_SIZE)),
+            content_type='application/json',
+        )
+
+    if 'limit' in request.query_params or 'cursor' in request.query_params:
+        try:
+            limit, cursor = loan_page_params(request.query_params)
+        except ValueError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Keyset pagination: fetch one extra row to know whether another page follows
+        page = list(rows.filter(loan_id__gt=cursor)[:limit + 1])
+        return Response(loan_page(page, limit), status=status.HTTP_200_OK)
+
+    rows = list(rows)
+    with serializing():
+        return Response([loan_list_item(row) for row in rows], status=status.HTTP_200_OK)
+
+
+# Async versions of the read endpoints, served under /async/ by the ASGI stack.
+# They return the same JSON as the DRF views above.
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    # Same compact encoding as DRF's JSONRenderer
+    with serializing():
+        return JsonResponse(data, status=status_code, safe=False, encoder=JSONEncoder,
+                            json_dumps_params={'separators': (',', ':')})
+
+async def keyset_chunks_async(rows, chunk_size):
+    """Yield ``LOAN_LIST_FIELDS`` rows in loan ID order, one keyset page of ``chunk_size`` per query
+
+    ``aiterator()`` cannot be used on ``values_list()`` here: Django's
+    ValuesListIterable runs its query as soon as it is created, which
+    ``aiterator()`` does on the event loop thread. ``async for`` runs each page's
+    query in a worker thread instead.
+    """
+    cursor = 0
+    while True:
+        page = [row async for row in rows.filter(loan_id__gt=cursor)[:chunk_size]]
+        for row in page:
+            yield row
+        if len(page) < chunk_size:
+            return
+        cursor = page[-1][0]
+
+async def stream_loan_list_async(rows):
+    """Async version of ``stream_loan_list``"""
+    yield '['
+    index = 0
+    async for row in rows:
+        yield (',' if index else '') + json.dumps(loan_list_item(row), cls=JSONEncoder)
+        index += 1
+    yield ']'
+
+@csrf_exempt
+@require_POST
+async def check_eligibility_async(request):
+    """Check loan eligibility for a customer"""
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return json_response({'detail': 'JSON parse error'}, status.HTTP_400_BAD_REQUEST)
+    serializer = CheckEligibilitySerializer(data=payload)
+    if not serializer.is_valid():
+        return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+    data = serializer.validated_data
+    result = await LoanEligibilityService.acheck_eligibility_cached(
+        data['customer_id'],
+        data['loan_amount'],
+        data['interest_rate'],
+        data['tenure']
+    )
+    with serializing():
+        return json_response(CheckEligibilityResponseSerializer(result).data)
+
+@require_GET
+async def view_loan_async(request, loan_id):
+    """View loan details by loan ID"""
+    try:
+        loan = await Loan.objects.select_related('customer').aget(loan_id=loan_id)
+    except Loan.DoesNotExist:
+        return json_response({'error': 'Loan not found'}, status.HTTP_404_NOT_FOUND)
+    return json_response(loan_detail(loan))
+
+@require_GET
+async def view_customer_loans_async(request, customer_id):
+    """View all active loans for a customer; takes the same parameters as view_customer_loans"""
+    if not await Customer.objects.filter(customer_id=customer_id).aexists():
+        return json_response({'error': 'Customer not found'}, status.HTTP_404_NOT_FOUND)
+
+    rows = customer_loan_rows(customer_id)
+
+    if request.GET.get('stream') in ('1', 'true'):
+        return StreamingHttpResponse(
+            stream_loan_list_async(keyset_chunks_async(rows, settings.VIEW_LOANS_STREAM_CHUNK_SIZE)),
+            content_type='application/json',
+        )
+
+    if 'limit' in request.GET or 'cursor' in request.GET:
+        try:
+            limit, cursor = loan_page_params(request.GET)
+        except ValueError as error:
+            return json_response({'error': str(error)}, status.HTTP_400_BAD_REQUEST)
+        page = [row async for row in rows.filter(loan_id__gt=cursor)[:limit + 1]]
+        return json_response(loan_page(page, limit))
+
+    rows = [row async for row in rows]
+    with serializing():
+        return json_response([loan_list_item(row) for row in rows])